@@ -0,0 +1,324 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Optional
+from sqlalchemy import select
+from dotenv import load_dotenv
+from database import open_read_session
+from models.task import Task, TaskArchive
+
+if TYPE_CHECKING:
+    import numpy as np
+
+load_dotenv()
+# Максимальный возраст снимка в секундах: более старый снимок пересобирается перед ответом
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.getenv("ANALYTICS_MAX_STALENESS_SECONDS", "300"))
+# Сколько строк задач читается из БД за раз при сборке снимка
+ANALYTICS_CHUNK_SIZE = int(os.getenv("ANALYTICS_CHUNK_SIZE", "100000"))
+
+QUADRANTS = ("Q1", "Q2", "Q3", "Q4")
+QUADRANT_INDEX = {quadrant: i for i, quadrant in enumerate(QUADRANTS)}
+
+# Время хранится в минутах от начала эпохи (int32 хватает до 6000 года),
+# отсутствующее значение - минимальное int32.
+# NumPy импортируется в функциях: модуль загружают роутеры и планировщик при старте, а снимок нужен не всегда.
+MISSING = -2 ** 31
+
+# Границы корзин гистограмм в часах
+TIME_TO_COMPLETE_BINS = [0.0, 1.0, 4.0, 12.0, 24.0, 72.0, 168.0, 720.0, float("inf")]
+LATENESS_BINS = [float("-inf"), -168.0, -24.0, -1.0, 0.0, 1.0, 24.0, 168.0, float("inf")]
+
+# Ключи сортировки списка пользователей в GET /admin/analytics
+USER_SORT_KEYS = ("overdue", "tasks", "on_time_rate", "late")
+
+
+# Колонки всех задач (основная таблица и архив) в виде массивов NumPy
+class TaskSnapshot:
+    def __init__(self, user_id, quadrant, completed, created_at, deadline_at, completed_at):
+        self.user_id = user_id
+        self.quadrant = quadrant
+        self.completed = completed
+        self.created_at = created_at
+        self.deadline_at = deadline_at
+        self.completed_at = completed_at
+
+    def __len__(self) -> int:
+        return len(self.user_id)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (
+            self.user_id, self.quadrant, self.completed,
+            self.created_at, self.deadline_at, self.completed_at
+        ))
+
+
+def _to_minutes(value: Optional[datetime]) -> int:
+    if value is None:
+        return MISSING
+    # SQLite возвращает даты без часового пояса - в БД они хранятся в UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp()) // 60
+
+
+def _rows_to_arrays(rows) -> tuple:
+    import numpy as np
+    count = len(rows)
+    return (
+        np.fromiter((row[0] for row in rows), dtype=np.int32, count=count),
+        np.fromiter((QUADRANT_INDEX.get(row[1], -1) for row in rows), dtype=np.int8, count=count),
+        np.fromiter((bool(row[2]) for row in rows), dtype=np.bool_, count=count),
+        np.fromiter((_to_minutes(row[3]) for row in rows), dtype=np.int32, count=count),
+        np.fromiter((_to_minutes(row[4]) for row in rows), dtype=np.int32, count=count),
+        np.fromiter((_to_minutes(row[5]) for row in rows), dtype=np.int32, count=count),
+    )
+
+
+# Потоковая загрузка нужных колонок задач пачками по chunk_size строк
+async def load_snapshot(chunk_size: int = ANALYTICS_CHUNK_SIZE) -> TaskSnapshot:
+    import numpy as np
+    chunks = []
+    session = await open_read_session()
+    async with session:
+        for model in (Task, TaskArchive):
+            stmt = (
+                select(
+                    model.user_id,
+                    model.quadrant,
+                    model.completed,
+                    model.created_at,
+                    model.deadline_at,
+                    model.completed_at
+                )
+                .execution_options(yield_per=chunk_size)
+            )
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                # Преобразование пачки в массивы - вне цикла событий
+                chunks.append(await asyncio.to_thread(_rows_to_arrays, rows))
+
+    if not chunks:
+        empty = _rows_to_arrays([])
+        return TaskSnapshot(*empty)
+    return TaskSnapshot(*[np.concatenate(columns) for columns in zip(*chunks)])
+
+
+def _rate(numerator, denominator):
+    import numpy as np
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1), np.nan)
+
+
+def _optional(value: float) -> Optional[float]:
+    import numpy as np
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+# Статус задачи относительно дедлайна; у задачи ровно один статус
+STATUS_OTHER, STATUS_ON_TIME, STATUS_LATE, STATUS_ON_PLAN, STATUS_OVERDUE = range(5)
+# Код строки = статус * 2 + выполнена
+CODES = 10
+
+
+# Таблица сопряженности "группа x код": один np.bincount вместо отдельного прохода на каждый счетчик
+def _crosstab(group, size: int, code) -> "np.ndarray":
+    import numpy as np
+    keys = group.astype(np.int64) * CODES + code
+    return np.bincount(keys, minlength=size * CODES).reshape(size, CODES)
+
+
+def _counters(table: "np.ndarray") -> dict:
+    by_status = table[:, 0::2] + table[:, 1::2]
+    return {
+        "tasks": table.sum(axis=1),
+        "completed": table[:, 1::2].sum(axis=1),
+        "on_time": by_status[:, STATUS_ON_TIME],
+        "late": by_status[:, STATUS_LATE],
+        "on_plan": by_status[:, STATUS_ON_PLAN],
+        "overdue": by_status[:, STATUS_OVERDUE],
+    }
+
+
+# Число значений (в минутах) с mask в каждой корзине; крайние корзины принимают все значения за границами.
+# Несколько сравнений с границами быстрее np.histogram и выборки по маске для небольшого числа корзин.
+def _histogram(minutes, mask, bins_hours) -> "np.ndarray":
+    import numpy as np
+    size = len(bins_hours) - 1
+    index = np.zeros(len(minutes), dtype=np.int8)
+    for edge in bins_hours[1:-1]:
+        index += (minutes >= np.int32(edge * 60)).view(np.int8)
+    # Значения вне маски - в лишнюю корзину size
+    index *= mask.view(np.int8)
+    index += (~mask).view(np.int8) * np.int8(size)
+    return np.bincount(index, minlength=size + 1)[:size]
+
+
+# Все агрегаты администратора по снимку; now - текущее время в минутах от эпохи
+def compute_aggregates(snapshot: TaskSnapshot, now: int) -> dict:
+    import numpy as np
+    completed = snapshot.completed
+    has_deadline = snapshot.deadline_at != MISSING
+    has_completed_at = snapshot.completed_at != MISSING
+
+    with_dates = completed & has_completed_at & has_deadline
+    pending_with_deadline = ~completed & has_deadline
+    early = snapshot.completed_at <= snapshot.deadline_at
+    before_deadline = snapshot.deadline_at > now
+
+    # Статус без np.where: булевы маски как int8 (флаги взаимоисключающие)
+    status = with_dates.view(np.int8) * (np.int8(STATUS_LATE) - early.view(np.int8))
+    status += pending_with_deadline.view(np.int8) * (np.int8(STATUS_OVERDUE) - before_deadline.view(np.int8))
+    code = status * np.int8(2) + completed.view(np.int8)
+
+    # По квадрантам; неизвестный квадрант (-1) попадает в отдельную последнюю строку
+    quadrant_index = np.where(snapshot.quadrant >= 0, snapshot.quadrant, len(QUADRANTS))
+    by_quadrant = _counters(_crosstab(quadrant_index, len(QUADRANTS) + 1, code)[:len(QUADRANTS)])
+    totals = {name: int(values.sum()) for name, values in by_quadrant.items()}
+
+    # По пользователям: id пользователя служит индексом, поэтому np.unique (сортировка) не нужен
+    user_size = int(snapshot.user_id.max()) + 1 if len(snapshot) else 0
+    per_user = _counters(_crosstab(snapshot.user_id, user_size, code))
+    present = np.flatnonzero(per_user["tasks"])
+    users = {"user_id": present}
+    users.update({name: per_user[name][present] for name in ("tasks", "completed", "on_time", "late", "overdue")})
+    users["on_time_rate"] = _rate(users["on_time"], users["on_time"] + users["late"])
+
+    # Гистограммы времени выполнения и опоздания
+    done = completed & has_completed_at
+    ttc_counts = _histogram(snapshot.completed_at - snapshot.created_at, done, TIME_TO_COMPLETE_BINS)
+    lateness_counts = _histogram(snapshot.completed_at - snapshot.deadline_at, with_dates, LATENESS_BINS)
+
+    def histogram(bins, counts) -> list:
+        return [
+            {"from_hours": None if np.isinf(low) else low,
+             "to_hours": None if np.isinf(high) else high,
+             "count": int(count)}
+            for low, high, count in zip(bins[:-1], bins[1:], counts)
+        ]
+
+    # Когорты по месяцу создания задачи: сначала счетчики по дням (целочисленное деление),
+    # затем дни сворачиваются в месяцы - календарное преобразование только для уникальных дней
+    cohorts = []
+    if len(snapshot):
+        days = snapshot.created_at // (24 * 60)
+        first_day = int(days.min())
+        day_index = days - first_day
+        day_size = int(day_index.max()) + 1
+        per_day = _crosstab(day_index, day_size, code)
+
+        month_of_day = (np.arange(first_day, first_day + day_size).astype("datetime64[D]")
+                        .astype("datetime64[M]").astype(np.int64))
+        first_month = int(month_of_day[0])
+        per_month = np.zeros((int(month_of_day[-1]) - first_month + 1, CODES), dtype=np.int64)
+        np.add.at(per_month, month_of_day - first_month, per_day)
+        per_month = _counters(per_month)
+
+        completion_rate = _rate(per_month["completed"], per_month["tasks"])
+        on_time_rate = _rate(per_month["on_time"], per_month["on_time"] + per_month["late"])
+        for i in np.flatnonzero(per_month["tasks"]):
+            cohorts.append({
+                "month": str(np.datetime64(first_month + int(i), "M")),
+                "created": int(per_month["tasks"][i]),
+                "completed": int(per_month["completed"][i]),
+                "overdue": int(per_month["overdue"][i]),
+                "completion_rate": _optional(completion_rate[i]),
+                "on_time_rate": _optional(on_time_rate[i]),
+            })
+
+    aggregates = {
+        "total_tasks": len(snapshot),
+        "by_quadrant": {quadrant: int(by_quadrant["tasks"][i]) for i, quadrant in enumerate(QUADRANTS)},
+        "by_status": {"completed": totals["completed"], "pending": totals["tasks"] - totals["completed"]},
+        "overdue_by_quadrant": {quadrant: int(by_quadrant["overdue"][i]) for i, quadrant in enumerate(QUADRANTS)},
+        "timing": {
+            "completed_on_time": totals["on_time"],
+            "completed_late": totals["late"],
+            "on_plan_pending": totals["on_plan"],
+            "overtime_pending": totals["overdue"],
+        },
+        "users_count": len(present),
+        "time_to_complete_histogram": histogram(TIME_TO_COMPLETE_BINS, ttc_counts),
+        "lateness_histogram": histogram(LATENESS_BINS, lateness_counts),
+        "cohorts": cohorts,
+    }
+    return {"aggregates": aggregates, "users": users}
+
+
+def top_users(users: dict, sort: str = "overdue", limit: int = 20) -> list:
+    import numpy as np
+    values = users[sort]
+    if sort == "on_time_rate":
+        # Худшие показатели первыми, пользователи без дедлайнов - в конце
+        order = np.argsort(np.where(np.isnan(values), np.inf, values), kind="stable")
+    else:
+        order = np.argsort(-values, kind="stable")
+
+    return [
+        {
+            "user_id": int(users["user_id"][i]),
+            "tasks": int(users["tasks"][i]),
+            "completed": int(users["completed"][i]),
+            "on_time": int(users["on_time"][i]),
+            "late": int(users["late"][i]),
+            "overdue": int(users["overdue"][i]),
+            "on_time_rate": _optional(users["on_time_rate"][i]),
+        }
+        for i in order[:limit]
+    ]
+
+
+# Последний собранный снимок этого процесса (только агрегаты, без массивов задач)
+_state = {"result": None, "built_at": None, "built_monotonic": None, "rows": 0, "build_ms": None}
+_refresh_lock = asyncio.Lock()
+
+
+async def _build_snapshot():
+    started = time.perf_counter()
+    snapshot = await load_snapshot()
+    now = int(time.time()) // 60
+    result = await asyncio.to_thread(compute_aggregates, snapshot, now)
+
+    _state.update(
+        result=result,
+        built_at=datetime.now(timezone.utc),
+        built_monotonic=time.monotonic(),
+        rows=len(snapshot),
+        build_ms=(time.perf_counter() - started) * 1000
+    )
+    print(f"Снимок аналитики собран: {len(snapshot)} задач за {_state['build_ms']:.0f} мс")
+
+
+# Периодическая пересборка из планировщика, чтобы запросы не ждали сборки
+async def refresh_snapshot():
+    async with _refresh_lock:
+        await _build_snapshot()
+
+
+def _snapshot_age() -> Optional[float]:
+    if _state["built_monotonic"] is None:
+        return None
+    return time.monotonic() - _state["built_monotonic"]
+
+
+# Снимок не старше max_staleness секунд; при необходимости пересобирается
+async def get_snapshot(max_staleness: int = ANALYTICS_MAX_STALENESS_SECONDS) -> dict:
+    age = _snapshot_age()
+    if age is None or age > max_staleness:
+        requested = time.monotonic()
+        async with _refresh_lock:
+            # Пока ждали блокировку, снимок мог пересобрать другой запрос
+            if _state["built_monotonic"] is None or _state["built_monotonic"] < requested:
+                await _build_snapshot()
+    return _state
+
+
+def snapshot_info(state: dict) -> dict:
+    return {
+        "built_at": state["built_at"],
+        "age_seconds": round(_snapshot_age() or 0, 1),
+        "rows": state["rows"],
+        "build_ms": round(state["build_ms"] or 0, 1),
+        "max_staleness_seconds": ANALYTICS_MAX_STALENESS_SECONDS,
+    }
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+from sqlalchemy import select, insert, delete, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models.task import Task, TaskArchive
+
+load_dotenv()
+# Через сколько дней после выполнения задача переносится в архив
+TASK_ARCHIVE_AFTER_DAYS = int(os.getenv("TASK_ARCHIVE_AFTER_DAYS", "30"))
+# Сколько задач переносится за одну транзакцию
+TASK_ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "1000"))
+
+# Колонки, общие для tasks и tasks_archive
+TASK_COLUMNS = [column.name for column in TaskArchive.__table__.columns]
+
+
+async def archive_completed_tasks(
+        partition: Optional[int] = None,
+        partitions: int = 1,
+        stats: Optional[dict] = None,
+        older_than_days: int = TASK_ARCHIVE_AFTER_DAYS,
+        batch_size: int = TASK_ARCHIVE_BATCH_SIZE
+) -> dict:
+    if stats is None:
+        stats = {}
+    stats.update(rows_scanned=0, rows_updated=0, batches=0)
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    # Задачи, закрытые через PUT, могут не иметь completed_at - для них берется created_at
+    # Исходная задача действующей серии остается в tasks: по ней создаются повторения
+    conditions = [
+        Task.completed == True,
+        Task.recurrence_next_at.is_(None),
+        or_(
+            Task.completed_at < cutoff,
+            and_(Task.completed_at.is_(None), Task.created_at < cutoff)
+        )
+    ]
+    if partition is not None:
+        conditions.append(Task.user_id % partitions == partition)
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            ids = (await db.execute(
+                select(Task.id).where(*conditions).order_by(Task.id).limit(batch_size)
+            )).scalars().all()
+            if not ids:
+                break
+
+            # Копирование и удаление в одной транзакции
+            await db.execute(
+                insert(TaskArchive).from_select(
+                    TASK_COLUMNS,
+                    select(*[Task.__table__.c[name] for name in TASK_COLUMNS])
+                    .where(Task.id.in_(ids))
+                )
+            )
+            await db.execute(
+                delete(Task)
+                .where(Task.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+            stats["rows_scanned"] += len(ids)
+            stats["rows_updated"] += len(ids)
+            stats["batches"] += 1
+
+    return stats
+
+
+# Выполняет выборку по tasks и, при необходимости, по tasks_archive.
+# build_filters получает модель и возвращает условия для нее.
+async def fetch_tasks(
+        db: AsyncSession,
+        build_filters: Callable[[type], list],
+        include_archive: bool = True
+) -> List:
+    result = await db.execute(select(Task).where(*build_filters(Task)))
+    tasks = list(result.scalars().all())
+
+    if include_archive:
+        result = await db.execute(select(TaskArchive).where(*build_filters(TaskArchive)))
+        tasks.extend(result.scalars().all())
+
+    return tasks
+
+
+async def get_archived_task(db: AsyncSession, task_id: int) -> Optional[TaskArchive]:
+    result = await db.execute(
+        select(TaskArchive).where(TaskArchive.id == task_id)
+    )
+    return result.scalar_one_or_none()
@@ -0,0 +1,115 @@
+# Время расчета агрегатов администратора по снимку NumPy в сравнении с циклом по задачам в Python.
+# Снимок генерируется сразу в виде массивов, БД не нужна.
+#
+#   python benchmarks/analytics_snapshot.py --rows 10000000 --users 100000
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analytics import TaskSnapshot, compute_aggregates, top_users, MISSING  # noqa: E402
+
+
+def make_snapshot(rows: int, users: int, seed: int = 42) -> TaskSnapshot:
+    rng = np.random.default_rng(seed)
+    now = int(time.time()) // 60
+    year = 365 * 24 * 60
+
+    created_at = (now - rng.integers(0, 2 * year, rows)).astype(np.int32)
+    completed = rng.random(rows) < 0.6
+    has_deadline = rng.random(rows) < 0.7
+
+    deadline_at = (created_at + rng.integers(60, 30 * 24 * 60, rows)).astype(np.int32)
+    deadline_at[~has_deadline] = MISSING
+    completed_at = np.minimum(created_at + rng.exponential(3 * 24 * 60, rows).astype(np.int32), now).astype(np.int32)
+    completed_at[~completed] = MISSING
+
+    return TaskSnapshot(
+        user_id=rng.integers(1, users + 1, rows).astype(np.int32),
+        quadrant=rng.integers(0, 4, rows).astype(np.int8),
+        completed=completed,
+        created_at=created_at,
+        deadline_at=deadline_at,
+        completed_at=completed_at,
+    )
+
+
+# То же, что делает compute_aggregates, но циклом по строкам - так считалась статистика раньше
+def python_aggregates(snapshot: TaskSnapshot, now: int, rows: int) -> dict:
+    per_user = {}
+    timing = {"on_time": 0, "late": 0, "on_plan": 0, "overdue": 0}
+    user_id = snapshot.user_id[:rows].tolist()
+    completed = snapshot.completed[:rows].tolist()
+    deadline_at = snapshot.deadline_at[:rows].tolist()
+    completed_at = snapshot.completed_at[:rows].tolist()
+    for i in range(rows):
+        stats = per_user.setdefault(user_id[i], [0, 0, 0, 0])
+        stats[0] += 1
+        if deadline_at[i] == MISSING:
+            continue
+        if completed[i]:
+            if completed_at[i] == MISSING:
+                continue
+            key = "on_time" if completed_at[i] <= deadline_at[i] else "late"
+        else:
+            key = "on_plan" if deadline_at[i] > now else "overdue"
+        timing[key] += 1
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк снимка аналитики")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--python-rows", type=int, default=1_000_000,
+                        help="Сколько строк обработать циклом Python (результат экстраполируется)")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snapshot = make_snapshot(args.rows, args.users)
+    print(f"Снимок: {len(snapshot)} задач, {snapshot.nbytes / 2 ** 20:.0f} МБ "
+          f"(сгенерирован за {time.perf_counter() - started:.1f} с)")
+
+    now = int(time.time()) // 60
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        result = compute_aggregates(snapshot, now)
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    print(f"NumPy: агрегаты за {best * 1000:.0f} мс (лучший из {args.repeat})")
+
+    started = time.perf_counter()
+    top_users(result["users"], "overdue", 20)
+    top_ms = (time.perf_counter() - started) * 1000
+    print(f"NumPy: топ-20 пользователей из {result['aggregates']['users_count']} за {top_ms:.1f} мс")
+
+    python_rows = min(args.python_rows, args.rows)
+    started = time.perf_counter()
+    python_aggregates(snapshot, now, python_rows)
+    python_time = (time.perf_counter() - started) * args.rows / python_rows
+    print(f"Python: только timing и счетчики пользователей ~{python_time * 1000:.0f} мс "
+          f"(по {python_rows} строкам), в {python_time / best:.0f} раз медленнее")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "rows": args.rows,
+                "users": args.users,
+                "snapshot_mb": snapshot.nbytes / 2 ** 20,
+                "numpy_ms": best * 1000,
+                "top_users_ms": top_ms,
+                "python_estimated_ms": python_time * 1000,
+            }, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
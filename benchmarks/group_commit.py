@@ -0,0 +1,113 @@
+# Пропускная способность изменений с отдельным коммитом на каждое и с групповым коммитом.
+# Конкурентные "запросы" создают и выполняют задачи через group_commit.run_in_transaction
+# без HTTP и авторизации, поэтому видна именно цена коммитов. Как и запрос, каждый "клиент" сначала
+# загружает пользователя своей сессией (get_current_user), то есть держит соединение из пула.
+# Нужна отдельная БД. Клиентов больше, чем соединений в пуле PostgreSQL (5 + 10 по умолчанию),
+# проверяет, что группа не ждет соединений, занятых ожидающими ее запросами.
+#
+#   DATABASE_URL=sqlite+aiosqlite:///bench.db SQLITE_SYNCHRONOUS=FULL python benchmarks/group_commit.py --clients 100
+#   DATABASE_URL=postgresql+asyncpg://.../bench python benchmarks/group_commit.py --clients 100
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import insert, select, update, func  # noqa: E402
+from database import init_db, AsyncSessionLocal  # noqa: E402
+from models import User, UserRole, Task  # noqa: E402
+from utils import adjust_task_counters  # noqa: E402
+import group_commit  # noqa: E402
+
+
+async def create_user() -> int:
+    async with AsyncSessionLocal() as db:
+        user_id = (await db.execute(select(func.coalesce(func.max(User.id), 0)))).scalar_one() + 1
+        await db.execute(insert(User).values(
+            id=user_id, nickname=f"group_commit_{user_id}", email=f"group_commit_{user_id}@example.com",
+            hashed_password="-", role=UserRole.USER
+        ))
+        await db.commit()
+        return user_id
+
+
+# Те же изменения, что у POST /tasks/ и PATCH /tasks/{id}/complete: задача и счетчики пользователя
+def create_operation(user_id: int, number: int):
+    async def operation(db):
+        task = Task(title=f"Задача {number}", is_important=False, quadrant="Q4", completed=False, user_id=user_id)
+        db.add(task)
+        await adjust_task_counters(db, user_id, total=1)
+        await db.flush()
+        return task.id
+    return operation
+
+
+def complete_operation(user_id: int, task_id: int):
+    async def operation(db):
+        await db.execute(
+            update(Task)
+            .where(Task.id == task_id, Task.completed == False)
+            .values(completed=True, completed_at=datetime.now(timezone.utc), version=Task.version + 1)
+        )
+        await adjust_task_counters(db, user_id, completed=1)
+    return operation
+
+
+async def run(clients: int, duration: float, user_id: int) -> dict:
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def client(number: int):
+        counter = 0
+        while time.perf_counter() < deadline:
+            counter += 1
+            started = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                await db.get(User, user_id)
+                task_id = await group_commit.run_in_transaction(db, create_operation(user_id, counter))
+            async with AsyncSessionLocal() as db:
+                await db.get(User, user_id)
+                await group_commit.run_in_transaction(db, complete_operation(user_id, task_id))
+            latencies.append((time.perf_counter() - started) / 2)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    elapsed = time.perf_counter() - started
+    await group_commit.stop_group_commit()
+
+    latencies.sort()
+    return {
+        "group_commit": group_commit.GROUP_COMMIT_ENABLED,
+        "operations": len(latencies) * 2,
+        "ops_per_second": round(len(latencies) * 2 / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "stats": group_commit.get_stats() if group_commit.GROUP_COMMIT_ENABLED else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        sys.exit("Укажите DATABASE_URL отдельной БД для бенчмарка")
+    await init_db()
+    user_id = await create_user()
+
+    results = []
+    for enabled in (False, True):
+        group_commit.GROUP_COMMIT_ENABLED = enabled
+        results.append(await run(args.clients, args.duration, user_id))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+# Нагрузочный бенчмарк эндпоинтов /api/v3: приложение вызывается в том же процессе через ASGI
+# (без сети и uvicorn), конкурентные клиенты работают с заранее засеянной локальной БД.
+#
+#   python benchmarks/load.py --users 200 --tasks-per-user 50 --clients 20 --duration 10 --output results.json
+#   python benchmarks/load.py ... --baseline results.json   # сравнение с прошлым запуском
+#   GROUP_COMMIT_ENABLED=true python benchmarks/load.py --scenario writes --clients 100   # групповой коммит
+#
+# По умолчанию используется временная БД SQLite; --database-url задает другую БД (она будет очищена).
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "benchmark"
+
+# Вес эндпоинта в смеси запросов одного клиента
+SCENARIO = {
+    "list": 20,
+    "list_quadrant": 10,
+    "search": 10,
+    "query": 15,
+    "get": 10,
+    "stats": 5,
+    "stats_timing": 5,
+    "create": 10,
+    "update": 5,
+    "complete": 5,
+    "delete": 2,
+}
+# Только частые изменения: создание и выполнение задач (проверка группового коммита)
+WRITE_SCENARIO = {
+    "create": 2,
+    "complete": 1,
+}
+SCENARIOS = {"mixed": SCENARIO, "writes": WRITE_SCENARIO}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+    }
+
+
+# Засевает users пользователей по tasks_per_user задач генератором datagen.py
+async def seed(users: int, tasks_per_user: int, seed_value: int = 42) -> dict:
+    from database import engine, Base
+    from datagen import generate
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+    # Пользователи bench1..benchN с id 1..N и общим паролем
+    result = await generate(
+        users=users,
+        tasks_per_user_mean=tasks_per_user,
+        password=PASSWORD,
+        prefix="bench",
+        seed=seed_value,
+        verbose=False,
+    )
+    return {
+        "users": users,
+        "tasks": result["tasks"],
+        "seconds": result["load_seconds"],
+    }
+
+
+class Client:
+    def __init__(self, http, user_number: int, rng: random.Random, results: dict):
+        self.http = http
+        self.email = f"bench{user_number}@example.com"
+        self.rng = rng
+        self.results = results
+        self.headers = {}
+        self.task_ids = []
+
+    async def call(self, name: str, method: str, url: str, ok=(200, 201), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=self.headers, **kwargs)
+            failed = response.status_code not in ok
+        except Exception:
+            response, failed = None, True
+        elapsed = time.perf_counter() - started
+
+        stats = self.results.setdefault(name, {"latencies": [], "errors": 0})
+        if failed:
+            stats["errors"] += 1
+        else:
+            stats["latencies"].append(elapsed)
+        return None if failed else response
+
+    async def login(self):
+        response = await self.call(
+            "login", "POST", "/api/v3/auth/login",
+            data={"username": self.email, "password": PASSWORD}
+        )
+        if response is None:
+            raise RuntimeError(f"Не удалось войти как {self.email}")
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = await self.http.get(
+            "/api/v3/tasks/query", params={"limit": 200, "sort": "id"}, headers=self.headers
+        )
+        self.task_ids = [task["id"] for task in response.json()["items"]]
+
+    def _task_id(self):
+        return self.rng.choice(self.task_ids) if self.task_ids else None
+
+    async def step(self, name: str):
+        if name == "list":
+            await self.call(name, "GET", "/api/v3/tasks")
+        elif name == "list_quadrant":
+            await self.call(name, "GET", f"/api/v3/tasks/quadrant/{self.rng.choice(['Q1', 'Q2', 'Q3', 'Q4'])}")
+        elif name == "search":
+            await self.call(name, "GET", "/api/v3/tasks/search", params={"q": "задача"})
+        elif name == "query":
+            await self.call(name, "GET", "/api/v3/tasks/query", params={"status": "pending", "sort": "-created_at", "limit": 50})
+        elif name == "stats":
+            await self.call(name, "GET", "/api/v3/stats/")
+        elif name == "stats_timing":
+            await self.call(name, "GET", "/api/v3/stats/timing")
+        elif name == "create":
+            response = await self.call(name, "POST", "/api/v3/tasks/", json={
+                "title": f"Новая задача {self.rng.randint(1, 10 ** 6)}",
+                "is_important": self.rng.random() < 0.5,
+            })
+            if response is not None:
+                self.task_ids.append(response.json()["id"])
+        else:
+            task_id = self._task_id()
+            if task_id is None:
+                return
+            if name == "get":
+                await self.call(name, "GET", f"/api/v3/tasks/{task_id}", ok=(200, 404))
+            elif name == "update":
+                await self.call(name, "PUT", f"/api/v3/tasks/{task_id}", ok=(200, 404, 409),
+                                json={"title": f"Изменено {self.rng.randint(1, 10 ** 6)}"})
+            elif name == "complete":
+                await self.call(name, "PATCH", f"/api/v3/tasks/{task_id}/complete", ok=(200, 404, 409))
+            elif name == "delete":
+                self.task_ids.remove(task_id)
+                await self.call(name, "DELETE", f"/api/v3/tasks/{task_id}", ok=(200, 404))
+
+
+# Возвращает результаты по эндпоинтам и время нагрузки; вход всех клиентов измеряется отдельно
+async def run_load(users: int, clients: int, duration: float, seed_value: int, scenario: dict = SCENARIO) -> tuple:
+    import httpx
+    import main
+
+    login_results = {}
+    results = {}
+    rng = random.Random(seed_value)
+    names = list(scenario)
+    weights = [scenario[name] for name in names]
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as http:
+        workers = [
+            Client(http, rng.randint(1, users), random.Random(seed_value + i), login_results)
+            for i in range(clients)
+        ]
+        started = time.perf_counter()
+        await asyncio.gather(*(worker.login() for worker in workers))
+        login_elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.results = results
+
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+
+        async def loop(worker: Client):
+            while time.perf_counter() < deadline:
+                await worker.step(worker.rng.choices(names, weights)[0])
+
+        await asyncio.gather(*(loop(worker) for worker in workers))
+        elapsed = time.perf_counter() - started
+
+    return results, elapsed, login_results["login"], login_elapsed
+
+
+async def run_scheduler(repeat: int) -> dict:
+    from scheduler import JOBS
+
+    results = {}
+    for job_id in ("update_urgency", "rollup_completions"):
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await JOBS[job_id]()
+            latencies.append(time.perf_counter() - started)
+        results[f"scheduler_{job_id}"] = summarize(latencies, 0, sum(latencies))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"{'эндпоинт':<32}{'запросов':>9}{'ошибок':>8}{'rps':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}")
+    for name, row in report["endpoints"].items():
+        line = (
+            f"{name:<32}{row['requests']:>9}{row['errors']:>8}{row['throughput_rps']:>9}"
+            f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+        )
+        previous = (baseline or {}).get("endpoints", {}).get(name)
+        if previous and previous["p95_ms"]:
+            change = (row["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+            line += f"   p95 {change:+.0%} к {baseline['commit']}"
+        print(line)
+    total = report["total"]
+    print(f"Всего: {total['requests']} запросов, {total['throughput_rps']} rps, p95 {total['p95_ms']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк API")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--tasks-per-user", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=10, help="Число конкурентных клиентов")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность нагрузки в секундах")
+    parser.add_argument("--scheduler-runs", type=int, default=3, help="Сколько раз запустить задачи планировщика")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed", help="Смесь запросов клиентов")
+    parser.add_argument("--database-url", help="БД для бенчмарка (будет очищена); по умолчанию временный SQLite")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения p95")
+    args = parser.parse_args()
+
+    # Настройки задаются до импорта приложения: database.py читает их при импорте
+    database_url = args.database_url
+    if database_url is None:
+        database_url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("DB_INIT_MODE", "create_all")
+    # Все клиенты приходят с одного адреса - лимит входа по IP их бы отсек
+    os.environ.setdefault("AUTH_LOGIN_IP_RATE", "0")
+    # Все клиенты входят одновременно, очередь на bcrypt не должна отклонять их по таймауту
+    os.environ.setdefault("PASSWORD_HASH_QUEUE_TIMEOUT", "300")
+
+    async def run():
+        seeded = await seed(args.users, args.tasks_per_user, args.seed)
+        print(f"Засеяно {seeded['users']} пользователей и {seeded['tasks']} задач за {seeded['seconds']} с")
+
+        results, elapsed, login, login_elapsed = await run_load(
+            args.users, args.clients, args.duration, args.seed, SCENARIOS[args.scenario]
+        )
+        endpoints = {"login": summarize(login["latencies"], login["errors"], login_elapsed)}
+        endpoints.update(
+            (name, summarize(stats["latencies"], stats["errors"], elapsed))
+            for name, stats in sorted(results.items())
+        )
+        endpoints.update(await run_scheduler(args.scheduler_runs))
+
+        all_latencies = [value for stats in results.values() for value in stats["latencies"]]
+        all_errors = sum(stats["errors"] for stats in results.values())
+        return seeded, endpoints, summarize(all_latencies, all_errors, elapsed)
+
+    seeded, endpoints, total = asyncio.run(run())
+
+    from sqlalchemy.engine import make_url
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": make_url(database_url).get_backend_name(),
+        "params": {
+            "users": args.users,
+            "tasks_per_user": args.tasks_per_user,
+            "clients": args.clients,
+            "duration": args.duration,
+            "seed": args.seed,
+            "scenario": SCENARIOS[args.scenario],
+            "group_commit": os.getenv("GROUP_COMMIT_ENABLED", "false").lower() == "true",
+        },
+        "seed": seeded,
+        "endpoints": endpoints,
+        "total": total,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Сравнение размера и времени кодирования списка задач в разных форматах ответа.
+#
+#   python benchmarks/payload_formats.py --tasks 5000
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from schemas import TaskResponse  # noqa: E402
+from task_formats import tasks_to_rows, tasks_to_columns, encode_json, msgpack, encode_msgpack  # noqa: E402
+from compression import zstandard, GZIP_LEVEL, ZSTD_LEVEL  # noqa: E402
+
+
+def make_tasks(count: int):
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    tasks = []
+    for i in range(count):
+        deadline = now + timedelta(days=rng.randint(-10, 30)) if rng.random() < 0.7 else None
+        completed = rng.random() < 0.4
+        tasks.append(TaskResponse(
+            id=i + 1,
+            title=f"Задача номер {i}",
+            description="Описание задачи " * rng.randint(0, 5) or None,
+            is_important=rng.random() < 0.5,
+            deadline_at=deadline,
+            quadrant=rng.choice(["Q1", "Q2", "Q3", "Q4"]),
+            completed=completed,
+            created_at=now - timedelta(days=rng.randint(0, 365)),
+            completed_at=now if completed else None,
+            is_urgent=rng.random() < 0.3,
+            days_until_deadline=(deadline - now).days if deadline else None,
+        ))
+    return tasks
+
+
+def measure(encode, repeat: int):
+    best = None
+    body = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = encode()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return body, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Размер и скорость форматов списка задач")
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    tasks = make_tasks(args.tasks)
+
+    formats = {
+        # То, что сейчас отдает response_model=List[TaskResponse]
+        "json_rows (текущий)": lambda: json.dumps(
+            tasks_to_rows(tasks), ensure_ascii=False, separators=(",", ":")
+        ).encode(),
+        "json_columnar": lambda: encode_json(tasks_to_columns(tasks)),
+    }
+    if msgpack is not None:
+        formats["msgpack_rows"] = lambda: encode_msgpack(tasks_to_rows(tasks))
+        formats["msgpack_columnar"] = lambda: encode_msgpack(tasks_to_columns(tasks))
+
+    results = []
+    for name, encode in formats.items():
+        body, encode_time = measure(encode, args.repeat)
+        row = {
+            "format": name,
+            "bytes": len(body),
+            "encode_ms": encode_time * 1000,
+        }
+        gzipped, gzip_time = measure(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL), args.repeat)
+        row["gzip_bytes"] = len(gzipped)
+        row["gzip_ms"] = gzip_time * 1000
+        if zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            zstd_body, zstd_time = measure(lambda: compressor.compress(body), args.repeat)
+            row["zstd_bytes"] = len(zstd_body)
+            row["zstd_ms"] = zstd_time * 1000
+        results.append(row)
+
+    baseline = results[0]["bytes"]
+    print(f"Задач: {args.tasks}")
+    for row in results:
+        line = (
+            f"{row['format']:<22} {row['bytes']:>10} Б ({row['bytes'] / baseline:6.1%})"
+            f"  кодирование {row['encode_ms']:8.2f} мс"
+            f"  gzip {row['gzip_bytes']:>9} Б / {row['gzip_ms']:7.2f} мс"
+        )
+        if "zstd_bytes" in row:
+            line += f"  zstd {row['zstd_bytes']:>9} Б / {row['zstd_ms']:7.2f} мс"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"tasks": args.tasks, "results": results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Доставка напоминаний диспетчером на локальный приемник вебхуков (benchmarks/webhook_stub.py).
+# Создает пользователей с вебхуком и наступившие напоминания, затем отправляет их проходами
+# dispatch_due до опустошения очереди. Нужна отдельная БД: таблицы задач и напоминаний заполняются.
+#
+#   DATABASE_URL=sqlite+aiosqlite:///bench.db python benchmarks/reminders.py --users 200 --tasks 50 --fail-rate 0.1
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Приемник слушает http://127.0.0.1 - без этого доставка на локальный адрес запрещена
+os.environ.setdefault("WEBHOOK_ALLOW_PRIVATE", "1")
+
+import httpx  # noqa: E402
+from sqlalchemy import insert, select, func  # noqa: E402
+from database import init_db, AsyncSessionLocal  # noqa: E402
+from models import User, UserRole, Task, Reminder  # noqa: E402
+import reminders  # noqa: E402
+from webhook_stub import start_stub  # noqa: E402
+
+
+async def fill(users: int, tasks: int, url: str):
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        first_user = (await db.execute(select(func.coalesce(func.max(User.id), 0)))).scalar_one() + 1
+        await db.execute(insert(User), [
+            {
+                "id": first_user + i,
+                "nickname": f"reminders_{first_user + i}",
+                "email": f"reminders_{first_user + i}@example.com",
+                "hashed_password": "-",
+                "role": UserRole.USER,
+                "webhook_url": url,
+                "webhook_secret": "bench",
+            }
+            for i in range(users)
+        ])
+        first_task = (await db.execute(select(func.coalesce(func.max(Task.id), 0)))).scalar_one() + 1
+        rows = []
+        for i in range(users * tasks):
+            deadline_at = now + timedelta(minutes=30)
+            rows.append({
+                "id": first_task + i,
+                "title": f"Задача {i}",
+                "is_important": False,
+                "deadline_at": deadline_at,
+                "quadrant": "Q3",
+                "completed": False,
+                "version": 1,
+                "user_id": first_user + i % users,
+            })
+        await db.execute(insert(Task), rows)
+        await db.execute(insert(Reminder), [
+            {
+                "task_id": row["id"],
+                "user_id": row["user_id"],
+                "deadline_at": row["deadline_at"],
+                "remind_at": now,
+                "status": "pending",
+                "attempts": 0,
+            }
+            for row in rows
+        ])
+        await db.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=50, help="напоминаний на пользователя")
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        sys.exit("Укажите DATABASE_URL отдельной БД для бенчмарка")
+    # Повторные отправки после неудачи - сразу в следующем проходе, а не через минуту
+    reminders.REMINDER_RETRY_SECONDS = 0
+
+    server, state = start_stub(fail_rate=args.fail_rate, delay_ms=args.delay_ms, secret="bench", quiet=True)
+    await init_db()
+    await fill(args.users, args.tasks, f"http://127.0.0.1:{server.server_address[1]}/hook")
+
+    total = {"rounds": 0, "sent": 0, "retried": 0, "failed": 0, "requests": 0}
+    client = httpx.AsyncClient(
+        timeout=reminders.WEBHOOK_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=reminders.WEBHOOK_CONCURRENCY)
+    )
+    started = time.perf_counter()
+    while True:
+        stats = await reminders.dispatch_due(client)
+        if not stats["claimed"]:
+            break
+        total["rounds"] += 1
+        for key in ("sent", "retried", "failed", "requests"):
+            total[key] += stats[key]
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    server.shutdown()
+
+    print(json.dumps({
+        **total,
+        "seconds": round(elapsed, 2),
+        "reminders_per_second": round(total["sent"] / elapsed) if elapsed else None,
+        "stub": state.summary(),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
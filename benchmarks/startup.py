@@ -0,0 +1,98 @@
+# Бенчмарк холодного старта: время от запуска процесса uvicorn до первого успешного запроса.
+#
+# Пример сравнения режимов запуска:
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --runs 5 --env DB_INIT_MODE=fingerprint --env DB_POOL_PREWARM=5
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _measure_import(env: dict) -> float:
+    # Время импорта приложения в отдельном процессе (без запуска сервера)
+    code = "import time; s = time.perf_counter(); import main; print(time.perf_counter() - s)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, env=env)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def _measure_first_request(env: dict, path: str, timeout: float) -> float:
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError("uvicorn завершился до первого ответа")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.01)
+        raise TimeoutError(f"Нет ответа от {url} за {timeout} с")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного старта API")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE для процесса сервера")
+    parser.add_argument("--output", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    import_times = [_measure_import(env) for _ in range(args.runs)]
+    first_request_times = [_measure_first_request(env, args.path, args.timeout) for _ in range(args.runs)]
+
+    result = {
+        "runs": args.runs,
+        "env": dict(item.partition("=")[::2] for item in args.env),
+        "import_main_ms": {
+            "median": statistics.median(import_times) * 1000,
+            "min": min(import_times) * 1000,
+        },
+        "time_to_first_request_ms": {
+            "median": statistics.median(first_request_times) * 1000,
+            "min": min(first_request_times) * 1000,
+            "max": max(first_request_times) * 1000,
+        },
+    }
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Локальный приемник вебхуков напоминаний для проверки диспетчера без внешних сервисов.
+# Проверяет подпись (если передан --secret), считает пачки и повторные доставки,
+# по запросу отвечает ошибками и задержкой, чтобы проверить повторы с паузами.
+#
+#   python benchmarks/webhook_stub.py --port 8099 --fail-rate 0.2 --delay-ms 50
+#   PUT /api/v3/auth/me/webhook {"url": "http://127.0.0.1:8099/hook"}  (приложение с WEBHOOK_ALLOW_PRIVATE=1)
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, fail_rate: float = 0.0, delay_ms: float = 0.0, secret: str = None, quiet: bool = False):
+        self.fail_rate = fail_rate
+        self.delay_ms = delay_ms
+        self.secret = secret
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed = 0
+        self.bad_signature = 0
+        self.batches = 0
+        self.reminders = 0
+        # (task_id, deadline_at) -> сколько раз доставлено
+        self.delivered = {}
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "failed": self.failed,
+                "bad_signature": self.bad_signature,
+                "batches": self.batches,
+                "reminders": self.reminders,
+                "unique": len(self.delivered),
+                "duplicates": sum(count - 1 for count in self.delivered.values()),
+            }
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: клиент диспетчера переиспользует соединения
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if state.delay_ms:
+                time.sleep(state.delay_ms / 1000)
+
+            code = 200
+            payload = None
+            with state.lock:
+                state.requests += 1
+                expected = None
+                if state.secret:
+                    expected = "sha256=" + hmac.new(state.secret.encode(), body, hashlib.sha256).hexdigest()
+                if expected and not hmac.compare_digest(expected, self.headers.get("X-Webhook-Signature", "")):
+                    state.bad_signature += 1
+                    code = 401
+                elif random.random() < state.fail_rate:
+                    state.failed += 1
+                    code = 503
+                else:
+                    payload = json.loads(body)
+                    state.batches += 1
+                    state.reminders += len(payload["reminders"])
+                    for reminder in payload["reminders"]:
+                        key = (reminder["task_id"], reminder["deadline_at"])
+                        state.delivered[key] = state.delivered.get(key, 0) + 1
+
+            if payload is not None and not state.quiet:
+                print(f"user {payload['user_id']}: {len(payload['reminders'])} напоминаний")
+            self._reply(code)
+
+        def _reply(self, code: int):
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Запуск в фоновом потоке (для бенчмарков); возвращает сервер и его состояние
+def start_stub(port: int = 0, **options):
+    state = StubState(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля запросов с ответом 503")
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--secret", default=None, help="ключ из PUT /auth/me/webhook для проверки подписи")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    server, state = start_stub(
+        args.port, fail_rate=args.fail_rate, delay_ms=args.delay_ms, secret=args.secret, quiet=args.quiet
+    )
+    print(f"Приемник вебхуков: http://127.0.0.1:{server.server_address[1]}/hook")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(state.summary(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(state.summary(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
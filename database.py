@@ -1,8 +1,29 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase
-from typing import AsyncGenerator
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy import event, select, delete, text, inspect, Table, Column, String, DateTime, TypeDecorator
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import functions
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from typing import AsyncGenerator, Optional
+from datetime import datetime, timezone
+from collections import deque
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+import asyncio
+import hashlib
+import hmac
+import itertools
 import os
+import time
 from dotenv import load_dotenv
+from slow_queries import install as install_slow_query_log
+from tracing import install as install_tracing
+from auth_utils import SECRET_KEY
 
 try:
     from models import Base, Task
@@ -10,24 +31,384 @@ except ImportError:
     class Base(DeclarativeBase):
         pass
 
+
+# Дата и время всегда в UTC: при записи значение приводится к UTC,
+# при чтении возвращается с tzinfo=UTC (SQLite хранит даты без часового пояса)
+class UTCDateTime(TypeDecorator):
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        else:
+            value = value.astimezone(timezone.utc)
+        if dialect.name == "sqlite":
+            # В SQLite даты сравниваются как строки, поэтому формат у всех значений один
+            return value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+# CURRENT_TIMESTAMP в SQLite - без долей секунды, а UTCDateTime пишет микросекунды:
+# server_default=func.now() должен давать строки того же формата
+@compiles(functions.now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+# create_all - создавать таблицы при каждом запуске (по умолчанию),
+# fingerprint - сверять отпечаток схемы и вызывать create_all только при его изменении,
+# skip - не трогать схему при запуске
+DB_INIT_MODE = os.getenv("DB_INIT_MODE", "create_all")
+# Сколько соединений открыть заранее при запуске (0 - не прогревать пул)
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", "0"))
 
-engine = create_async_engine(
-    DATABASE_URL,
-    connect_args={"statement_cache_size": 0}
-)
+# Настройки встроенной БД SQLite (DATABASE_URL=sqlite+aiosqlite:///путь/к/файлу.db)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Отрицательное значение - размер кэша страниц в КиБ
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+# Сколько ждать блокировку записи, которую держит другой процесс
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Сколько секунд транзакция ждет своей очереди на запись в этом процессе
+SQLITE_WRITE_TIMEOUT = float(os.getenv("SQLITE_WRITE_TIMEOUT", "30"))
+SQLITE_READER_POOL_SIZE = int(os.getenv("SQLITE_READER_POOL_SIZE", "8"))
+# За сколько последних секунд усредняется время ожидания соединения из пула
+POOL_WAIT_WINDOW_SECONDS = float(os.getenv("POOL_WAIT_WINDOW_SECONDS", "5"))
+
+
+# Время ожидания соединений из пулов всех движков (по нему load_shedding.py судит о перегрузке БД)
+class PoolWaitStats:
+    def __init__(self, window: float = POOL_WAIT_WINDOW_SECONDS):
+        self.window = window
+        # (время получения соединения, сколько ждали)
+        self.samples = deque(maxlen=10000)
+        # Сумма ожиданий в samples: recent_wait вызывается на каждый запрос и не должен обходить окно
+        self.total = 0.0
+        # Начала ожиданий, которые еще не закончились (в порядке начала)
+        self.waiting = {}
+        self.checkouts = 0
+        self._tokens = itertools.count()
+
+    def start(self) -> int:
+        token = next(self._tokens)
+        self.waiting[token] = time.monotonic()
+        return token
+
+    def finish(self, token: int):
+        started = self.waiting.pop(token, None)
+        if started is not None:
+            now = time.monotonic()
+            if len(self.samples) == self.samples.maxlen:
+                self.total -= self.samples[0][1]
+            self.samples.append((now, now - started))
+            self.total += now - started
+            self.checkouts += 1
+
+    # Среднее ожидание за окно; если кто-то ждет дольше прямо сейчас - его время ожидания
+    def recent_wait(self) -> float:
+        now = time.monotonic()
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.total -= self.samples.popleft()[1]
+        if not self.samples:
+            # Заодно сбрасываем накопленную ошибку округления
+            self.total = 0.0
+        average = self.total / len(self.samples) if self.samples else 0.0
+        oldest = now - next(iter(self.waiting.values())) if self.waiting else 0.0
+        return max(average, oldest)
+
+
+pool_wait_stats = PoolWaitStats()
+# Ожидание, которое идет в текущем вызове _do_get (пул вызывается синхронно внутри гринлета)
+_checkout_wait: ContextVar[Optional[int]] = ContextVar("pool_checkout_wait", default=None)
+
+
+# Учитывает только ожидание свободного места в очереди пула. Открытие нового соединения
+# (TCP, TLS, аутентификация) и переподключение после recycle в ожидание не входят:
+# к удаленной БД они сами по себе дольше порога, и запросы отклонялись бы без всякой очереди.
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        if _checkout_wait.get() is not None:
+            # Повторный вызов изнутри QueuePool._do_get - ожидание уже учитывается
+            return super()._do_get()
+        token = pool_wait_stats.start()
+        reset_token = _checkout_wait.set(token)
+        try:
+            return super()._do_get()
+        finally:
+            _checkout_wait.reset(reset_token)
+            pool_wait_stats.finish(token)
+
+    def _create_connection(self):
+        token = _checkout_wait.get()
+        if token is not None:
+            # Место в пуле получено, дальше - подключение, а не ожидание
+            pool_wait_stats.finish(token)
+        return super()._create_connection()
+
+
+def is_sqlite_url(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _engine_options(url) -> dict:
+    options = {"poolclass": TimedQueuePool}
+    # statement_cache_size=0 нужен только asyncpg за pgbouncer
+    if make_url(url).get_driver_name() == "asyncpg":
+        options["connect_args"] = {"statement_cache_size": 0}
+    return options
+
+
+def _setup_sqlite_engine(async_engine, writer: bool):
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA foreign_keys=ON",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if not writer:
+        # Соединения читателей не могут случайно записать данные в обход очереди
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        # Транзакции начинает SQLAlchemy (событие begin), а не драйвер
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(async_engine.sync_engine, "begin")
+    def _on_begin(conn):
+        # Писатель сразу берет блокировку записи: без этого две транзакции,
+        # начавшие с чтения, получают SQLITE_BUSY при попытке записать
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if writer else "BEGIN")
+
+
+def _create_sqlite_engines(url) -> tuple:
+    if make_url(url).database in (None, "", ":memory:"):
+        # БД в памяти живет в одном соединении - читатели и писатель общие
+        writer = create_async_engine(url)
+        _setup_sqlite_engine(writer, writer=True)
+        return writer, writer
+
+    # Единственное соединение писателя - это и есть очередь записи:
+    # транзакции ждут его в пуле по порядку, не больше SQLITE_WRITE_TIMEOUT секунд.
+    # Ожидание писателя - главное узкое место SQLite, поэтому оно тоже идет в pool_wait_stats:
+    # отклоненные чтения освобождают процесс (цикл событий, GIL) для очереди записи.
+    writer = create_async_engine(
+        url, poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=SQLITE_WRITE_TIMEOUT
+    )
+    # Читатели в режиме WAL друг другу не мешают: пул держит открытыми SQLITE_READER_POOL_SIZE
+    # соединений, при пиковой нагрузке открываются дополнительные
+    reader = create_async_engine(url, poolclass=TimedQueuePool, pool_size=SQLITE_READER_POOL_SIZE, max_overflow=-1)
+    _setup_sqlite_engine(writer, writer=True)
+    _setup_sqlite_engine(reader, writer=False)
+    return writer, reader
+
+
+# Сессия для SQLite: запросы на чтение идут через пул читателей, запись - через писателя.
+# После первой записи вся транзакция остается на писателе, чтобы видеть свои изменения.
+class SQLiteRoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if (
+            self.info.get("sqlite_writer")
+            or self._flushing
+            or isinstance(clause, (UpdateBase, TextClause))
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            self.info["sqlite_writer"] = True
+            return engine.sync_engine
+        return sqlite_reader_engine.sync_engine
+
+
+@event.listens_for(SQLiteRoutingSession, "after_transaction_end")
+def _release_sqlite_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("sqlite_writer", None)
+
+
+IS_SQLITE = is_sqlite_url(DATABASE_URL)
+
+if IS_SQLITE:
+    engine, sqlite_reader_engine = _create_sqlite_engines(DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=SQLiteRoutingSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+else:
+    engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+    sqlite_reader_engine = None
+    AsyncSessionLocal = async_sessionmaker(
+        bind=engine,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
+# Реплики только для чтения (через запятую), по умолчанию не используются
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+# На сколько секунд реплика исключается из ротации после ошибки подключения
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# Сколько секунд после записи пользователь читает с основной БД (0 - выключено)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "0"))
+
+replica_engines = [
+    create_async_engine(url, **_engine_options(url))
+    for url in DATABASE_REPLICA_URLS
+]
+
+# Журнал медленных запросов на всех движках
+install_slow_query_log(engine, explain_engine=sqlite_reader_engine)
+if sqlite_reader_engine is not None and sqlite_reader_engine is not engine:
+    install_slow_query_log(sqlite_reader_engine)
+for replica in replica_engines:
+    install_slow_query_log(replica)
 
-AsyncSessionLocal = async_sessionmaker(
-    bind=engine,
-    autoflush=False,
-    expire_on_commit=False
+# Спаны SQL-запросов для трассировки
+for traced_engine in {engine, sqlite_reader_engine or engine, *replica_engines}:
+    install_tracing(traced_engine)
+
+ReplicaSessionLocals = [
+    async_sessionmaker(bind=replica, autoflush=False, expire_on_commit=False)
+    for replica in replica_engines
+]
+
+_replica_counter = itertools.count()
+_replica_down_until = [0.0] * len(replica_engines)
+# Привязка к основной БД текущего запроса: {"pin": (user_id, до какого времени), "issued": bool}.
+# Сама привязка хранится у клиента (подписанные cookie и заголовок), поэтому ее видят все процессы.
+_read_your_writes: ContextVar[Optional[dict]] = ContextVar("read_your_writes", default=None)
+READ_YOUR_WRITES_COOKIE = "read_your_writes"
+READ_YOUR_WRITES_HEADER = "x-read-your-writes"
+
+# Отпечаток схемы, для которой последний раз выполнялся create_all
+schema_meta = Table(
+    "schema_meta",
+    Base.metadata,
+    Column("fingerprint", String(64), primary_key=True),
+    Column("updated_at", UTCDateTime(), nullable=False),
 )
 
-async def init_db():
+
+def schema_fingerprint() -> str:
+    # Описание таблиц, колонок и индексов из моделей, без обращения к БД
+    parts = []
+    for table in sorted(Base.metadata.tables.values(), key=lambda t: t.name):
+        parts.append(f"table {table.name}")
+        for column in table.columns:
+            parts.append(
+                f"column {column.name} {column.type!r} "
+                f"nullable={column.nullable} pk={column.primary_key}"
+            )
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            columns = ",".join(column.name for column in index.columns)
+            parts.append(f"index {index.name} {columns} unique={index.unique}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+async def _stored_fingerprint() -> Optional[str]:
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(select(schema_meta.c.fingerprint))
+            return result.scalar_one_or_none()
+    except DBAPIError:
+        # Таблицы schema_meta еще нет
+        return None
+
+
+# create_all не меняет существующие таблицы: добавляем недостающие колонки и индексы
+def _sync_schema(sync_conn) -> list:
+    inspector = inspect(sync_conn)
+    preparer = sync_conn.dialect.identifier_preparer
+    added_columns = []
+
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = CreateColumn(column).compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+            added_columns.append((table.name, column.name))
+            print(f"Добавлена колонка {table.name}.{column.name}")
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(sync_conn)
+                print(f"Создан индекс {index.name}")
+
+    return added_columns
+
+
+# Возвращает список добавленных колонок [(таблица, колонка)]
+async def init_db() -> list:
+    if DB_INIT_MODE == "skip":
+        print("Инициализация схемы пропущена (DB_INIT_MODE=skip)")
+        return []
+
+    fingerprint = schema_fingerprint()
+    if DB_INIT_MODE == "fingerprint" and await _stored_fingerprint() == fingerprint:
+        print("Схема базы данных актуальна")
+        return []
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        added_columns = await conn.run_sync(_sync_schema)
+        await conn.execute(delete(schema_meta))
+        await conn.execute(
+            schema_meta.insert().values(
+                fingerprint=fingerprint,
+                updated_at=datetime.now(timezone.utc)
+            )
+        )
     print("База данных инициализирована!")
+    return added_columns
+
+
+# Открывает соединения пула параллельно, чтобы первые запросы не ждали подключения.
+# Вызывается после проверки схемы: init_db тоже берет соединение из пула.
+async def prewarm_pool(size: int = DB_POOL_PREWARM):
+    if size <= 0:
+        return
+
+    async def _open(target):
+        conn = await target.connect()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    targets = []
+    for target in dict.fromkeys([engine, sqlite_reader_engine or engine, *replica_engines]):
+        # Соединения сверх pool_size при возврате закрываются, а больше pool_size + max_overflow
+        # одновременно не открыть вовсе - прогрев ждал бы pool_timeout
+        pool_size = target.pool.size() if hasattr(target.pool, "size") else size
+        targets += [target] * min(size, pool_size)
+    results = await asyncio.gather(
+        *(_open(target) for target in targets),
+        return_exceptions=True
+    )
+    # Соединения возвращаются в пул только после того, как открыты все
+    for conn in results:
+        if isinstance(conn, Exception):
+            print(f"Не удалось прогреть соединение: {conn}")
+        else:
+            await conn.close()
 
 async def drop_db():
     async with engine.begin() as conn:
@@ -36,4 +417,106 @@ async def drop_db():
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+def _sign_pin(user_id: int, until: float) -> str:
+    value = f"{user_id}.{int(until)}"
+    signature = hmac.new(SECRET_KEY.encode(), value.encode(), hashlib.sha256).hexdigest()[:32]
+    return f"{value}.{signature}"
+
+
+def _parse_pin(value: Optional[str]) -> Optional[tuple]:
+    try:
+        user_id, until, signature = value.split(".")
+        expected = _sign_pin(int(user_id), int(until)).rsplit(".", 1)[1]
+    except (AttributeError, ValueError):
+        return None
+    if not hmac.compare_digest(signature, expected):
+        return None
+    return int(user_id), float(until)
+
+
+def pin_to_primary(user_id: Optional[int]):
+    state = _read_your_writes.get()
+    if READ_YOUR_WRITES_SECONDS <= 0 or user_id is None or state is None:
+        return
+    # Секунды округляются вверх: в подписанном значении хранится целое число
+    state["pin"] = (user_id, float(int(time.time() + READ_YOUR_WRITES_SECONDS) + 1))
+    state["issued"] = True
+
+
+def is_pinned_to_primary(user_id: Optional[int]) -> bool:
+    state = _read_your_writes.get()
+    if user_id is None or state is None or state["pin"] is None:
+        return False
+    pinned_user, until = state["pin"]
+    return pinned_user == user_id and until > time.time()
+
+
+# ASGI-обертка: читает привязку к основной БД из запроса и отдает новую после записи.
+# Браузер возвращает cookie сам, другие клиенты повторяют заголовок X-Read-Your-Writes.
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if READ_YOUR_WRITES_SECONDS <= 0 or not replica_engines or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        pin = None
+        for key, value in scope["headers"]:
+            if key == READ_YOUR_WRITES_HEADER.encode():
+                pin = _parse_pin(value.decode("latin-1")) or pin
+            elif key == b"cookie":
+                morsel = SimpleCookie(value.decode("latin-1")).get(READ_YOUR_WRITES_COOKIE)
+                if morsel is not None:
+                    pin = pin or _parse_pin(morsel.value)
+        state = {"pin": pin, "issued": False}
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and state["issued"]:
+                value = _sign_pin(*state["pin"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", (
+                        f"{READ_YOUR_WRITES_COOKIE}={value}; Max-Age={int(READ_YOUR_WRITES_SECONDS) + 1}; "
+                        f"Path=/; HttpOnly; SameSite=Lax"
+                    ).encode()),
+                    (READ_YOUR_WRITES_HEADER.encode(), value.encode()),
+                ]
+            await send(message)
+
+        token = _read_your_writes.set(state)
+        try:
+            await self.app(scope, receive, send_with_pin)
+        finally:
+            _read_your_writes.reset(token)
+
+
+# После коммита на основной БД пользователь, сделавший запись, временно читает с нее же
+@event.listens_for(Session, "after_commit")
+def _pin_writer_after_commit(session):
+    pin_to_primary(session.info.get("user_id"))
+
+
+# Сессия для чтения: реплики по кругу, при недоступности реплики - основная БД
+async def open_read_session(user_id: Optional[int] = None) -> AsyncSession:
+    if replica_engines and not is_pinned_to_primary(user_id):
+        start = next(_replica_counter)
+        for offset in range(len(replica_engines)):
+            index = (start + offset) % len(replica_engines)
+            if _replica_down_until[index] > time.monotonic():
+                continue
+
+            session = ReplicaSessionLocals[index]()
+            try:
+                # Соединение берется сразу, чтобы ошибка реплики не дошла до эндпоинта
+                await session.connection()
+                return session
+            except (DBAPIError, OSError, asyncio.TimeoutError) as e:
+                await session.close()
+                _replica_down_until[index] = time.monotonic() + REPLICA_RETRY_SECONDS
+                print(f"Реплика {index} недоступна, переключение: {e}")
+
+    return AsyncSessionLocal()
\ No newline at end of file
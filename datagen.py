@@ -0,0 +1,328 @@
+# Генератор синтетических пользователей и задач для локальной проверки на больших объемах.
+# Пишет напрямую в БД в обход API: пароль хешируется один раз, строки генерируются пачками
+# через NumPy и вставляются через COPY (PostgreSQL) или executemany одной транзакцией на пачку.
+#
+#   python datagen.py --users 10000 --tasks-per-user 100
+#   python datagen.py --users 100000 --tasks-per-user 50 --distribution lognormal \
+#       --deadline-share 0.6 --completion-rate 0.5 --quadrant-mix 0.1,0.4,0.1,0.4
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+TITLE_WORDS = np.array([
+    "Отчет", "Звонок", "Встреча", "Письмо", "Ревью кода", "Презентация",
+    "Оплата счета", "Планирование", "Тестирование", "Документация",
+])
+DESCRIPTION = "Сгенерированная задача"
+
+TASK_COLUMNS = [
+    "title", "description", "is_important", "deadline_at", "quadrant",
+    "completed", "created_at", "completed_at", "user_id",
+]
+USER_COLUMNS = [
+    "id", "nickname", "email", "hashed_password", "role", "tasks_count", "completed_tasks_count",
+]
+QUADRANTS = np.array(["Q1", "Q2", "Q3", "Q4"])
+
+DAY_US = 24 * 3600 * 10 ** 6
+
+
+def tasks_per_user(rng, users: int, mean: float, distribution: str) -> np.ndarray:
+    if distribution == "fixed":
+        return np.full(users, int(mean), dtype=np.int64)
+    if distribution == "poisson":
+        return rng.poisson(mean, users)
+    if distribution == "lognormal":
+        # Длинный хвост: немного пользователей с очень большим числом задач, среднее = mean
+        sigma = 1.0
+        return np.rint(rng.lognormal(np.log(max(mean, 1e-9)) - sigma ** 2 / 2, sigma, users)).astype(np.int64)
+    raise ValueError(f"Неизвестное распределение: {distribution}")
+
+
+# Колонки пачки задач в виде массивов NumPy; время - в микросекундах от эпохи
+def generate_tasks(
+        rng,
+        owner_ids: np.ndarray,
+        counts: np.ndarray,
+        completed_counts: np.ndarray,
+        now_us: int,
+        deadline_share: float,
+        quadrant_mix: Sequence[float],
+        history_days: int
+) -> dict:
+    size = int(counts.sum())
+    user_id = np.repeat(owner_ids, counts)
+    # Номер задачи внутри пользователя: первые completed_counts[u] задач выполнены
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    completed = (np.arange(size) - starts) < np.repeat(completed_counts, counts)
+
+    quadrant = rng.choice(4, size=size, p=quadrant_mix)
+    is_important = quadrant <= 1
+    is_urgent = (quadrant == 0) | (quadrant == 2)
+
+    created_at = now_us - (rng.random(size) * history_days * DAY_US).astype(np.int64)
+    completed_at = np.minimum(created_at + (rng.exponential(2.0, size) * DAY_US).astype(np.int64), now_us)
+
+    # Активные задачи согласованы с правилом срочности (дедлайн не позже чем через 3 дня):
+    # у срочных дедлайн всегда есть, у остальных - с такой вероятностью, чтобы общая доля
+    # задач с дедлайном была deadline_share
+    urgent_share = quadrant_mix[0] + quadrant_mix[2]
+    other_share = 1 - urgent_share
+    other_deadline = min(max((deadline_share - urgent_share) / other_share, 0.0), 1.0) if other_share > 0 else 0.0
+    random_share = rng.random(size)
+
+    urgent_deadline = now_us + ((rng.random(size) * 13.5 - 10) * DAY_US).astype(np.int64)
+    later_deadline = now_us + ((4.5 + rng.random(size) * 55) * DAY_US).astype(np.int64)
+    done_deadline = created_at + (rng.random(size) * 14 * DAY_US).astype(np.int64)
+
+    deadline_at = np.where(completed, done_deadline, np.where(is_urgent, urgent_deadline, later_deadline))
+    has_deadline = np.where(
+        completed,
+        random_share < deadline_share,
+        is_urgent | (random_share < other_deadline)
+    )
+
+    return {
+        "title_word": rng.integers(0, len(TITLE_WORDS), size),
+        "title_number": rng.integers(1, 10 ** 6, size),
+        "has_description": rng.random(size) < 0.5,
+        "is_important": is_important,
+        "deadline_at": deadline_at,
+        "has_deadline": has_deadline,
+        "quadrant": quadrant,
+        "completed": completed,
+        "created_at": created_at,
+        "completed_at": completed_at,
+        "user_id": user_id,
+    }
+
+
+def _sqlite_timestamps(values: np.ndarray, present: np.ndarray) -> list:
+    # Формат UTCDateTime для SQLite: "YYYY-MM-DD HH:MM:SS.ffffff"
+    strings = np.datetime_as_string(values.astype("datetime64[us]"), unit="us")
+    # Замена "T" на пробел прямо в буфере строк UCS-4, без str.replace на каждую строку
+    strings.view(np.uint32).reshape(len(strings), -1)[:, 10] = ord(" ")
+    strings = strings.tolist()
+    if present.all():
+        return strings
+    return [value if flag else None for value, flag in zip(strings, present.tolist())]
+
+
+def _aware_timestamps(values: np.ndarray, present: np.ndarray) -> list:
+    moments = values.astype("datetime64[us]").astype(object)
+    return [
+        moment.replace(tzinfo=timezone.utc) if flag else None
+        for moment, flag in zip(moments.tolist(), present.tolist())
+    ]
+
+
+def task_rows(columns: dict, timestamps: Callable) -> list:
+    titles = [
+        f"{word} {number}"
+        for word, number in zip(TITLE_WORDS[columns["title_word"]].tolist(), columns["title_number"].tolist())
+    ]
+    everywhere = np.ones(len(titles), dtype=np.bool_)
+    return list(zip(
+        titles,
+        [DESCRIPTION if flag else None for flag in columns["has_description"].tolist()],
+        columns["is_important"].tolist(),
+        timestamps(columns["deadline_at"], columns["has_deadline"]),
+        QUADRANTS[columns["quadrant"]].tolist(),
+        columns["completed"].tolist(),
+        timestamps(columns["created_at"], everywhere),
+        timestamps(columns["completed_at"], columns["completed"]),
+        columns["user_id"].tolist(),
+    ))
+
+
+async def _write_rows(conn, table, column_names: list, rows: list):
+    dialect = conn.dialect
+    if dialect.name == "postgresql" and dialect.driver == "asyncpg":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=rows, columns=column_names)
+    elif dialect.name == "sqlite":
+        placeholders = ", ".join("?" for _ in column_names)
+        await conn.exec_driver_sql(
+            f"INSERT INTO {table.name} ({', '.join(column_names)}) VALUES ({placeholders})", rows
+        )
+    else:
+        await conn.execute(table.insert(), [dict(zip(column_names, row)) for row in rows])
+
+
+async def generate(
+        users: int,
+        tasks_per_user_mean: float,
+        distribution: str = "fixed",
+        deadline_share: float = 0.7,
+        completion_rate: float = 0.4,
+        quadrant_mix: Sequence[float] = (0.25, 0.25, 0.25, 0.25),
+        history_days: int = 365,
+        password: str = "password",
+        prefix: str = "user",
+        batch_size: int = 50000,
+        seed: Optional[int] = None,
+        defer_indexes: bool = False,
+        verbose: bool = True
+) -> dict:
+    from sqlalchemy import select, func, text
+    from database import engine, init_db
+    from models import User, UserRole, Task
+    from auth_utils import get_password_hash
+
+    if abs(sum(quadrant_mix) - 1) > 1e-6:
+        raise ValueError("Сумма долей квадрантов должна быть равна 1")
+
+    await init_db()
+
+    rng = np.random.default_rng(seed)
+    now_us = int(datetime.now(timezone.utc).timestamp() * 10 ** 6)
+    counts = tasks_per_user(rng, users, tasks_per_user_mean, distribution)
+    completed_counts = rng.binomial(counts, completion_rate)
+
+    async with engine.connect() as conn:
+        first_id = ((await conn.execute(select(func.max(User.id)))).scalar() or 0) + 1
+    user_ids = np.arange(first_id, first_id + users, dtype=np.int64)
+    is_sqlite = engine.dialect.name == "sqlite"
+    timestamps = _sqlite_timestamps if is_sqlite else _aware_timestamps
+
+    started = time.perf_counter()
+    # bcrypt считается один раз для всех пользователей
+    hashed_password = get_password_hash(password)
+    role = UserRole.USER.name
+
+    # Пользователи со счетчиками задач, которые получатся после генерации
+    for offset in range(0, users, batch_size):
+        chunk = slice(offset, offset + batch_size)
+        rows = [
+            (user_id, f"{prefix}{user_id}", f"{prefix}{user_id}@example.com", hashed_password, role, total, done)
+            for user_id, total, done in zip(
+                user_ids[chunk].tolist(), counts[chunk].tolist(), completed_counts[chunk].tolist()
+            )
+        ]
+        async with engine.begin() as conn:
+            await _write_rows(conn, User.__table__, USER_COLUMNS, rows)
+
+    if engine.dialect.name == "postgresql":
+        # id пользователей заданы явно - последовательность нужно сдвинуть
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))"
+            ))
+
+    # Без индексов вставка в разы быстрее, а построение индекса одной сортировкой в конце
+    # дешевле, чем обновление всех индексов на каждую строку
+    task_indexes = sorted(Task.__table__.indexes, key=lambda index: index.name)
+    if defer_indexes:
+        async with engine.begin() as conn:
+            for index in task_indexes:
+                await conn.run_sync(index.drop, checkfirst=True)
+
+    # Задачи пачками примерно по batch_size строк, целыми пользователями.
+    # Следующая пачка готовится в отдельном потоке, пока текущая пишется в БД.
+    total_tasks = int(counts.sum())
+    bounds = np.searchsorted(np.cumsum(counts), np.arange(batch_size, total_tasks + batch_size, batch_size))
+    ends = [end for end in np.unique(np.minimum(bounds + 1, users)).tolist() if end > 0]
+    starts = [0] + ends[:-1]
+
+    def build(start: int, end: int) -> list:
+        columns = generate_tasks(
+            rng,
+            user_ids[start:end],
+            counts[start:end],
+            completed_counts[start:end],
+            now_us,
+            deadline_share,
+            quadrant_mix,
+            history_days
+        )
+        return task_rows(columns, timestamps)
+
+    async def write(rows: list):
+        async with engine.begin() as conn:
+            await _write_rows(conn, Task.__table__, TASK_COLUMNS, rows)
+
+    written = 0
+    rows = build(starts[0], ends[0]) if ends else []
+    for i in range(len(ends)):
+        if i + 1 < len(ends):
+            next_rows, _ = await asyncio.gather(asyncio.to_thread(build, starts[i + 1], ends[i + 1]), write(rows))
+        else:
+            next_rows = None
+            await write(rows)
+
+        written += len(rows)
+        rows = next_rows
+        if verbose:
+            elapsed = time.perf_counter() - started
+            print(f"Задач: {written}/{total_tasks} ({(written + users) / elapsed:,.0f} строк/с)")
+
+    load_seconds = time.perf_counter() - started
+    if defer_indexes:
+        if verbose:
+            print("Построение индексов задач...")
+        async with engine.begin() as conn:
+            for index in task_indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+
+    return {
+        "users": users,
+        "first_user_id": first_id,
+        "tasks": written,
+        "load_seconds": round(load_seconds, 2),
+        "index_seconds": round(time.perf_counter() - started - load_seconds, 2),
+        "rows_per_second": round((users + written) / load_seconds) if load_seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генерация пользователей и задач напрямую в БД")
+    parser.add_argument("--users", type=int, required=True)
+    parser.add_argument("--tasks-per-user", type=float, default=100, help="Среднее число задач на пользователя")
+    parser.add_argument("--distribution", choices=["fixed", "poisson", "lognormal"], default="fixed",
+                        help="Распределение числа задач по пользователям")
+    parser.add_argument("--deadline-share", type=float, default=0.7, help="Доля задач с дедлайном")
+    parser.add_argument("--completion-rate", type=float, default=0.4, help="Доля выполненных задач")
+    parser.add_argument("--quadrant-mix", default="0.25,0.25,0.25,0.25", help="Доли Q1,Q2,Q3,Q4")
+    parser.add_argument("--history-days", type=int, default=365, help="За сколько дней созданы задачи")
+    parser.add_argument("--password", default="password", help="Пароль всех пользователей")
+    parser.add_argument("--prefix", default="user", help="Префикс никнейма и email")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="Удалить индексы задач на время загрузки и построить заново в конце")
+    parser.add_argument("--database-url", help="По умолчанию DATABASE_URL из окружения")
+    args = parser.parse_args()
+
+    if args.database_url:
+        # До импорта database.py, который читает DATABASE_URL при импорте
+        os.environ["DATABASE_URL"] = args.database_url
+
+    result = asyncio.run(generate(
+        users=args.users,
+        tasks_per_user_mean=args.tasks_per_user,
+        distribution=args.distribution,
+        deadline_share=args.deadline_share,
+        completion_rate=args.completion_rate,
+        quadrant_mix=[float(value) for value in args.quadrant_mix.split(",")],
+        history_days=args.history_days,
+        password=args.password,
+        prefix=args.prefix,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        defer_indexes=args.defer_indexes,
+    ))
+    print(
+        f"Создано {result['users']} пользователей (с id {result['first_user_id']}) и {result['tasks']} задач "
+        f"за {result['load_seconds']} с: {result['rows_per_second']:,} строк/с"
+    )
+    if args.defer_indexes:
+        print(f"Индексы построены за {result['index_seconds']} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,42 +2,60 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from database import get_async_session
+from database import get_async_session, open_read_session
 from models import User, UserRole
 from auth_utils import decode_access_token
-from typing import Optional
+from tracing import span
+from typing import AsyncGenerator, Optional
 
 # OAuth2 схема для получения токена из заголовка Authorization
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v3/auth/login")
 
 
-# Аутентификация
-async def get_current_user(
-        token: str = Depends(oauth2_scheme),
-        db: AsyncSession = Depends(get_async_session)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Не удалось проверить учетные данные",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+# id пользователя из токена (без обращения к БД)
+async def get_token_user_id(token: str = Depends(oauth2_scheme)) -> int:
     # Декодирование токена
     payload = decode_access_token(token)
     if payload is None:
-        raise credentials_exception
+        raise _credentials_exception()
 
     user_id: Optional[int] = payload.get("sub")
     if user_id is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    return int(user_id)
 
-        # Поиск пользователя в БД
-    result = await db.execute(
-        select(User).where(User.id == int(user_id))
-    )
-    user = result.scalar_one_or_none()
 
-    if user is None:
-        raise credentials_exception
+async def _load_user(db: AsyncSession, user_id: int) -> User:
+    # Поиск пользователя в БД
+    with span("auth.user_lookup", user_id=user_id):
+        result = await db.execute(
+            select(User).where(User.id == user_id)
+        )
+        user = result.scalar_one_or_none()
+
+    # Пользователь, помеченный на удаление, не может работать с API
+    if user is None or user.deleted_at is not None:
+        raise _credentials_exception()
+    return user
+
+
+# Аутентификация
+async def get_current_user(
+        user_id: int = Depends(get_token_user_id),
+        db: AsyncSession = Depends(get_async_session)
+) -> User:
+    user = await _load_user(db, user_id)
+
+    # Нужен для read-your-writes: после коммита в этой сессии чтения идут с основной БД
+    db.info["user_id"] = user.id
 
     return user
 
@@ -51,4 +69,28 @@ async def get_current_admin(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Недостаточно прав доступа"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+# Сессия для эндпоинтов, которые только читают данные (может вести на реплику).
+# Пользователь берется из токена, поэтому основная БД для таких запросов не нужна вовсе.
+async def get_read_session(
+        user_id: int = Depends(get_token_user_id)
+) -> AsyncGenerator[AsyncSession, None]:
+    session = await open_read_session(user_id)
+    async with session:
+        yield session
+
+
+# Аутентификация для эндпоинтов только для чтения: пользователь ищется в той же сессии чтения
+async def get_read_user(
+        user_id: int = Depends(get_token_user_id),
+        db: AsyncSession = Depends(get_read_session)
+) -> User:
+    return await _load_user(db, user_id)
+
+
+async def get_read_admin(
+        current_user: User = Depends(get_read_user)
+) -> User:
+    return await get_current_admin(current_user)
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal, pin_to_primary
+
+load_dotenv()
+# Групповой коммит: изменения задач из разных запросов применяются одной транзакцией
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() == "true"
+# Сколько ждать другие изменения после первого в группе
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+# Максимум изменений в одной транзакции
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+# Изменение: получает сессию, не коммитит; результат не должен зависеть от сессии после коммита
+Operation = Callable[[AsyncSession], Awaitable]
+
+_queue: Optional[asyncio.Queue] = None
+_flusher: Optional[asyncio.Task] = None
+_stats = {
+    "batches": 0,
+    "operations": 0,
+    "operation_errors": 0,
+    "fallbacks": 0,
+    "max_batch": 0,
+    "commit_ms_total": 0.0,
+}
+
+
+# Выполняет изменение и коммитит его: отдельной транзакцией или в группе с изменениями других запросов.
+# Ошибка изменения (в том числе HTTPException) возвращается только вызвавшему его запросу.
+async def run_in_transaction(db: AsyncSession, operation: Operation):
+    if not GROUP_COMMIT_ENABLED:
+        result = await operation(db)
+        await db.commit()
+        return result
+
+    # Сессия запроса (по ней загружен текущий пользователь) держит соединение из того же пула, что нужен
+    # группе: при числе ожидающих запросов не меньше размера пула группа не получила бы соединение.
+    # close() возвращает соединение в пул; загруженные объекты остаются доступны (отсоединенными).
+    await db.close()
+
+    global _queue, _flusher
+    if _flusher is None or _flusher.done():
+        _queue = asyncio.Queue()
+        # Чистый контекст: группа не должна унаследовать ContextVar запроса, который ее запустил
+        _flusher = asyncio.create_task(_flush_loop(), context=contextvars.Context())
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((operation, future))
+    result = await future
+    # Коммит был в сессии группы без user_id - read-your-writes для автора изменения закрепляется здесь
+    pin_to_primary(db.info.get("user_id"))
+    return result
+
+
+# Возвращает группу изменений и признак остановки (в очереди встретился None)
+async def _collect() -> tuple:
+    first = await _queue.get()
+    if first is None:
+        return [], True
+    batch = [first]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GROUP_COMMIT_WINDOW_MS / 1000
+    while len(batch) < GROUP_COMMIT_MAX_BATCH:
+        # Уже ожидающие изменения забираются без ожидания
+        if not _queue.empty():
+            item = _queue.get_nowait()
+        else:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        if item is None:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+async def _run_alone(operation: Operation, future: asyncio.Future):
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await operation(db)
+            await db.commit()
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+        return
+    if not future.done():
+        future.set_result(result)
+
+
+# Каждое изменение - в своей точке сохранения: ошибка откатывает только его, остальные коммитятся вместе
+async def _apply(batch: list):
+    # Запрос, который уже отменен (клиент отключился), в группу не попадает
+    batch = [(operation, future) for operation, future in batch if not future.done()]
+    if not batch:
+        return
+
+    outcomes = []
+    started = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            for operation, future in batch:
+                try:
+                    async with db.begin_nested():
+                        outcomes.append((future, await operation(db), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            await db.commit()
+    except Exception as e:
+        # Транзакция группы не прошла целиком (коммит, соединение) - изменения выполняются по одному
+        print(f"Групповой коммит не удался ({type(e).__name__}: {e}), изменения выполняются по отдельности")
+        _stats["fallbacks"] += 1
+        for operation, future in batch:
+            await _run_alone(operation, future)
+        return
+
+    _stats["batches"] += 1
+    _stats["operations"] += len(batch)
+    _stats["max_batch"] = max(_stats["max_batch"], len(batch))
+    _stats["commit_ms_total"] += (time.perf_counter() - started) * 1000
+    for future, result, error in outcomes:
+        if future.done():
+            continue
+        if error is not None:
+            _stats["operation_errors"] += 1
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+async def _flush_loop():
+    while True:
+        batch, stopping = await _collect()
+        try:
+            await _apply(batch)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        if stopping:
+            return
+
+
+# Остановка приложения: изменения, уже поставленные в очередь, применяются до выхода
+async def stop_group_commit():
+    global _flusher, _queue
+    if _flusher is None:
+        return
+    if not _flusher.done():
+        await _queue.put(None)
+        await asyncio.gather(_flusher, return_exceptions=True)
+    _flusher = None
+    _queue = None
+
+
+def get_stats() -> dict:
+    batches = _stats["batches"]
+    return {
+        "enabled": GROUP_COMMIT_ENABLED,
+        "window_ms": GROUP_COMMIT_WINDOW_MS,
+        "max_batch_size": GROUP_COMMIT_MAX_BATCH,
+        "batches": batches,
+        "operations": _stats["operations"],
+        "operation_errors": _stats["operation_errors"],
+        "fallbacks": _stats["fallbacks"],
+        "max_batch": _stats["max_batch"],
+        "avg_batch": round(_stats["operations"] / batches, 2) if batches else 0.0,
+        "avg_transaction_ms": round(_stats["commit_ms_total"] / batches, 2) if batches else 0.0,
+        "queued": _queue.qsize() if _queue is not None else 0,
+    }
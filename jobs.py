@@ -0,0 +1,376 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from contextvars import ContextVar
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models.job import (
+    Job, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, JOB_ACTIVE_STATUSES
+)
+from scheduler import (
+    WORKER_ID, JOBS as SCHEDULER_JOBS, SCHEDULER_MODE, SCHEDULER_PARTITIONS,
+    lease_name, run_with_lease, is_lease_completed
+)
+from user_deletion import purge_user
+from reminders import schedule_user_reminders
+from utils import reconcile_task_counters
+from slow_queries import current_source as current_query_source
+
+load_dotenv()
+# Сколько заданий одновременно выполняет один процесс, 0 - процесс только ставит задания в очередь
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Как часто свободный воркер проверяет очередь (задания этого процесса будят его сразу)
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "5"))
+# Как часто выполняющееся задание сохраняет прогресс и проверяет отмену
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "2"))
+# Задание без отметки дольше этого времени считается брошенным (воркер упал)
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+# Сколько раз брошенное задание возвращается в очередь, прежде чем считается неудачным
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+
+# id выполняемого задания (для обработчиков, которым нужен ключ запуска)
+current_job_id: ContextVar[Optional[int]] = ContextVar("current_job_id", default=None)
+
+
+# Задачи планировщика, запущенные вручную, берут ту же аренду, что и запуск по cron (по партициям
+# в режиме partitioned): иначе они пересекаются и, например, архивация падает на конфликте ключей
+async def _run_under_scheduler_lease(kind: str, progress: dict, **options):
+    run_key = f"job:{current_job_id.get()}"
+    partitions = list(range(SCHEDULER_PARTITIONS)) if SCHEDULER_MODE == "partitioned" else [None]
+    totals = {}
+    for partition in partitions:
+        name = lease_name(kind, partition)
+        # Партиция одна - прогресс виден по ходу работы, иначе обновляется после каждой партиции
+        stats = progress if partition is None else {}
+
+        async def run():
+            if partition is None:
+                await SCHEDULER_JOBS[kind](stats=stats, **options)
+            else:
+                await SCHEDULER_JOBS[kind](partition=partition, partitions=SCHEDULER_PARTITIONS, stats=stats, **options)
+
+        while not await run_with_lease(name, run_key, run):
+            if await is_lease_completed(name, run_key):
+                # Партицию выполнила прошлая попытка этого задания
+                break
+            # Аренду держит запуск по расписанию - ждем, пока он закончится
+            progress["waiting_for_lease"] = name
+            await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+        progress.pop("waiting_for_lease", None)
+
+        if partition is not None:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+            progress.update(totals, partitions_done=partition + 1)
+
+
+async def _run_update_urgency(params: dict, progress: dict):
+    await _run_under_scheduler_lease("update_urgency", progress)
+
+
+async def _run_archive_completed(params: dict, progress: dict):
+    await _run_under_scheduler_lease("archive_completed", progress)
+
+
+async def _run_rollup_completions(params: dict, progress: dict):
+    await _run_under_scheduler_lease("rollup_completions", progress, full=bool(params.get("full", False)))
+
+
+async def _run_generate_occurrences(params: dict, progress: dict):
+    await _run_under_scheduler_lease("generate_occurrences", progress)
+
+
+async def _run_reconcile_counters(params: dict, progress: dict):
+    async with AsyncSessionLocal() as db:
+        await reconcile_task_counters(db, stats=progress)
+
+
+async def _run_purge_user(params: dict, progress: dict):
+    await purge_user(int(params["user_id"]), stats=progress)
+
+
+async def _run_schedule_user_reminders(params: dict, progress: dict):
+    await schedule_user_reminders(int(params["user_id"]), stats=progress)
+
+
+# Обработчики заданий: (параметры, прогресс) -> None, прогресс заполняется по ходу работы
+JOB_HANDLERS = {
+    "update_urgency": _run_update_urgency,
+    "archive_completed": _run_archive_completed,
+    "rollup_completions": _run_rollup_completions,
+    "generate_occurrences": _run_generate_occurrences,
+    "reconcile_counters": _run_reconcile_counters,
+    "purge_user": _run_purge_user,
+    "schedule_user_reminders": _run_schedule_user_reminders,
+}
+# Задания, которые админ ставит в очередь напрямую; purge_user - только через DELETE /admin/users/{id},
+# schedule_user_reminders - через PUT /auth/me/webhook
+ADMIN_JOB_KINDS = (
+    "update_urgency", "archive_completed", "rollup_completions", "generate_occurrences", "reconcile_counters"
+)
+
+_workers: list = []
+_wakeup: Optional[asyncio.Event] = None
+_last_reclaim = 0.0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def job_dedupe_key(kind: str, params: dict) -> str:
+    return hashlib.sha256(
+        json.dumps([kind, params], sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+# Ставит задание в очередь. Если такое же задание уже ждет или выполняется, возвращает его.
+# Дубликаты исключает уникальный частичный индекс ux_jobs_active_key, а не проверка перед вставкой.
+async def enqueue_job(db: AsyncSession, kind: str, params: Optional[dict] = None, created_by: Optional[int] = None) -> Job:
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Неизвестное задание: {kind}")
+    params = params or {}
+    dedupe_key = job_dedupe_key(kind, params)
+
+    for _ in range(3):
+        existing = (await db.execute(
+            select(Job).where(Job.dedupe_key == dedupe_key, Job.status.in_(JOB_ACTIVE_STATUSES))
+        )).scalar_one_or_none()
+        if existing is not None:
+            return existing
+
+        job = Job(
+            kind=kind, params=params, dedupe_key=dedupe_key, status=JOB_QUEUED,
+            progress={}, created_by=created_by, created_at=_now()
+        )
+        try:
+            async with db.begin_nested():
+                db.add(job)
+            await db.commit()
+            break
+        except IntegrityError:
+            # Такое же задание только что поставил другой запрос - вернем его
+            continue
+    else:
+        raise RuntimeError(f"Не удалось поставить задание {kind} в очередь")
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return job
+
+
+# Отмена: задание из очереди отменяется сразу, выполняющееся - воркером при следующей отметке
+async def cancel_job(db: AsyncSession, job_id: int) -> Optional[Job]:
+    await db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == JOB_QUEUED)
+        .values(status=JOB_CANCELLED, cancel_requested=True, finished_at=_now())
+    )
+    await db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == JOB_RUNNING)
+        .values(cancel_requested=True)
+    )
+    await db.commit()
+    return (await db.execute(
+        select(Job).where(Job.id == job_id).execution_options(populate_existing=True)
+    )).scalar_one_or_none()
+
+
+async def claim_job(attempts: int = 3) -> Optional[Job]:
+    for _ in range(attempts):
+        async with AsyncSessionLocal() as db:
+            # В PostgreSQL строки, заблокированные другими воркерами, пропускаются - воркеры не ждут друг друга
+            job_id = (await db.execute(
+                select(Job.id)
+                .where(Job.status == JOB_QUEUED, Job.cancel_requested == False)
+                .order_by(Job.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if job_id is None:
+                await db.rollback()
+                return None
+
+            # Условное обновление: в SQLite нет FOR UPDATE, задание достается тому, чей UPDATE прошел
+            now = _now()
+            job = (await db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == JOB_QUEUED, Job.cancel_requested == False)
+                .values(
+                    status=JOB_RUNNING,
+                    worker=WORKER_ID,
+                    attempts=Job.attempts + 1,
+                    started_at=now,
+                    heartbeat_at=now
+                )
+                .returning(Job)
+            )).scalar_one_or_none()
+            await db.commit()
+            if job is not None:
+                return job
+    return None
+
+
+# Сохраняет прогресс. Возвращает флаг отмены или None, если задание больше не принадлежит воркеру.
+async def _heartbeat(job_id: int, progress: dict) -> Optional[bool]:
+    async with AsyncSessionLocal() as db:
+        cancel_requested = (await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.worker == WORKER_ID, Job.status == JOB_RUNNING)
+            .values(progress=dict(progress), heartbeat_at=_now())
+            .returning(Job.cancel_requested)
+        )).scalar_one_or_none()
+        await db.commit()
+        return cancel_requested
+
+
+async def _finish(job_id: int, values: dict):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.worker == WORKER_ID, Job.status == JOB_RUNNING)
+            .values(**values)
+        )
+        await db.commit()
+
+
+# Остановка приложения: задание возвращается в очередь и будет выполнено заново,
+# а задание, которое админ уже отменил, завершается отменой и больше не запускается
+async def _release_on_shutdown(job_id: int, progress: dict):
+    owned = (Job.id == job_id, Job.worker == WORKER_ID, Job.status == JOB_RUNNING)
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Job)
+            .where(*owned, Job.cancel_requested == True)
+            .values(status=JOB_CANCELLED, progress=dict(progress), finished_at=_now())
+        )
+        await db.execute(
+            update(Job)
+            .where(*owned)
+            .values(status=JOB_QUEUED, worker=None, progress=dict(progress))
+        )
+        await db.commit()
+
+
+async def run_claimed_job(job: Job):
+    progress = dict(job.progress or {})
+    started = time.perf_counter()
+    print(f"Задание {job.id} ({job.kind}) запущено воркером {WORKER_ID}")
+
+    # Запросы задания в журнале медленных запросов подписываются его именем
+    token = current_query_source.set(f"job:{job.kind}#{job.id}")
+    job_token = current_job_id.set(job.id)
+    try:
+        handler = asyncio.create_task(JOB_HANDLERS[job.kind](job.params or {}, progress))
+    finally:
+        current_job_id.reset(job_token)
+        current_query_source.reset(token)
+
+    cancelled = False
+    try:
+        while not handler.done():
+            await asyncio.wait({handler}, timeout=JOB_HEARTBEAT_SECONDS)
+            if handler.done():
+                break
+            cancel_requested = await _heartbeat(job.id, progress)
+            if cancel_requested is None:
+                # Задание вернули в очередь как брошенное - его выполнит другой воркер
+                handler.cancel()
+                print(f"Задание {job.id} больше не принадлежит воркеру, выполнение прервано")
+                return
+            if cancel_requested:
+                cancelled = True
+                handler.cancel()
+        try:
+            await handler
+            values = {"status": JOB_COMPLETED, "error": None}
+        except asyncio.CancelledError:
+            if not cancelled:
+                raise
+            values = {"status": JOB_CANCELLED, "error": None}
+        except Exception as e:
+            values = {"status": JOB_FAILED, "error": f"{type(e).__name__}: {e}"}
+            print(f"Ошибка в задании {job.id} ({job.kind}): {values['error']}")
+    except asyncio.CancelledError:
+        handler.cancel()
+        await asyncio.shield(_release_on_shutdown(job.id, progress))
+        raise
+
+    progress["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    now = _now()
+    await _finish(job.id, {**values, "progress": dict(progress), "heartbeat_at": now, "finished_at": now})
+    print(f"Задание {job.id} ({job.kind}): {values['status']} за {progress['duration_ms']:.0f} мс")
+
+
+# Возвращает в очередь задания воркеров, которые перестали отмечаться.
+# Отмененное админом задание в очередь не возвращается: иначе другой воркер выполнил бы его заново.
+async def requeue_stale_jobs() -> int:
+    stale_before = _now() - timedelta(seconds=JOB_STALE_SECONDS)
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Job)
+            .where(Job.status == JOB_RUNNING, Job.heartbeat_at < stale_before, Job.cancel_requested == True)
+            .values(status=JOB_CANCELLED, finished_at=_now())
+        )
+        await db.execute(
+            update(Job)
+            .where(Job.status == JOB_RUNNING, Job.heartbeat_at < stale_before, Job.attempts >= JOB_MAX_ATTEMPTS)
+            .values(status=JOB_FAILED, finished_at=_now(), error="Воркер перестал отвечать")
+        )
+        result = await db.execute(
+            update(Job)
+            .where(Job.status == JOB_RUNNING, Job.heartbeat_at < stale_before)
+            .values(status=JOB_QUEUED, worker=None)
+        )
+        await db.commit()
+        return result.rowcount or 0
+
+
+async def _worker_loop(number: int):
+    global _last_reclaim
+    while True:
+        try:
+            if time.monotonic() - _last_reclaim >= JOB_STALE_SECONDS / 2:
+                _last_reclaim = time.monotonic()
+                requeued = await requeue_stale_jobs()
+                if requeued:
+                    print(f"Брошенных заданий возвращено в очередь: {requeued}")
+
+            job = await claim_job()
+            if job is not None:
+                await run_claimed_job(job)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка воркера заданий {number}: {type(e).__name__}: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_job_workers(concurrency: int = JOB_WORKERS):
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for number in range(concurrency):
+        _workers.append(asyncio.create_task(_worker_loop(number)))
+    print(f"Воркеры заданий запущены: {concurrency}")
+
+
+async def stop_job_workers():
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,131 @@
+import json
+import math
+import os
+import time
+from dotenv import load_dotenv
+from database import pool_wait_stats
+
+load_dotenv()
+LOAD_SHED_ENABLED = os.getenv("LOAD_SHED_ENABLED", "true").lower() == "true"
+# Перегрузка: среднее ожидание соединения из пула (мс) или число запросов в обработке.
+# При первом пороге отклоняются второстепенные запросы, при втором - и обычные чтения.
+LOAD_SHED_POOL_WAIT_MS = float(os.getenv("LOAD_SHED_POOL_WAIT_MS", "100"))
+LOAD_SHED_POOL_WAIT_CRITICAL_MS = float(os.getenv("LOAD_SHED_POOL_WAIT_CRITICAL_MS", "1000"))
+LOAD_SHED_MAX_IN_FLIGHT = int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT", "100"))
+LOAD_SHED_MAX_IN_FLIGHT_CRITICAL = int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT_CRITICAL", "300"))
+LOAD_SHED_RETRY_AFTER_SECONDS = float(os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", "2"))
+
+# critical - не отклоняются никогда, low - отклоняются первыми
+PRIORITY_CRITICAL = "critical"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+PRIORITIES = (PRIORITY_CRITICAL, PRIORITY_NORMAL, PRIORITY_LOW)
+
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+CRITICAL_PATHS = ("/health", "/api/v3/admin/load")
+LOW_PRIORITY_PREFIXES = ("/api/v3/stats", "/api/v3/tasks/search")
+
+# Уровень перегрузки: 0 - норма, 1 - отклоняются low, 2 - отклоняются low и normal
+LEVEL_OK = 0
+LEVEL_SHED_LOW = 1
+LEVEL_SHED_NORMAL = 2
+
+_state = {
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "level": LEVEL_OK,
+    "admitted": dict.fromkeys(PRIORITIES, 0),
+    "shed": dict.fromkeys(PRIORITIES, 0),
+    "last_shed_at": None,
+}
+
+
+def request_priority(method: str, path: str) -> str:
+    # Изменения задач, проверка здоровья и счетчики перегрузки проходят всегда
+    if path in CRITICAL_PATHS or (method in MUTATING_METHODS and path.startswith("/api/v3/tasks")):
+        return PRIORITY_CRITICAL
+    # Статистика, поиск и списки админки - то, без чего клиенты проживут пару секунд
+    if path.startswith(LOW_PRIORITY_PREFIXES) or (method == "GET" and path.startswith("/api/v3/admin")):
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+
+def overload_level(in_flight: int, pool_wait_ms: float) -> int:
+    if in_flight >= LOAD_SHED_MAX_IN_FLIGHT_CRITICAL or pool_wait_ms >= LOAD_SHED_POOL_WAIT_CRITICAL_MS:
+        return LEVEL_SHED_NORMAL
+    if in_flight >= LOAD_SHED_MAX_IN_FLIGHT or pool_wait_ms >= LOAD_SHED_POOL_WAIT_MS:
+        return LEVEL_SHED_LOW
+    return LEVEL_OK
+
+
+def should_shed(priority: str, level: int) -> bool:
+    if priority == PRIORITY_LOW:
+        return level >= LEVEL_SHED_LOW
+    if priority == PRIORITY_NORMAL:
+        return level >= LEVEL_SHED_NORMAL
+    return False
+
+
+def get_stats() -> dict:
+    return {
+        "enabled": LOAD_SHED_ENABLED,
+        "level": _state["level"],
+        "in_flight": _state["in_flight"],
+        "max_in_flight": _state["max_in_flight"],
+        "pool_wait_ms": round(pool_wait_stats.recent_wait() * 1000, 2),
+        "pool_waiting": len(pool_wait_stats.waiting),
+        "pool_checkouts": pool_wait_stats.checkouts,
+        "admitted": dict(_state["admitted"]),
+        "shed": dict(_state["shed"]),
+        "last_shed_at": _state["last_shed_at"],
+        "thresholds": {
+            "pool_wait_ms": LOAD_SHED_POOL_WAIT_MS,
+            "pool_wait_critical_ms": LOAD_SHED_POOL_WAIT_CRITICAL_MS,
+            "max_in_flight": LOAD_SHED_MAX_IN_FLIGHT,
+            "max_in_flight_critical": LOAD_SHED_MAX_IN_FLIGHT_CRITICAL,
+        },
+    }
+
+
+# Отклоняет часть запросов с 503, пока БД не успевает выдавать соединения
+# или в обработке слишком много запросов: очередь не растет, пока клиенты ждут таймаута
+class LoadSheddingMiddleware:
+    def __init__(self, app, enabled: bool = LOAD_SHED_ENABLED):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        priority = request_priority(scope["method"], scope["path"])
+        level = overload_level(_state["in_flight"], pool_wait_stats.recent_wait() * 1000)
+        _state["level"] = level
+
+        if should_shed(priority, level):
+            _state["shed"][priority] += 1
+            _state["last_shed_at"] = time.time()
+            await self._reject(send)
+            return
+
+        _state["admitted"][priority] += 1
+        _state["in_flight"] += 1
+        _state["max_in_flight"] = max(_state["max_in_flight"], _state["in_flight"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _state["in_flight"] -= 1
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Сервер перегружен, повторите позже"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(LOAD_SHED_RETRY_AFTER_SECONDS))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
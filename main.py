@@ -1,26 +1,75 @@
+import asyncio
+import importlib
 from fastapi import FastAPI, Depends
 from contextlib import asynccontextmanager
-from database import init_db, get_async_session
+from database import init_db, prewarm_pool, get_async_session, AsyncSessionLocal, ReadYourWritesMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
 from routers import tasks, stats, auth, admin
 from scheduler import start_scheduler
+from jobs import start_job_workers, stop_job_workers
+from reminders import start_reminder_dispatcher, stop_reminder_dispatcher
+from group_commit import stop_group_commit
+from utils import reconcile_task_counters
+from compression import CompressionMiddleware
+from load_shedding import LoadSheddingMiddleware
+from slow_queries import SlowQuerySourceMiddleware
+from tracing import TracingMiddleware, close_exporters
+import auth_utils
+
+
+async def start_background_services(app: FastAPI):
+    # Тяжелые импорты выполняются в потоке, не блокируя обработку первых запросов
+    await asyncio.gather(
+        asyncio.to_thread(importlib.import_module, "apscheduler.schedulers.asyncio"),
+        asyncio.to_thread(auth_utils.warm_up),
+    )
+
+    # Запуск планировщика
+    app.state.scheduler = start_scheduler()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Запуск приложения...")
     print("Инициализация базы данных...")
-    await init_db()
+    added_columns = await init_db()
+    # Прогрев пула - после проверки схемы, чтобы они не делили соединения пула
+    await prewarm_pool()
     print("База данных инициализирована")
 
-    # Запуск планировщика
-    scheduler=start_scheduler()
+    # Счетчики задач только что добавлены в существующую таблицу - заполняем их
+    if ("users", "tasks_count") in added_columns:
+        async with AsyncSessionLocal() as db:
+            await reconcile_task_counters(db)
+        print("Счетчики задач пользователей заполнены")
+
+    # Воркеры фоновых заданий (очередь в таблице jobs)
+    start_job_workers()
+    # Отправка напоминаний о дедлайнах на вебхуки пользователей
+    start_reminder_dispatcher()
+
+    app.state.scheduler = None
+    background = asyncio.create_task(start_background_services(app))
     print("Приложение готово к работе!")
     yield
 
-    print("Остановка планирвщика...")
-    scheduler.shutdown()
+    try:
+        await background
+    except Exception as e:
+        # Остальные службы все равно нужно остановить
+        print(f"Ошибка фонового запуска: {type(e).__name__}: {e}")
+    # Изменения, ожидающие группового коммита, применяются до остановки
+    await stop_group_commit()
+    if app.state.scheduler is not None:
+        print("Остановка планирвщика...")
+        app.state.scheduler.shutdown()
+    print("Остановка воркеров заданий...")
+    await stop_job_workers()
+    print("Остановка диспетчера напоминаний...")
+    await stop_reminder_dispatcher()
+    # Дописываем буферизованные трассы в файл
+    close_exporters()
     print("Остановка приложения...")
 
 
@@ -34,6 +83,17 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Сжатие больших ответов (списки задач) в zstd/gzip
+app.add_middleware(CompressionMiddleware)
+# Привязка к основной БД после записи (read-your-writes при работе с репликами)
+app.add_middleware(ReadYourWritesMiddleware)
+# Маршрут запроса для журнала медленных запросов
+app.add_middleware(SlowQuerySourceMiddleware)
+# Трассировка запросов (спаны фаз, заголовок traceparent)
+app.add_middleware(TracingMiddleware)
+# Отклонение второстепенных запросов при перегрузке БД (внешний слой - до сжатия и роутинга)
+app.add_middleware(LoadSheddingMiddleware)
+
 app.include_router(tasks.router, prefix="/api/v3")
 app.include_router(stats.router, prefix="/api/v3")
 app.include_router(auth.router, prefix="/api/v3")
@@ -1,6 +1,12 @@
-from models.task import Task
+from models.task import Task, TaskArchive
 from models.user import User, UserRole
+from models.scheduler_lease import SchedulerLease
+from models.scheduler_run import SchedulerRun
+from models.completion_rollup import CompletionRollup, CompletionRollupStale
+from models.job import Job
+from models.task_tag import TaskTag
+from models.reminder import Reminder
 from database import Base
 
 
-__all__ = ["Base", "User", "UserRole", "Task"]
\ No newline at end of file
+__all__ = ["Base", "User", "UserRole", "Task", "TaskArchive", "SchedulerLease", "SchedulerRun", "CompletionRollup", "CompletionRollupStale", "Job", "TaskTag", "Reminder"]
@@ -0,0 +1,64 @@
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Index
+from database import Base
+
+
+# Дневной свод по выполненным задачам: гистограммы времени выполнения и опоздания.
+# Одна строка - число задач пользователя за день в квадранте, попавших в корзину гистограммы.
+class CompletionRollup(Base):
+    __tablename__ = "task_completion_rollups"
+    __table_args__ = (
+        # Статистика администратора по всем пользователям за период
+        Index("ix_task_completion_rollups_day", "day"),
+    )
+
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    day = Column(
+        Date,
+        primary_key=True  # День выполнения (UTC)
+    )
+    quadrant = Column(
+        String(2),
+        primary_key=True
+    )
+    metric = Column(
+        String(8),
+        primary_key=True  # "ttc" - время выполнения, "late" - опоздание относительно дедлайна
+    )
+    bucket = Column(
+        Integer,
+        primary_key=True  # Номер логарифмической корзины (см. rollups.value_to_bucket)
+    )
+    count = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"<CompletionRollup(user_id={self.user_id}, day={self.day}, quadrant='{self.quadrant}', "
+            f"metric='{self.metric}', bucket={self.bucket}, count={self.count})>"
+        )
+
+
+# День свода, который нужно пересчитать: выполненную задачу удалили или изменили после того,
+# как день попал в свод. rollups.rollup_completions пересчитывает такие дни и удаляет отметки.
+class CompletionRollupStale(Base):
+    __tablename__ = "task_completion_rollup_stale"
+
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    day = Column(
+        Date,
+        primary_key=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<CompletionRollupStale(user_id={self.user_id}, day={self.day})>"
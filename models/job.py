@@ -0,0 +1,116 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, JSON, ForeignKey, Index, text
+from database import Base, UTCDateTime
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+# Фоновое задание: ставится в очередь из админки, выполняется воркерами приложения
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Воркеры забирают самые старые задания из очереди
+        Index("ix_jobs_status_id", "status", "id"),
+        Index("ix_jobs_kind_created", "kind", "created_at"),
+        # Одно активное задание на вид и параметры, даже при одновременных POST /admin/jobs
+        Index(
+            "ux_jobs_active_key",
+            "dedupe_key",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+            sqlite_where=text("status IN ('queued', 'running')")
+        ),
+    )
+
+    id = Column(
+        Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+    kind = Column(
+        String(100),
+        nullable=False  # Имя обработчика из jobs.JOB_HANDLERS
+    )
+    params = Column(
+        JSON,
+        nullable=False,
+        default=dict
+    )
+    dedupe_key = Column(
+        String(64),
+        nullable=True  # sha256 от вида и параметров (JSON в PostgreSQL нельзя сравнивать в индексе)
+    )
+    status = Column(
+        String(16),
+        nullable=False,
+        default=JOB_QUEUED
+    )
+    progress = Column(
+        JSON,
+        nullable=False,
+        default=dict  # Счетчики обработчика, сохраняются по ходу выполнения
+    )
+    cancel_requested = Column(
+        Boolean,
+        nullable=False,
+        default=False
+    )
+    attempts = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    worker = Column(
+        String(255),
+        nullable=True  # Воркер, выполняющий задание
+    )
+    created_by = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='SET NULL'),
+        nullable=True
+    )
+    created_at = Column(
+        UTCDateTime(),
+        nullable=False
+    )
+    started_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    heartbeat_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    finished_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    error = Column(
+        Text,
+        nullable=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<Job(id={self.id}, kind='{self.kind}', status='{self.status}')>"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": self.progress,
+            "cancel_requested": self.cancel_requested,
+            "attempts": self.attempts,
+            "worker": self.worker,
+            "created_by": self.created_by,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "heartbeat_at": self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error
+        }
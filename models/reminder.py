@@ -0,0 +1,65 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index, text
+from database import Base, UTCDateTime
+
+REMINDER_PENDING = "pending"
+REMINDER_SENT = "sent"
+REMINDER_FAILED = "failed"
+
+
+# Напоминание о дедлайне задачи; создается только для пользователей с вебхуком.
+# Строка удаляется вместе с задачей (в том числе при переносе в архив).
+class Reminder(Base):
+    __tablename__ = "reminders"
+    __table_args__ = (
+        # Очередь диспетчера: ближайшее напоминание и пачка наступивших (частичный индекс - только ожидающие)
+        Index(
+            "ix_reminders_due",
+            "remind_at",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'")
+        ),
+        # Удаление напоминаний пользователя при отключении вебхука
+        Index("ix_reminders_user", "user_id"),
+    )
+
+    task_id = Column(
+        Integer,
+        ForeignKey('tasks.id', ondelete='CASCADE'),
+        primary_key=True  # Одно напоминание на задачу
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    # Дедлайн на момент планирования: если он изменился, напоминание устарело
+    deadline_at = Column(
+        UTCDateTime(),
+        nullable=False
+    )
+    # Когда отправить; при неудачной отправке сдвигается на время следующей попытки
+    remind_at = Column(
+        UTCDateTime(),
+        nullable=False
+    )
+    status = Column(
+        String(16),
+        nullable=False,
+        default=REMINDER_PENDING
+    )
+    attempts = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    sent_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    last_error = Column(
+        Text,
+        nullable=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<Reminder(task_id={self.task_id}, remind_at={self.remind_at}, status='{self.status}')>"
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Boolean
+from database import Base, UTCDateTime
+
+
+# Аренда (lease) задачи планировщика: одну запись может держать только один воркер
+class SchedulerLease(Base):
+    __tablename__ = "scheduler_leases"
+
+    name = Column(
+        String(100),
+        primary_key=True  # id задачи или "id:номер_партиции"
+    )
+    owner = Column(
+        String(255),
+        nullable=False  # Воркер, который держит аренду
+    )
+    run_key = Column(
+        String(32),
+        nullable=False  # Плановое время запуска, к которому относится аренда
+    )
+    expires_at = Column(
+        UTCDateTime(),
+        nullable=False
+    )
+    completed = Column(
+        Boolean,
+        nullable=False,
+        default=False
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"<SchedulerLease(name='{self.name}', owner='{self.owner}', "
+            f"run_key='{self.run_key}', completed={self.completed})>"
+        )
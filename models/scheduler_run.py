@@ -0,0 +1,80 @@
+from sqlalchemy import Column, Integer, String, Float, Text, Index
+from database import Base, UTCDateTime
+
+
+# История запусков задач планировщика
+class SchedulerRun(Base):
+    __tablename__ = "scheduler_runs"
+    __table_args__ = (
+        Index("ix_scheduler_runs_job_started", "job_id", "started_at"),
+    )
+
+    id = Column(
+        Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+    job_id = Column(
+        String(100),
+        nullable=False
+    )
+    partition = Column(
+        Integer,
+        nullable=True  # None - задача выполнялась целиком
+    )
+    worker = Column(
+        String(255),
+        nullable=False
+    )
+    started_at = Column(
+        UTCDateTime(),
+        nullable=False
+    )
+    finished_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    duration_ms = Column(
+        Float,
+        nullable=True
+    )
+    rows_scanned = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    rows_updated = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    batches = Column(
+        Integer,
+        nullable=False,
+        default=0
+    )
+    error = Column(
+        Text,
+        nullable=True
+    )
+
+    def __repr__(self) -> str:
+        return (
+            f"<SchedulerRun(id={self.id}, job_id='{self.job_id}', "
+            f"rows_updated={self.rows_updated}, error={self.error is not None})>"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "partition": self.partition,
+            "worker": self.worker,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "duration_ms": self.duration_ms,
+            "rows_scanned": self.rows_scanned,
+            "rows_updated": self.rows_updated,
+            "batches": self.batches,
+            "error": self.error
+        }
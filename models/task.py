@@ -1,17 +1,11 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, Index, text
+from sqlalchemy.orm import relationship, declared_attr
 from sqlalchemy.sql import func
-from database import Base
+from database import Base, UTCDateTime
 
-class Task(Base):
-    __tablename__ = "tasks"
 
-    id = Column(
-        Integer,
-        primary_key=True,
-        index=True,
-        autoincrement=True
-    )
+# Общие колонки задачи для основной таблицы и архива
+class TaskColumnsMixin:
     title = Column(
         String(255),
         nullable=False
@@ -26,7 +20,7 @@ class Task(Base):
         default=False
     )
     deadline_at = Column(
-        DateTime(timezone=True),
+        UTCDateTime(),
         nullable=True
     )
     quadrant = Column(
@@ -39,30 +33,53 @@ class Task(Base):
         default=False
     )
     created_at = Column(
-        DateTime(timezone=True),
+        UTCDateTime(),
         server_default=func.now(),
         nullable=False
     )
     completed_at = Column(
-        DateTime(timezone=True),
+        UTCDateTime(),
         nullable=True
     )
-
-    user_id = Column(
+    # Версия для оптимистичной блокировки: растет при каждом изменении через API, отдается в ETag
+    version = Column(
         Integer,
-        ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False,
-        index=True
+        default=1,
+        server_default="1"
     )
-
-    owner = relationship(
-        "User",
-        back_populates="tasks"
+    # Правило повторения (recurrence.parse_rule) - только у исходной задачи серии
+    recurrence_rule = Column(
+        String(255),
+        nullable=True
+    )
+    # Ближайшее повторение серии, которое еще не создано (None - серия закончилась)
+    recurrence_next_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+    # У повторения: id исходной задачи серии и плановое время повторения
+    recurrence_parent_id = Column(
+        Integer,
+        nullable=True
+    )
+    occurrence_at = Column(
+        UTCDateTime(),
+        nullable=True
     )
 
+    @declared_attr
+    def user_id(cls):
+        return Column(
+            Integer,
+            ForeignKey('users.id', ondelete='CASCADE'),
+            nullable=False,
+            index=True
+        )
+
     def __repr__(self) -> str:
         return (
-            f"<Task(id={self.id}, title='{self.title[:30]}...', "
+            f"<{type(self).__name__}(id={self.id}, title='{self.title[:30]}...', "
             f"quadrant='{self.quadrant}', completed={self.completed})>"
         )
 
@@ -77,5 +94,64 @@ class Task(Base):
             "completed": self.completed,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "version": self.version,
+            "recurrence_rule": self.recurrence_rule,
+            "recurrence_parent_id": self.recurrence_parent_id,
+            "occurrence_at": self.occurrence_at.isoformat() if self.occurrence_at else None,
             "user_id": self.user_id
-        }
\ No newline at end of file
+        }
+
+
+# Активные и недавно выполненные задачи ("горячая" таблица)
+class Task(TaskColumnsMixin, Base):
+    __tablename__ = "tasks"
+    __table_args__ = (
+        # Выборка выполненных задач для переноса в архив
+        Index("ix_tasks_completed_at", "completed_at"),
+        # Составные индексы для GET /tasks/query (см. query_planner.QUERY_PLANS)
+        Index("ix_tasks_user_created", "user_id", "created_at", "id"),
+        Index("ix_tasks_user_deadline", "user_id", "deadline_at", "id"),
+        Index("ix_tasks_user_quadrant_created", "user_id", "quadrant", "created_at", "id"),
+        Index("ix_tasks_user_completed_created", "user_id", "completed", "created_at", "id"),
+        Index("ix_tasks_user_completed_deadline", "user_id", "completed", "deadline_at", "id"),
+        # Одно повторение серии на плановое время: повторные запуски генерации не создают дублей
+        Index("ux_tasks_recurrence_occurrence", "recurrence_parent_id", "occurrence_at", unique=True),
+        # Серии, у которых следующее повторение вошло в окно генерации (частичный индекс - только активные серии)
+        Index(
+            "ix_tasks_recurrence_next",
+            "recurrence_next_at",
+            postgresql_where=text("recurrence_next_at IS NOT NULL"),
+            sqlite_where=text("recurrence_next_at IS NOT NULL")
+        ),
+    )
+
+    id = Column(
+        Integer,
+        primary_key=True,
+        index=True,
+        autoincrement=True
+    )
+
+    owner = relationship(
+        "User",
+        back_populates="tasks"
+    )
+
+
+# Выполненные задачи, перенесенные из tasks ("холодная" таблица), id сохраняются
+class TaskArchive(TaskColumnsMixin, Base):
+    __tablename__ = "tasks_archive"
+    __table_args__ = (
+        # Диапазоны по времени выполнения: сводки выполнения (rollups.py)
+        Index("ix_tasks_archive_completed_at", "completed_at"),
+        # Ветка архива в GET /tasks/query (см. query_planner.QUERY_PLANS); все задачи архива выполнены,
+        # поэтому индексы с completed в префиксе не нужны
+        Index("ix_tasks_archive_user_created", "user_id", "created_at", "id"),
+        Index("ix_tasks_archive_user_deadline", "user_id", "deadline_at", "id"),
+    )
+
+    id = Column(
+        Integer,
+        primary_key=True,
+        autoincrement=False
+    )
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from database import Base
+
+
+# Теги задач. task_id - id в tasks или tasks_archive (при архивации id сохраняется),
+# поэтому внешнего ключа на задачу нет: теги удаляются вместе с задачей явно.
+class TaskTag(Base):
+    __tablename__ = "task_tags"
+    __table_args__ = (
+        # Фильтр по тегам и статистика пользователя
+        Index("ix_task_tags_user_tag", "user_id", "tag", "task_id"),
+        # Фильтр по тегам у администратора (все пользователи)
+        Index("ix_task_tags_tag", "tag", "task_id"),
+    )
+
+    task_id = Column(
+        Integer,
+        primary_key=True
+    )
+    tag = Column(
+        String(50),
+        primary_key=True  # В нижнем регистре (tags.normalize_tags)
+    )
+    user_id = Column(
+        Integer,
+        ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    def __repr__(self) -> str:
+        return f"<TaskTag(task_id={self.task_id}, tag='{self.tag}')>"
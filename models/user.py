@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
-from database import Base
+from database import Base, UTCDateTime
 import enum
 
 
@@ -11,6 +11,10 @@ class UserRole(enum.Enum):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Keyset-пагинация списка пользователей с сортировкой по числу задач
+        Index("ix_users_tasks_count_id", "tasks_count", "id"),
+    )
 
     id = Column(
         Integer,
@@ -44,12 +48,45 @@ class User(Base):
         default=UserRole.USER  # По умолчанию - обычный пользователь
     )
 
+    # Счетчики задач пользователя, обновляются вместе с изменением задач
+    tasks_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+
+    completed_tasks_count = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+
+    # Время пометки на удаление; задачи такого пользователя удаляются в фоне
+    deleted_at = Column(
+        UTCDateTime(),
+        nullable=True
+    )
+
+    # Вебхук для напоминаний о дедлайнах (None - напоминания не отправляются)
+    webhook_url = Column(
+        String(2048),
+        nullable=True
+    )
+    # Ключ HMAC-подписи запросов вебхука, выдается пользователю при настройке
+    webhook_secret = Column(
+        String(64),
+        nullable=True
+    )
+
 
     # Связь с задачами (один пользователь -> много задач)
     tasks = relationship(
         "Task",
         back_populates="owner",  # Обратная связь
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        passive_deletes=True  # Задачи удаляет ON DELETE CASCADE, без загрузки в память
     )
 
     def __repr__(self) -> str:
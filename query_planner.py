@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+# Разрешенные ключи сортировки для GET /tasks/query
+SORT_KEYS = ["created_at", "deadline_at", "id"]
+
+# Белый список планов для каждой таблицы запроса: индекс, колонки с условием равенства (префикс индекса)
+# и колонка, по которой индекс отдает строки уже отсортированными. Планы перечислены от самого
+# селективного к наименее селективному. SQL планировщик не меняет: это индекс, которым, как ожидается,
+# воспользуется СУБД для каждой ветки запроса (составные индексы заведены под эти сочетания).
+# Планы с "dialects" есть только в указанных СУБД (в SQLite первичный ключ - это rowid, а не индекс).
+QUERY_PLANS = {
+    "tasks": [
+        {"index": "ix_tasks_user_quadrant_created", "equality": ("user_id", "quadrant"), "sort": "created_at"},
+        {"index": "ix_tasks_user_completed_created", "equality": ("user_id", "completed"), "sort": "created_at"},
+        {"index": "ix_tasks_user_completed_deadline", "equality": ("user_id", "completed"), "sort": "deadline_at"},
+        {"index": "ix_tasks_user_created", "equality": ("user_id",), "sort": "created_at"},
+        {"index": "ix_tasks_user_deadline", "equality": ("user_id",), "sort": "deadline_at"},
+        {"index": "ix_tasks_user_id", "equality": ("user_id",), "sort": None},
+        {"index": "tasks_pkey", "equality": (), "sort": "id", "dialects": ("postgresql",)},
+    ],
+    # В архиве все задачи выполнены: условие completed не сужает выборку, индексы с ним не нужны
+    "tasks_archive": [
+        {"index": "ix_tasks_archive_user_created", "equality": ("user_id",), "sort": "created_at"},
+        {"index": "ix_tasks_archive_user_deadline", "equality": ("user_id",), "sort": "deadline_at"},
+        {"index": "ix_tasks_archive_user_id", "equality": ("user_id",), "sort": None},
+        {"index": "tasks_archive_pkey", "equality": (), "sort": "id", "dialects": ("postgresql",)},
+    ],
+}
+
+
+# Выбирает индекс таблицы под набор условий равенства и ключ сортировки
+def choose_plan(equality_columns: set, sort_key: str, table: str = "tasks",
+                dialect: str = "postgresql") -> Optional[dict]:
+    for plan in QUERY_PLANS[table]:
+        if dialect not in plan.get("dialects", (dialect,)):
+            continue
+        if not set(plan["equality"]) <= equality_columns:
+            continue
+        if plan["sort"] == sort_key or plan["sort"] is None:
+            return plan
+    return None
+
+
+# Ожидаемые индексы веток запроса: "tasks=ix_tasks_user_created; tasks_archive=ix_tasks_archive_user_created"
+def describe_plans(equality_columns: set, sort_key: str, tables, dialect: str) -> str:
+    parts = []
+    for table in tables:
+        plan = choose_plan(equality_columns, sort_key, table, dialect)
+        parts.append(f"{table}={plan['index'] if plan else 'seq_scan'}")
+    return "; ".join(parts)
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps({"v": sort_value, "id": row_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+# Возвращает (значение ключа сортировки, id) или вызывает ValueError
+def decode_cursor(cursor: str, sort_key: str) -> tuple:
+    data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    value = data["v"]
+    if sort_key != "id":
+        value = datetime.fromisoformat(value)
+    return value, int(data["id"])
+
+
+# EXPLAIN для произвольного запроса SQLAlchemy с сохранением параметров
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain_postgresql(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+# Оценка числа строк по плану PostgreSQL вместо COUNT(*); для других СУБД - None
+async def estimate_count(db: AsyncSession, statement) -> Optional[int]:
+    if db.get_bind().dialect.name != "postgresql":
+        return None
+
+    result = await db.execute(Explain(statement))
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
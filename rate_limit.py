@@ -0,0 +1,213 @@
+import asyncio
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+load_dotenv()
+# Лимиты в формате "запросов/секунд": емкость корзины и время ее полного восполнения.
+# Пустая строка или 0 отключают лимит.
+AUTH_LOGIN_IP_RATE = os.getenv("AUTH_LOGIN_IP_RATE", "30/60")
+AUTH_LOGIN_ACCOUNT_RATE = os.getenv("AUTH_LOGIN_ACCOUNT_RATE", "10/300")
+AUTH_REGISTER_IP_RATE = os.getenv("AUTH_REGISTER_IP_RATE", "5/60")
+# redis://... - общие корзины для всех процессов, по умолчанию - в памяти процесса
+RATE_LIMIT_BACKEND_URL = os.getenv("RATE_LIMIT_BACKEND_URL", "")
+# Сколько корзин хранится в памяти (самые старые вытесняются)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Брать IP клиента из X-Forwarded-For (только за доверенным прокси)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+# Одновременных запросов, считающих bcrypt, и сколько секунд запрос может ждать своей очереди
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5"))
+
+
+# Хранилище корзин. take() при наличии токена списывает cost токенов и возвращает 0,
+# иначе возвращает, через сколько секунд токен появится. cost=0 - только проверка.
+class RateLimitBackend(ABC):
+    @abstractmethod
+    async def take(self, key: str, capacity: float, refill_per_second: float, cost: int = 1) -> float:
+        ...
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # ключ -> (токены, время обновления)
+        self.buckets = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, cost: int = 1) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= cost
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+
+        self.buckets[key] = (tokens, now)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+
+# Та же корзина в Redis: списание атомарно в Lua-скрипте, время берется с сервера Redis
+REDIS_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisBackend(RateLimitBackend):
+    def __init__(self, url: str):
+        # redis - необязательная зависимость, нужна только для общего хранилища
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(REDIS_TAKE_SCRIPT)
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, cost: int = 1) -> float:
+        result = await self.script(keys=[f"rate_limit:{key}"], args=[capacity, refill_per_second, cost])
+        return float(result)
+
+
+def _create_backend() -> RateLimitBackend:
+    if RATE_LIMIT_BACKEND_URL.startswith(("redis://", "rediss://")):
+        return RedisBackend(RATE_LIMIT_BACKEND_URL)
+    return MemoryBackend()
+
+
+_backend: Optional[RateLimitBackend] = None
+
+
+def get_backend() -> RateLimitBackend:
+    global _backend
+    if _backend is None:
+        _backend = _create_backend()
+    return _backend
+
+
+# Подмена хранилища корзин (например, своим общим хранилищем)
+def set_backend(backend: RateLimitBackend):
+    global _backend
+    _backend = backend
+
+
+class RateLimit:
+    def __init__(self, name: str, rate: str):
+        self.name = name
+        self.capacity = 0.0
+        self.refill_per_second = 0.0
+        if rate and rate != "0":
+            count, _, seconds = rate.partition("/")
+            self.capacity = float(count)
+            self.refill_per_second = self.capacity / float(seconds or 1)
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    async def _take(self, key: str, cost: int) -> float:
+        try:
+            return await get_backend().take(f"{self.name}:{key}", self.capacity, self.refill_per_second, cost)
+        except Exception as error:
+            # Недоступное общее хранилище не должно закрывать вход в приложение
+            print(f"Ошибка хранилища лимитов ({self.name}): {error}")
+            return 0.0
+
+    # Отклоняет запрос с 429, если корзина пуста; cost=0 - проверить, не списывая токен
+    async def check(self, key: str, cost: int = 1):
+        if not self.enabled:
+            return
+        retry_after = await self._take(key, cost)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Слишком много попыток, повторите позже",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+
+    # Списывает токен без отказа (запрос уже обработан, например неудачный вход)
+    async def spend(self, key: str):
+        if self.enabled:
+            await self._take(key, 1)
+
+
+login_ip_limit = RateLimit("login_ip", AUTH_LOGIN_IP_RATE)
+login_account_limit = RateLimit("login_account", AUTH_LOGIN_ACCOUNT_RATE)
+register_ip_limit = RateLimit("register_ip", AUTH_REGISTER_IP_RATE)
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def login_account_key(username: str) -> str:
+    return username.strip().lower()
+
+
+# Зависимости эндпоинтов входа и регистрации: проверяются до запросов к БД и bcrypt.
+# Форма входа разбирается FastAPI один раз и попадает и сюда, и в обработчик.
+# Лимит аккаунта считает только неудачные попытки (record_failed_login), иначе любой,
+# кто знает email, мог бы заблокировать вход владельцу.
+async def limit_login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    await login_ip_limit.check(client_ip(request))
+    await login_account_limit.check(login_account_key(form_data.username), cost=0)
+
+
+async def record_failed_login(username: str):
+    await login_account_limit.spend(login_account_key(username))
+
+
+async def limit_register(request: Request):
+    await register_ip_limit.check(client_ip(request))
+
+
+_hash_semaphore: Optional[asyncio.Semaphore] = None
+
+
+# Место в очереди на bcrypt на все время запроса: без свободного места запрос
+# отклоняется, не дожидаясь, пока займет поток и соединение с БД
+async def password_hash_slot():
+    global _hash_semaphore
+    if _hash_semaphore is None:
+        _hash_semaphore = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+    try:
+        await asyncio.wait_for(_hash_semaphore.acquire(), timeout=PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите позже",
+            headers={"Retry-After": str(max(1, math.ceil(PASSWORD_HASH_QUEUE_TIMEOUT)))},
+        )
+    try:
+        yield
+    finally:
+        _hash_semaphore.release()
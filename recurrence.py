@@ -0,0 +1,332 @@
+import calendar
+import os
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional, Tuple
+from sqlalchemy import select, insert, update, delete, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models.task import Task
+from models.user import User
+from models.task_tag import TaskTag
+from tags import load_tags
+from reminders import schedule_reminders
+from utils import calculate_urgency, define_quadrant
+
+load_dotenv()
+# На сколько дней вперед создаются повторения серий
+RECURRENCE_WINDOW_DAYS = int(os.getenv("RECURRENCE_WINDOW_DAYS", "14"))
+# Сколько серий обрабатывается за одну транзакцию
+RECURRENCE_BATCH_SIZE = int(os.getenv("RECURRENCE_BATCH_SIZE", "2000"))
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+RULE_SHORTCUTS = {"daily": "FREQ=DAILY", "weekly": "FREQ=WEEKLY", "monthly": "FREQ=MONTHLY"}
+
+
+# Подмножество RRULE (RFC 5545): FREQ, INTERVAL, BYDAY (только для WEEKLY), COUNT, UNTIL.
+# Время повторений - время исходной задачи в UTC.
+class RecurrenceRule(NamedTuple):
+    freq: str
+    interval: int = 1
+    by_day: Tuple[int, ...] = ()  # Дни недели 0-6 (пн-вс)
+    count: Optional[int] = None  # Всего задач в серии, включая исходную
+    until: Optional[datetime] = None
+
+    def to_string(self) -> str:
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.by_day:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[day] for day in self.by_day))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append("UNTIL=" + self.until.strftime("%Y%m%dT%H%M%SZ"))
+        return ";".join(parts)
+
+
+def _parse_until(value: str) -> datetime:
+    try:
+        if "T" in value:
+            return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+        # Дата без времени включает весь день
+        day = datetime.strptime(value, "%Y%m%d").replace(tzinfo=timezone.utc)
+        return day + timedelta(days=1, microseconds=-1)
+    except ValueError:
+        raise ValueError(f"Некорректный UNTIL: {value}")
+
+
+# Разбор правила; одинаковые строки правил разбираются один раз
+@lru_cache(maxsize=4096)
+def parse_rule(rule: str) -> RecurrenceRule:
+    text = RULE_SHORTCUTS.get(rule.strip().lower(), rule.strip())
+    if text.upper().startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+
+    fields = {}
+    for part in filter(None, text.split(";")):
+        name, _, value = part.partition("=")
+        name = name.strip().upper()
+        if name not in ("FREQ", "INTERVAL", "BYDAY", "COUNT", "UNTIL") or not value:
+            raise ValueError(f"Неподдерживаемая часть правила: {part}")
+        fields[name] = value.strip().upper()
+
+    freq = fields.get("FREQ")
+    if freq not in FREQUENCIES:
+        raise ValueError(f"FREQ должен быть одним из: {', '.join(FREQUENCIES)}")
+
+    try:
+        interval = int(fields.get("INTERVAL", "1"))
+        count = int(fields["COUNT"]) if "COUNT" in fields else None
+    except ValueError:
+        raise ValueError("INTERVAL и COUNT должны быть целыми числами")
+    if not 1 <= interval <= 1000:
+        raise ValueError("INTERVAL должен быть от 1 до 1000")
+    if count is not None and count < 1:
+        raise ValueError("COUNT должен быть положительным")
+
+    by_day = ()
+    if "BYDAY" in fields:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY поддерживается только с FREQ=WEEKLY")
+        days = fields["BYDAY"].split(",")
+        if not set(days) <= set(WEEKDAYS):
+            raise ValueError(f"BYDAY - дни недели из: {', '.join(WEEKDAYS)}")
+        by_day = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+
+    until = _parse_until(fields["UNTIL"]) if "UNTIL" in fields else None
+    return RecurrenceRule(freq, interval, by_day, count, until)
+
+
+# Каноническая запись правила для хранения (ValueError, если правило некорректно)
+def normalize_rule(rule: str) -> str:
+    return parse_rule(rule).to_string()
+
+
+def _add_months(value: datetime, months: int) -> datetime:
+    years, month = divmod(value.month - 1 + months, 12)
+    year = value.year + years
+    # 31 число в коротком месяце переносится на последний день месяца
+    day = min(value.day, calendar.monthrange(year, month + 1)[1])
+    return value.replace(year=year, month=month + 1, day=day)
+
+
+# Повторения серии (номер, время) позже after, по возрастанию времени.
+# Номер 0 - исходная задача (anchor), она сама не возвращается.
+def _iter_schedule(rule: RecurrenceRule, anchor: datetime, after: datetime) -> Iterator[Tuple[int, datetime]]:
+    if rule.freq == "MONTHLY":
+        months = (after.year - anchor.year) * 12 + after.month - anchor.month
+        index = max(1, months // rule.interval)
+        while True:
+            yield index, _add_months(anchor, index * rule.interval)
+            index += 1
+
+    if rule.freq == "DAILY" or not rule.by_day:
+        step = timedelta(days=rule.interval if rule.freq == "DAILY" else 7 * rule.interval)
+        index = max(1, (after - anchor) // step + 1)
+        while True:
+            yield index, anchor + index * step
+            index += 1
+
+    # WEEKLY с BYDAY: в первой неделе - только дни после исходной задачи
+    week_start = anchor - timedelta(days=anchor.weekday())
+    first_week = [day for day in rule.by_day if day > anchor.weekday()]
+    step = timedelta(weeks=rule.interval)
+    week = max(0, (after - week_start) // step)
+    while True:
+        days = first_week if week == 0 else rule.by_day
+        first_index = 1 if week == 0 else len(first_week) + (week - 1) * len(rule.by_day) + 1
+        for position, day in enumerate(days):
+            yield first_index + position, week_start + week * step + timedelta(days=day)
+        week += 1
+
+
+def iter_occurrences(rule: RecurrenceRule, anchor: datetime, after: datetime) -> Iterator[datetime]:
+    for index, occurrence_at in _iter_schedule(rule, anchor, after):
+        if rule.count is not None and index >= rule.count:
+            return
+        if rule.until is not None and occurrence_at > rule.until:
+            return
+        if occurrence_at > after:
+            yield occurrence_at
+
+
+def _insert_occurrences_stmt(dialect_name: str):
+    table = Task.__table__
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(table)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(table)
+    else:
+        raise RuntimeError(f"Генерация повторений не поддерживается для {dialect_name}")
+    # Повторение, которое уже создал другой воркер или прошлый запуск, пропускается;
+    # RETURNING отдает только вставленные строки - по ним увеличиваются счетчики и копируются теги
+    return stmt.on_conflict_do_nothing(
+        index_elements=["recurrence_parent_id", "occurrence_at"]
+    ).returning(
+        table.c.id, table.c.user_id, table.c.recurrence_parent_id, table.c.deadline_at, table.c.completed
+    )
+
+
+# Создает повторения серий до конца окна в текущей транзакции и сдвигает recurrence_next_at.
+# series - задачи или строки с колонками серии. Возвращает число созданных задач.
+async def materialize_occurrences(db: AsyncSession, series, now: Optional[datetime] = None) -> int:
+    now = now or datetime.now(timezone.utc)
+    horizon = now + timedelta(days=RECURRENCE_WINDOW_DAYS)
+
+    values = []
+    next_values = []
+    for task in series:
+        try:
+            rule = parse_rule(task.recurrence_rule)
+        except ValueError:
+            next_values.append({"series_id": task.id, "next_at": None})
+            continue
+
+        anchor = task.deadline_at or task.created_at
+        # Пропущенные повторения в прошлом (генерация долго не запускалась) не создаются
+        after = anchor if task.recurrence_next_at is None else task.recurrence_next_at - timedelta(microseconds=1)
+        after = max(after, now)
+
+        next_at = None
+        for occurrence_at in iter_occurrences(rule, anchor, after):
+            if occurrence_at > horizon:
+                next_at = occurrence_at
+                break
+            values.append({
+                "title": task.title,
+                "description": task.description,
+                "is_important": task.is_important,
+                "deadline_at": occurrence_at,
+                "quadrant": define_quadrant(task.is_important, calculate_urgency(occurrence_at)),
+                "completed": False,
+                "version": 1,
+                "user_id": task.user_id,
+                "recurrence_parent_id": task.id,
+                "occurrence_at": occurrence_at,
+            })
+        next_values.append({"series_id": task.id, "next_at": next_at})
+
+    created = {}
+    if values:
+        # executemany с RETURNING - многострочные INSERT ... VALUES пачками
+        result = await db.execute(_insert_occurrences_stmt(db.get_bind().dialect.name), values)
+        inserted = result.all()
+        for row in inserted:
+            created[row.user_id] = created.get(row.user_id, 0) + 1
+
+        # Повторения получают теги исходной задачи
+        series_tags = await load_tags(db, list({row.recurrence_parent_id for row in inserted}))
+        tag_values = [
+            {"task_id": row.id, "user_id": row.user_id, "tag": tag}
+            for row in inserted
+            for tag in series_tags.get(row.recurrence_parent_id, ())
+        ]
+        if tag_values:
+            await db.execute(insert(TaskTag), tag_values)
+
+        # И напоминания о дедлайне, если у пользователя настроен вебхук
+        await schedule_reminders(db, inserted, now, created=True)
+
+    users = User.__table__
+    if created:
+        await db.execute(
+            update(users)
+            .where(users.c.id == bindparam("counter_user_id"))
+            .values(tasks_count=users.c.tasks_count + bindparam("created")),
+            [{"counter_user_id": user_id, "created": count} for user_id, count in created.items()]
+        )
+
+    tasks = Task.__table__
+    if next_values:
+        await db.execute(
+            update(tasks)
+            .where(tasks.c.id == bindparam("series_id"))
+            .values(recurrence_next_at=bindparam("next_at", type_=tasks.c.recurrence_next_at.type)),
+            next_values
+        )
+
+    return sum(created.values())
+
+
+# Правило серии изменилось: невыполненные будущие повторения удаляются и создаются заново
+async def reschedule_series(db: AsyncSession, task: Task, now: Optional[datetime] = None) -> int:
+    now = now or datetime.now(timezone.utc)
+    pending = [
+        Task.recurrence_parent_id == task.id,
+        Task.completed == False,
+        Task.occurrence_at > now
+    ]
+    await db.execute(
+        delete(TaskTag)
+        .where(TaskTag.task_id.in_(select(Task.id).where(*pending)))
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(
+        delete(Task)
+        .where(*pending)
+        .execution_options(synchronize_session=False)
+    )
+    removed = result.rowcount or 0
+    if removed:
+        await db.execute(
+            update(User)
+            .where(User.id == task.user_id)
+            .values(tasks_count=User.tasks_count - removed)
+        )
+
+    await db.execute(
+        update(Task)
+        .where(Task.id == task.id)
+        .values(recurrence_next_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    task.recurrence_next_at = None
+    if task.recurrence_rule is None:
+        return 0
+    return await materialize_occurrences(db, [task], now)
+
+
+# Задача планировщика: повторения серий, у которых следующее повторение вошло в окно
+async def generate_occurrences(
+        partition: Optional[int] = None,
+        partitions: int = 1,
+        stats: Optional[dict] = None,
+        batch_size: int = RECURRENCE_BATCH_SIZE
+) -> dict:
+    if stats is None:
+        stats = {}
+    stats.update(rows_scanned=0, rows_updated=0, batches=0)
+
+    now = datetime.now(timezone.utc)
+    horizon = now + timedelta(days=RECURRENCE_WINDOW_DAYS)
+    conditions = [Task.recurrence_next_at <= horizon, Task.recurrence_rule.isnot(None)]
+    if partition is not None:
+        conditions.append(Task.user_id % partitions == partition)
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            # Обработанные серии получают recurrence_next_at за окном и выпадают из выборки
+            series = (await db.execute(
+                select(
+                    Task.id, Task.user_id, Task.title, Task.description, Task.is_important,
+                    Task.deadline_at, Task.created_at, Task.recurrence_rule, Task.recurrence_next_at
+                )
+                .where(*conditions)
+                .order_by(Task.recurrence_next_at, Task.id)
+                .limit(batch_size)
+            )).all()
+            if not series:
+                break
+
+            created = await materialize_occurrences(db, series, now)
+            await db.commit()
+
+            stats["rows_scanned"] += len(series)
+            stats["rows_updated"] += created
+            stats["batches"] += 1
+
+    return stats
@@ -0,0 +1,488 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional
+from sqlalchemy import select, update, delete, insert, func, event, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models.task import Task
+from models.user import User
+from models.reminder import Reminder, REMINDER_PENDING, REMINDER_SENT, REMINDER_FAILED
+from slow_queries import current_source as current_query_source
+
+if TYPE_CHECKING:
+    import httpx
+
+load_dotenv()
+# 0 - диспетчер в этом процессе не запускается (напоминания отправляют другие процессы)
+REMINDER_DISPATCHER = os.getenv("REMINDER_DISPATCHER", "1") == "1"
+# За сколько минут до дедлайна отправляется напоминание
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "60"))
+# Сколько наступивших напоминаний диспетчер забирает за один проход
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+# Максимальный сон диспетчера: за это время он заметит напоминания, созданные другими процессами
+REMINDER_MAX_SLEEP_SECONDS = float(os.getenv("REMINDER_MAX_SLEEP_SECONDS", "30"))
+# На сколько откладываются забранные напоминания: если процесс упал при отправке, их заберет другой
+REMINDER_CLAIM_SECONDS = int(os.getenv("REMINDER_CLAIM_SECONDS", "120"))
+# Попыток отправки напоминания, после чего оно помечается неудачным
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "5"))
+# Пауза перед повторной отправкой после неудачи, удваивается с каждой попыткой
+REMINDER_RETRY_SECONDS = int(os.getenv("REMINDER_RETRY_SECONDS", "60"))
+
+# Напоминаний в одном запросе к вебхуку
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+# Одновременных запросов к вебхукам (и соединений в пуле HTTP-клиента)
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "20"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "5"))
+# Повторы запроса при сетевой ошибке, 429 и 5xx; пауза растет экспоненциально со случайным разбросом
+WEBHOOK_RETRIES = int(os.getenv("WEBHOOK_RETRIES", "2"))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", "0.5"))
+# 1 - разрешить http и адреса локальной и частной сети (локальный приемник benchmarks/webhook_stub.py).
+# В рабочем окружении не включать: вебхуком можно обратиться к внутренним сервисам.
+WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "0") == "1"
+
+# Счетчики диспетчера этого процесса (GET /admin/reminders)
+dispatcher_stats = {
+    "rounds": 0,
+    "claimed": 0,
+    "sent": 0,
+    "retried": 0,
+    "failed": 0,
+    "dropped": 0,
+    "requests": 0,
+    "request_errors": 0,
+    "next_wakeup": None,
+}
+
+_dispatcher: Optional[asyncio.Task] = None
+_client: Optional["httpx.AsyncClient"] = None
+_wakeup: Optional[asyncio.Event] = None
+# Время, до которого спит диспетчер: будим его, только если новое напоминание наступает раньше
+_sleep_until: Optional[datetime] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def remind_at_for(deadline_at: datetime, now: datetime) -> datetime:
+    # Задача создана меньше чем за REMINDER_LEAD_MINUTES до дедлайна - напоминание сразу
+    return max(deadline_at - timedelta(minutes=REMINDER_LEAD_MINUTES), now)
+
+
+def _wake_after_commit(db: AsyncSession, remind_at: datetime):
+    if _wakeup is None or (_sleep_until is not None and remind_at >= _sleep_until):
+        return
+
+    # Диспетчер увидит строки только после коммита, поэтому будим его после него
+    def wake(session):
+        if _wakeup is not None:
+            _wakeup.set()
+
+    event.listen(db.sync_session, "after_commit", wake, once=True)
+
+
+# Приводит напоминания задач в соответствие с их дедлайнами в текущей транзакции: напоминание
+# с прежним дедлайном остается (повторно не отправляется), устаревшие удаляются, недостающие
+# создаются для невыполненных задач с дедлайном в будущем у пользователей с вебхуком.
+# created=True - задачи только что вставлены, напоминаний у них заведомо нет.
+async def schedule_reminders(db: AsyncSession, tasks, now: Optional[datetime] = None, created: bool = False) -> int:
+    tasks = list(tasks)
+    if not tasks:
+        return 0
+    now = now or _now()
+    existing = {}
+    if not created:
+        existing = dict((await db.execute(
+            select(Reminder.task_id, Reminder.deadline_at)
+            .where(Reminder.task_id.in_([task.id for task in tasks]))
+        )).all())
+
+    candidates = {
+        task.id: task for task in tasks
+        if not task.completed and task.deadline_at is not None and task.deadline_at > now
+    }
+    stale = [
+        task_id for task_id, deadline_at in existing.items()
+        if task_id not in candidates or candidates[task_id].deadline_at != deadline_at
+    ]
+    if stale:
+        await db.execute(
+            delete(Reminder)
+            .where(Reminder.task_id.in_(stale))
+            .execution_options(synchronize_session=False)
+        )
+
+    missing = [task for task in candidates.values() if task.id not in existing or task.id in stale]
+    if not missing:
+        return 0
+    subscribed = set((await db.execute(
+        select(User.id).where(
+            User.id.in_({task.user_id for task in missing}),
+            User.webhook_url.isnot(None)
+        )
+    )).scalars())
+    values = [
+        {
+            "task_id": task.id,
+            "user_id": task.user_id,
+            "deadline_at": task.deadline_at,
+            "remind_at": remind_at_for(task.deadline_at, now),
+            "status": REMINDER_PENDING,
+            "attempts": 0,
+        }
+        for task in missing if task.user_id in subscribed
+    ]
+    if not values:
+        return 0
+
+    await db.execute(insert(Reminder), values)
+    _wake_after_commit(db, min(value["remind_at"] for value in values))
+    return len(values)
+
+
+# Вебхук включен: напоминания по всем будущим дедлайнам пользователя.
+# Выполняется заданием schedule_user_reminders (jobs.py), каждая пачка - отдельная транзакция.
+async def schedule_user_reminders(user_id: int, batch_size: int = 5000, stats: Optional[dict] = None) -> dict:
+    stats = stats if stats is not None else {}
+    stats.update(reminders_scheduled=0, batches=0)
+    now = _now()
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Task.id, Task.user_id, Task.deadline_at, Task.completed)
+                .where(
+                    Task.user_id == user_id,
+                    Task.completed == False,
+                    Task.deadline_at > now,
+                    Task.id > last_id
+                )
+                .order_by(Task.id)
+                .limit(batch_size)
+            )).all()
+            if not rows:
+                return stats
+            last_id = rows[-1].id
+            stats["reminders_scheduled"] += await schedule_reminders(db, rows, now)
+            await db.commit()
+        stats["batches"] += 1
+
+
+async def cancel_user_reminders(db: AsyncSession, user_id: int):
+    await db.execute(
+        delete(Reminder)
+        .where(Reminder.user_id == user_id, Reminder.status == REMINDER_PENDING)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class WebhookAddressError(ValueError):
+    pass
+
+
+def _is_public_address(address) -> bool:
+    # ::ffff:127.0.0.1 и подобные проверяются как IPv4
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+# Проверяет адрес вебхука и разрешает его имя. Возвращает URL с IP-адресом вместо имени и имя хоста:
+# запрос идет на проверенный адрес, и DNS-ответ, подмененный после проверки, не уведет его во внутреннюю сеть.
+async def resolve_webhook_url(url: str) -> tuple:
+    # httpx импортируется при первом использовании: модуль загружается при старте любого процесса
+    import httpx
+    parsed = httpx.URL(url)
+    if parsed.scheme != "https" and not (WEBHOOK_ALLOW_PRIVATE and parsed.scheme == "http"):
+        raise WebhookAddressError("Адрес вебхука должен использовать https")
+    host = parsed.host
+    if not host:
+        raise WebhookAddressError("В адресе вебхука не указан хост")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, parsed.port or (443 if parsed.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except (socket.gaierror, UnicodeError) as e:
+        raise WebhookAddressError(f"Не удалось разрешить адрес вебхука {host}: {e}")
+    addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not addresses:
+        raise WebhookAddressError(f"Не удалось разрешить адрес вебхука {host}")
+    if not WEBHOOK_ALLOW_PRIVATE:
+        for address in addresses:
+            if not _is_public_address(address):
+                raise WebhookAddressError(f"Адрес вебхука {host} ведет в локальную или частную сеть ({address})")
+    return parsed.copy_with(host=str(addresses[0])), host
+
+
+def sign_payload(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+# Один запрос к вебхуку с повторами. Возвращает None при успехе или текст последней ошибки.
+# Адрес проверяется при каждой доставке: DNS-имя могло начать указывать во внутреннюю сеть.
+async def deliver_webhook(client: "httpx.AsyncClient", url: str, secret: Optional[str], payload: dict) -> Optional[str]:
+    import httpx
+    try:
+        target, host = await resolve_webhook_url(url)
+    except WebhookAddressError as e:
+        dispatcher_stats["request_errors"] += 1
+        return str(e)
+
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    # Соединение - с проверенным IP, а Host и SNI (проверка сертификата) - исходного имени
+    headers = {"Content-Type": "application/json", "Host": httpx.URL(url).netloc.decode("ascii")}
+    if secret:
+        headers["X-Webhook-Signature"] = sign_payload(secret, body)
+
+    error = None
+    for attempt in range(WEBHOOK_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(WEBHOOK_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+        dispatcher_stats["requests"] += 1
+        try:
+            response = await client.post(target, content=body, headers=headers, extensions={"sni_hostname": host})
+        except httpx.HTTPError as e:
+            dispatcher_stats["request_errors"] += 1
+            error = f"{type(e).__name__}: {e}"
+            continue
+        if response.status_code < 300:
+            return None
+        dispatcher_stats["request_errors"] += 1
+        error = f"HTTP {response.status_code}"
+        # Остальные 4xx не исправятся повтором
+        if response.status_code < 500 and response.status_code != 429:
+            break
+    return error
+
+
+async def _claim_due(now: datetime) -> list:
+    async with AsyncSessionLocal() as db:
+        # В PostgreSQL строки, которые забирает другой процесс, пропускаются
+        task_ids = (await db.execute(
+            select(Reminder.task_id)
+            .where(Reminder.status == REMINDER_PENDING, Reminder.remind_at <= now)
+            .order_by(Reminder.remind_at)
+            .limit(REMINDER_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )).scalars().all()
+        if not task_ids:
+            await db.rollback()
+            return []
+
+        # Условное обновление: напоминание достается тому процессу, чей UPDATE его сдвинул
+        claimed = (await db.execute(
+            update(Reminder)
+            .where(
+                Reminder.task_id.in_(task_ids),
+                Reminder.status == REMINDER_PENDING,
+                Reminder.remind_at <= now
+            )
+            .values(remind_at=now + timedelta(seconds=REMINDER_CLAIM_SECONDS), attempts=Reminder.attempts + 1)
+            .returning(Reminder.task_id, Reminder.user_id, Reminder.deadline_at, Reminder.attempts)
+        )).all()
+        await db.commit()
+        return claimed
+
+
+async def _save_results(sent: list, failed: list, dropped: list, now: datetime):
+    reminders = Reminder.__table__
+    async with AsyncSessionLocal() as db:
+        if dropped:
+            await db.execute(delete(reminders).where(reminders.c.task_id.in_(dropped)))
+        if sent:
+            await db.execute(
+                update(reminders)
+                .where(reminders.c.task_id.in_(sent))
+                .values(status=REMINDER_SENT, sent_at=now, last_error=None)
+            )
+        if failed:
+            await db.execute(
+                update(reminders)
+                .where(reminders.c.task_id == bindparam("reminder_task_id"))
+                .values(
+                    status=bindparam("new_status"),
+                    remind_at=bindparam("retry_at", type_=reminders.c.remind_at.type),
+                    last_error=bindparam("error")
+                ),
+                failed
+            )
+        await db.commit()
+
+
+# Один проход диспетчера: забрать наступившие напоминания, отправить пачками по пользователям
+async def dispatch_due(client: "httpx.AsyncClient", now: Optional[datetime] = None) -> dict:
+    now = now or _now()
+    stats = {"claimed": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0, "requests": 0}
+    claimed = await _claim_due(now)
+    stats["claimed"] = len(claimed)
+    if not claimed:
+        return stats
+
+    async with AsyncSessionLocal() as db:
+        tasks = {
+            row.id: row for row in await db.execute(
+                select(Task.id, Task.title, Task.deadline_at, Task.quadrant, Task.completed)
+                .where(Task.id.in_([reminder.task_id for reminder in claimed]))
+            )
+        }
+        users = {
+            row.id: row for row in await db.execute(
+                select(User.id, User.webhook_url, User.webhook_secret)
+                .where(User.id.in_({reminder.user_id for reminder in claimed}))
+            )
+        }
+
+    # Задача выполнена, удалена, дедлайн перенесен или вебхук отключен - напоминание не нужно
+    dropped = []
+    by_user = {}
+    for reminder in claimed:
+        task = tasks.get(reminder.task_id)
+        user = users.get(reminder.user_id)
+        if (
+            task is None or task.completed or task.deadline_at != reminder.deadline_at
+            or user is None or not user.webhook_url
+        ):
+            dropped.append(reminder.task_id)
+            continue
+        by_user.setdefault(reminder.user_id, []).append(reminder)
+
+    batches = []
+    for user_id, reminders in by_user.items():
+        for i in range(0, len(reminders), WEBHOOK_BATCH_SIZE):
+            batches.append((users[user_id], reminders[i:i + WEBHOOK_BATCH_SIZE]))
+
+    semaphore = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+
+    async def send(user, reminders) -> Optional[str]:
+        payload = {
+            "event": "deadline_reminder",
+            "user_id": user.id,
+            "sent_at": now.isoformat(),
+            "reminders": [
+                {
+                    "task_id": reminder.task_id,
+                    "title": tasks[reminder.task_id].title,
+                    "quadrant": tasks[reminder.task_id].quadrant,
+                    "deadline_at": reminder.deadline_at.isoformat(),
+                    "attempt": reminder.attempts,
+                }
+                for reminder in reminders
+            ],
+        }
+        async with semaphore:
+            return await deliver_webhook(client, user.webhook_url, user.webhook_secret, payload)
+
+    errors = await asyncio.gather(*(send(user, reminders) for user, reminders in batches))
+    stats["requests"] = len(batches)
+
+    sent = []
+    failed = []
+    for (user, reminders), error in zip(batches, errors):
+        if error is None:
+            sent.extend(reminder.task_id for reminder in reminders)
+            continue
+        for reminder in reminders:
+            if reminder.attempts >= REMINDER_MAX_ATTEMPTS:
+                new_status, retry_at = REMINDER_FAILED, now
+                stats["failed"] += 1
+            else:
+                new_status = REMINDER_PENDING
+                retry_at = now + timedelta(seconds=REMINDER_RETRY_SECONDS * 2 ** (reminder.attempts - 1))
+                stats["retried"] += 1
+            failed.append({
+                "reminder_task_id": reminder.task_id,
+                "new_status": new_status,
+                "retry_at": retry_at,
+                "error": error,
+            })
+
+    stats["sent"] = len(sent)
+    stats["dropped"] = len(dropped)
+    await _save_results(sent, failed, dropped, now)
+    return stats
+
+
+async def next_due_at() -> Optional[datetime]:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.min(Reminder.remind_at)).where(Reminder.status == REMINDER_PENDING)
+        )).scalar_one_or_none()
+
+
+# Диспетчер не опрашивает таблицу: спит до ближайшего напоминания (по частичному индексу),
+# раньше его будит только создание более раннего напоминания в этом процессе.
+async def _dispatcher_loop():
+    global _sleep_until
+    current_query_source.set("reminders")
+    while True:
+        next_due = None
+        try:
+            while True:
+                started = time.perf_counter()
+                stats = await dispatch_due(_client)
+                if not stats["claimed"]:
+                    break
+                dispatcher_stats["rounds"] += 1
+                for key in ("claimed", "sent", "retried", "failed", "dropped"):
+                    dispatcher_stats[key] += stats[key]
+                print(
+                    f"Напоминания: отправлено {stats['sent']}, отложено {stats['retried']}, "
+                    f"не доставлено {stats['failed']}, отменено {stats['dropped']} "
+                    f"({stats['requests']} запросов, {(time.perf_counter() - started) * 1000:.0f} мс)"
+                )
+                if stats["claimed"] < REMINDER_BATCH_SIZE:
+                    break
+            next_due = await next_due_at()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка диспетчера напоминаний: {type(e).__name__}: {e}")
+
+        now = _now()
+        delay = REMINDER_MAX_SLEEP_SECONDS
+        if next_due is not None:
+            delay = min(max((next_due - now).total_seconds(), 0.0), delay)
+        _sleep_until = now + timedelta(seconds=delay)
+        dispatcher_stats["next_wakeup"] = _sleep_until.isoformat()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start_reminder_dispatcher():
+    global _dispatcher, _client, _wakeup
+    if not REMINDER_DISPATCHER:
+        return
+    import httpx
+    # Один клиент на процесс: соединения с вебхуками переиспользуются между пачками
+    _client = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=WEBHOOK_CONCURRENCY, max_keepalive_connections=WEBHOOK_CONCURRENCY),
+        headers={"User-Agent": "todo-reminders/1.0"}
+    )
+    _wakeup = asyncio.Event()
+    _dispatcher = asyncio.create_task(_dispatcher_loop())
+    print("Диспетчер напоминаний запущен")
+
+
+async def stop_reminder_dispatcher():
+    global _dispatcher, _client, _wakeup
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+        await asyncio.gather(_dispatcher, return_exceptions=True)
+        _dispatcher = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _wakeup = None
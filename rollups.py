@@ -0,0 +1,453 @@
+import math
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Callable, Optional
+from sqlalchemy import select, insert, delete, func, case, cast, literal, tuple_, union_all, Integer, Float, Date
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from archive import TASK_ARCHIVE_AFTER_DAYS
+from models.task import Task, TaskArchive
+from models.completion_rollup import CompletionRollup, CompletionRollupStale
+
+load_dotenv()
+# Сколько дней свода пересчитывается за одну транзакцию
+COMPLETION_ROLLUP_WINDOW_DAYS = int(os.getenv("COMPLETION_ROLLUP_WINDOW_DAYS", "7"))
+# Сколько пользователей с устаревшими днями свода пересчитывается за одну транзакцию
+COMPLETION_ROLLUP_STALE_BATCH_SIZE = int(os.getenv("COMPLETION_ROLLUP_STALE_BATCH_SIZE", "1000"))
+
+METRIC_TIME_TO_COMPLETE = "ttc"
+METRIC_LATENESS = "late"
+
+PERCENTILES = (0.5, 0.9, 0.99)
+QUADRANTS = ("Q1", "Q2", "Q3", "Q4")
+
+# Корзин на каждое удвоение значения: граница соседних корзин отличается в 2^(1/4) раза,
+# поэтому перцентиль по гистограмме отличается от точного не больше чем на ~9%
+BUCKETS_PER_DOUBLING = 4
+
+
+# Номер логарифмической корзины для значения в секундах.
+# 0 - меньше секунды по модулю, у отрицательных значений (задача выполнена раньше дедлайна)
+# отрицательный номер, поэтому порядок номеров совпадает с порядком значений.
+def value_to_bucket(seconds: float) -> int:
+    magnitude = abs(seconds)
+    if magnitude < 1:
+        return 0
+    index = int(math.floor(math.log2(magnitude) * BUCKETS_PER_DOUBLING)) + 1
+    return index if seconds > 0 else -index
+
+
+# Границы корзины (нижняя, верхняя) в секундах
+def bucket_bounds(bucket: int) -> tuple:
+    if bucket == 0:
+        return -1.0, 1.0
+    k = abs(bucket)
+    low = 2 ** ((k - 1) / BUCKETS_PER_DOUBLING)
+    high = 2 ** (k / BUCKETS_PER_DOUBLING)
+    return (low, high) if bucket > 0 else (-high, -low)
+
+
+# Перцентили по гистограмме {корзина: количество} с интерполяцией внутри корзины
+def histogram_percentiles(histogram: dict, percentiles=PERCENTILES) -> dict:
+    total = sum(histogram.values())
+    if total == 0:
+        return {f"p{round(q * 100)}": None for q in percentiles}
+
+    buckets = sorted(histogram.items())
+    result = {}
+    for q in percentiles:
+        position = q * total
+        seen = 0
+        for bucket, count in buckets:
+            if seen + count >= position:
+                low, high = bucket_bounds(bucket)
+                value = low + (high - low) * (position - seen) / count
+                break
+            seen += count
+        result[f"p{round(q * 100)}"] = value
+    return result
+
+
+# Разница двух моментов времени в секундах
+class seconds_between(FunctionElement):
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(seconds_between)
+def _seconds_between(element, compiler, **kw):
+    end, start = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"EXTRACT(EPOCH FROM {end} - {start})"
+
+
+@compiles(seconds_between, "sqlite")
+def _seconds_between_sqlite(element, compiler, **kw):
+    end, start = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"((julianday({end}) - julianday({start})) * 86400.0)"
+
+
+# День (UTC) момента времени
+class utc_day(FunctionElement):
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(utc_day)
+def _utc_day(element, compiler, **kw):
+    return f"CAST(timezone('UTC', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(utc_day, "sqlite")
+def _utc_day_sqlite(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)})"
+
+
+# value_to_bucket на стороне БД. Добавка 1e-9 нужна, чтобы на границах корзин (точные степени
+# 2^(1/4)) ln(x) / ln(2) не оказался чуть меньше целого из-за округления
+def _bucket_sql(seconds, signed: bool = True):
+    magnitude = func.abs(seconds)
+    index = cast(func.floor(func.ln(magnitude) / math.log(2) * BUCKETS_PER_DOUBLING + 1e-9), Integer) + 1
+    if not signed:
+        # Время выполнения не бывает отрицательным (расхождение часов считается нулем)
+        return case((seconds < 1, 0), else_=index)
+    return case((magnitude < 1, 0), (seconds > 0, index), else_=-index)
+
+
+# Задачи, выполненные позже этого момента, еще не в архиве: archive.py переносит выполненные
+# раньше TASK_ARCHIVE_AFTER_DAYS дней назад (день запаса - на запуск архивации, начатый раньше)
+def _archive_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=TASK_ARCHIVE_AFTER_DAYS + 1)
+
+
+# Таблицы, где могут быть задачи, выполненные начиная с since: свежие окна архив не читают
+def _completion_models(since: Optional[datetime]) -> tuple:
+    if since is not None and since >= _archive_cutoff():
+        return (Task,)
+    return (Task, TaskArchive)
+
+
+# Строки свода за [start, end): группировка и корзины считаются в БД, задачи в приложение не читаются
+def _rollup_select(start: datetime, end: datetime, scope: Callable[[type], list]):
+    selects = []
+    for model in _completion_models(start):
+        conditions = [
+            model.completed == True,
+            model.completed_at >= start,
+            model.completed_at < end,
+            *scope(model)
+        ]
+        columns = [model.user_id.label("user_id"), utc_day(model.completed_at).label("day"), model.quadrant.label("quadrant")]
+        selects.append(
+            select(
+                *columns,
+                literal(METRIC_TIME_TO_COMPLETE).label("metric"),
+                _bucket_sql(seconds_between(model.completed_at, model.created_at), signed=False).label("bucket")
+            ).where(*conditions)
+        )
+        selects.append(
+            select(
+                *columns,
+                literal(METRIC_LATENESS).label("metric"),
+                _bucket_sql(seconds_between(model.completed_at, model.deadline_at)).label("bucket")
+            ).where(*conditions, model.deadline_at.isnot(None))
+        )
+    source = union_all(*selects).subquery()
+    keys = [source.c.user_id, source.c.day, source.c.quadrant, source.c.metric, source.c.bucket]
+    return select(*keys, func.count()).group_by(*keys)
+
+
+# Заменяет строки свода за дни [day, end_day) одним INSERT ... SELECT. Возвращает число строк.
+async def _replace_rollup(db: AsyncSession, day: date, end_day: date, scope: Callable[[type], list]) -> int:
+    await db.execute(
+        delete(CompletionRollup).where(
+            CompletionRollup.day >= day,
+            CompletionRollup.day < end_day,
+            *scope(CompletionRollup)
+        )
+    )
+    result = await db.execute(
+        insert(CompletionRollup).from_select(
+            ["user_id", "day", "quadrant", "metric", "bucket", "count"],
+            _rollup_select(_day_start(day), _day_start(end_day), scope)
+        )
+    )
+    return result.rowcount or 0
+
+
+# Помечает день свода устаревшим: выполненную задачу удаляют или меняют ее поля, от которых зависит свод.
+# Вызывается в транзакции изменения, пересчитает день следующий запуск rollup_completions.
+async def invalidate_completion_day(db: AsyncSession, user_id: int, completed_at: Optional[datetime]):
+    if completed_at is None:
+        return
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        stmt = postgresql.insert(CompletionRollupStale)
+    elif dialect_name == "sqlite":
+        stmt = sqlite.insert(CompletionRollupStale)
+    else:
+        raise RuntimeError(f"Свод выполнения не поддерживается для {dialect_name}")
+    await db.execute(
+        stmt.values(user_id=user_id, day=_as_utc(completed_at).date()).on_conflict_do_nothing()
+    )
+
+
+# Пересчет дней, помеченных устаревшими. Отметки удаляются в той же транзакции, что и пересчет:
+# отметка, добавленная после этого, останется до следующего запуска.
+async def _refresh_stale_days(db: AsyncSession, scope: Callable[[type], list], stats: dict):
+    while True:
+        stale = (await db.execute(
+            select(CompletionRollupStale.user_id, CompletionRollupStale.day)
+            .where(*scope(CompletionRollupStale))
+            .order_by(CompletionRollupStale.day, CompletionRollupStale.user_id)
+            .limit(COMPLETION_ROLLUP_STALE_BATCH_SIZE)
+        )).all()
+        if not stale:
+            return
+
+        await db.execute(
+            delete(CompletionRollupStale).where(
+                tuple_(CompletionRollupStale.user_id, CompletionRollupStale.day).in_(
+                    [(row.user_id, row.day) for row in stale]
+                )
+            )
+        )
+        by_day = {}
+        for row in stale:
+            by_day.setdefault(row.day, []).append(row.user_id)
+        for day, user_ids in by_day.items():
+            def day_scope(model, user_ids=user_ids) -> list:
+                return [*scope(model), model.user_id.in_(user_ids)]
+            stats["rows_updated"] += await _replace_rollup(db, day, day + timedelta(days=1), day_scope)
+        await db.commit()
+        stats["stale_days"] += len(stale)
+        stats["batches"] += 1
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite возвращает даты без часового пояса - в БД они хранятся в UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+# Первый день с выполненными задачами начиная с since (по индексу completed_at - без чтения истории)
+async def _next_completion_day(db: AsyncSession, scope: Callable[[type], list], since: Optional[date] = None) -> Optional[date]:
+    since_start = _day_start(since) if since is not None else None
+    first = None
+    for model in _completion_models(since_start):
+        conditions = [model.completed == True, *scope(model)]
+        if since_start is not None:
+            conditions.append(model.completed_at >= since_start)
+        value = (await db.execute(select(func.min(model.completed_at)).where(*conditions))).scalar()
+        if value is not None:
+            value = _as_utc(value).date()
+            first = value if first is None else min(first, value)
+    return first
+
+
+# Пересчет дневного свода по выполненным задачам.
+# Без full пересчитываются дни, помеченные устаревшими (invalidate_completion_day), и дни начиная
+# с последнего дня в своде: выполнение задачи ставит completed_at = текущее время, а удаление
+# и изменение выполненных задач помечают свой день. Дни без выполненных задач пропускаются,
+# поэтому запуск стоит пропорционально числу новых выполнений, а не длине истории.
+async def rollup_completions(
+        partition: Optional[int] = None,
+        partitions: int = 1,
+        stats: Optional[dict] = None,
+        full: bool = False
+) -> dict:
+    if stats is None:
+        stats = {}
+    stats.update(rows_updated=0, batches=0, stale_days=0)
+
+    def scope(model) -> list:
+        if partition is None:
+            return []
+        return [model.user_id % partitions == partition]
+
+    today = datetime.now(timezone.utc).date()
+
+    async with AsyncSessionLocal() as db:
+        start = None
+        if full:
+            await db.execute(delete(CompletionRollup).where(*scope(CompletionRollup)))
+            # Полный пересчет покрывает и устаревшие дни
+            await db.execute(delete(CompletionRollupStale).where(*scope(CompletionRollupStale)))
+        else:
+            await _refresh_stale_days(db, scope, stats)
+            start = (await db.execute(
+                select(func.max(CompletionRollup.day)).where(*scope(CompletionRollup))
+            )).scalar()
+        if start is None:
+            start = await _next_completion_day(db, scope) or today
+
+        day = start
+        while day <= today:
+            day = await _next_completion_day(db, scope, day)
+            if day is None or day > today:
+                break
+            window_end = min(day + timedelta(days=COMPLETION_ROLLUP_WINDOW_DAYS), today + timedelta(days=1))
+            # Дни окна заменяются целиком в одной транзакции
+            stats["rows_updated"] += await _replace_rollup(db, day, window_end, scope)
+            await db.commit()
+            stats["batches"] += 1
+            day = window_end
+
+    return stats
+
+
+def _summary(completed: int, ttc: dict, lateness: dict, with_deadline: int, late: int) -> dict:
+    def to_hours(values: dict) -> dict:
+        return {name: None if value is None else round(value / 3600, 2) for name, value in values.items()}
+
+    return {
+        "completed": completed,
+        "time_to_complete_hours": to_hours(ttc),
+        "lateness_hours": to_hours(lateness),
+        "with_deadline": with_deadline,
+        "completed_late": late,
+    }
+
+
+def _per_week(per_day: list) -> list:
+    # Неделя начинается с понедельника, как у date_trunc('week', ...)
+    weeks = {}
+    for item in per_day:
+        week = item["day"] - timedelta(days=item["day"].weekday())
+        weeks[week] = weeks.get(week, 0) + item["completed"]
+    return [{"week": week, "completed": count} for week, count in sorted(weeks.items())]
+
+
+# Статистика из свода: объем работы зависит от числа дней и корзин, а не от числа задач
+async def completion_stats_from_rollup(
+        db: AsyncSession,
+        user_id: Optional[int],
+        date_from: date,
+        date_to: date
+) -> dict:
+    conditions = [CompletionRollup.day >= date_from, CompletionRollup.day <= date_to]
+    if user_id is not None:
+        conditions.append(CompletionRollup.user_id == user_id)
+
+    result = await db.execute(
+        select(
+            CompletionRollup.quadrant,
+            CompletionRollup.metric,
+            CompletionRollup.bucket,
+            func.sum(CompletionRollup.count)
+        )
+        .where(*conditions)
+        .group_by(CompletionRollup.quadrant, CompletionRollup.metric, CompletionRollup.bucket)
+    )
+    histograms = {}
+    for quadrant, metric, bucket, count in result.all():
+        for key in (quadrant, None):
+            per_metric = histograms.setdefault(key, {METRIC_TIME_TO_COMPLETE: {}, METRIC_LATENESS: {}})
+            per_metric[metric][bucket] = per_metric[metric].get(bucket, 0) + count
+
+    def summarize(key) -> dict:
+        per_metric = histograms.get(key, {METRIC_TIME_TO_COMPLETE: {}, METRIC_LATENESS: {}})
+        ttc = per_metric[METRIC_TIME_TO_COMPLETE]
+        lateness = per_metric[METRIC_LATENESS]
+        return _summary(
+            completed=sum(ttc.values()),
+            ttc=histogram_percentiles(ttc),
+            lateness=histogram_percentiles(lateness),
+            with_deadline=sum(lateness.values()),
+            late=sum(count for bucket, count in lateness.items() if bucket > 0),
+        )
+
+    result = await db.execute(
+        select(CompletionRollup.day, func.sum(CompletionRollup.count))
+        .where(*conditions, CompletionRollup.metric == METRIC_TIME_TO_COMPLETE)
+        .group_by(CompletionRollup.day)
+        .order_by(CompletionRollup.day)
+    )
+    per_day = [{"day": day, "completed": count} for day, count in result.all()]
+
+    return {
+        "source": "rollup",
+        "by_quadrant": {quadrant: summarize(quadrant) for quadrant in QUADRANTS},
+        "total": summarize(None),
+        "per_day": per_day,
+        "per_week": _per_week(per_day),
+    }
+
+
+# Точный расчет по задачам через percentile_cont (только PostgreSQL).
+# Стоимость растет с числом задач за период - для отладки и сверки со сводом.
+async def completion_stats_exact(
+        db: AsyncSession,
+        user_id: Optional[int],
+        date_from: date,
+        date_to: date
+) -> dict:
+    selects = []
+    for model in (Task, TaskArchive):
+        conditions = [
+            model.completed == True,
+            model.completed_at >= _day_start(date_from),
+            model.completed_at < _day_start(date_to + timedelta(days=1)),
+        ]
+        if user_id is not None:
+            conditions.append(model.user_id == user_id)
+        selects.append(
+            select(
+                model.quadrant.label("quadrant"),
+                model.completed_at.label("completed_at"),
+                func.extract("epoch", model.completed_at - model.created_at).label("ttc"),
+                func.extract("epoch", model.completed_at - model.deadline_at).label("late"),
+            ).where(*conditions)
+        )
+    source = union_all(*selects).subquery()
+
+    # ROLLUP добавляет итоговую строку с quadrant = NULL
+    result = await db.execute(
+        select(
+            source.c.quadrant,
+            func.count(),
+            func.count(source.c.late),
+            func.sum(case((source.c.late > 0, 1), else_=0)),
+            *[func.percentile_cont(q).within_group(source.c.ttc) for q in PERCENTILES],
+            *[func.percentile_cont(q).within_group(source.c.late) for q in PERCENTILES],
+        )
+        .group_by(func.rollup(source.c.quadrant))
+    )
+    names = [f"p{round(q * 100)}" for q in PERCENTILES]
+    summaries = {}
+    for row in result.all():
+        ttc = row[4:4 + len(PERCENTILES)]
+        lateness = row[4 + len(PERCENTILES):]
+        summaries[row[0]] = _summary(
+            completed=row[1],
+            ttc=dict(zip(names, ttc)),
+            lateness=dict(zip(names, lateness)),
+            with_deadline=row[2],
+            late=row[3] or 0,
+        )
+
+    empty = _summary(0, dict.fromkeys(names), dict.fromkeys(names), 0, 0)
+
+    async def completions_by(unit: str) -> list:
+        # Дни и недели в UTC, как дни свода (utc_day), независимо от часового пояса сессии
+        period = func.date_trunc(unit, func.timezone("UTC", source.c.completed_at))
+        result = await db.execute(
+            select(period, func.count()).group_by(period).order_by(period)
+        )
+        return [{unit: value.date(), "completed": count} for value, count in result.all()]
+
+    return {
+        "source": "exact",
+        "by_quadrant": {quadrant: summaries.get(quadrant, empty) for quadrant in QUADRANTS},
+        "total": summaries.get(None, empty),
+        "per_day": await completions_by("day"),
+        "per_week": await completions_by("week"),
+    }
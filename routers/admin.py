@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, update, tuple_, func
 from database import get_async_session
-from dependencies import get_current_admin
-from models import User, Task
+from dependencies import get_current_admin, get_read_session, get_read_admin
+from models import User, UserRole, SchedulerRun, Job, Reminder
+from models.reminder import REMINDER_PENDING
+from schemas import JobCreate
+from jobs import enqueue_job, cancel_job, ADMIN_JOB_KINDS
+from analytics import get_snapshot, snapshot_info, top_users, USER_SORT_KEYS
+from load_shedding import get_stats as get_load_stats
+from group_commit import get_stats as get_group_commit_stats
+from reminders import dispatcher_stats
+from slow_queries import get_entries as get_slow_queries, summarize_entries as summarize_slow_queries
+from tracing import get_traces, get_trace, TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_TRUST_REMOTE_SAMPLED
 
 router = APIRouter(
     prefix="/admin",
@@ -13,31 +24,319 @@ router = APIRouter(
 
 @router.get("/users")
 async def get_users_with_task_counts(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    sort: str = Query("id", pattern="^-?(id|tasks_count)$", description="id, tasks_count, -id, -tasks_count"),
+    role: Optional[UserRole] = None,
+    nickname_prefix: Optional[str] = Query(None, min_length=1, max_length=50),
+    db: AsyncSession = Depends(get_read_session),
+    admin: User = Depends(get_read_admin)
+):
+    descending = sort.startswith("-")
+    sort_column = User.tasks_count if sort.lstrip("-") == "tasks_count" else User.id
+    # Ключ сортировки всегда заканчивается на id, чтобы курсор был однозначным
+    sort_key = [sort_column, User.id] if sort_column is not User.id else [User.id]
+
+    stmt = select(
+        User.id,
+        User.nickname,
+        User.email,
+        User.role,
+        User.tasks_count,
+        User.completed_tasks_count
+    )
+
+    # Пользователи, помеченные на удаление, в список не попадают
+    stmt = stmt.where(User.deleted_at.is_(None))
+
+    if role is not None:
+        stmt = stmt.where(User.role == role)
+    if nickname_prefix:
+        stmt = stmt.where(User.nickname.startswith(nickname_prefix, autoescape=True))
+
+    if cursor:
+        try:
+            cursor_values = [int(value) for value in cursor.split(":")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        if len(cursor_values) != len(sort_key):
+            raise HTTPException(status_code=400, detail="Курсор не соответствует сортировке")
+        if descending:
+            stmt = stmt.where(tuple_(*sort_key) < tuple_(*cursor_values))
+        else:
+            stmt = stmt.where(tuple_(*sort_key) > tuple_(*cursor_values))
+
+    order = [column.desc() if descending else column.asc() for column in sort_key]
+    stmt = stmt.order_by(*order).limit(limit)
+
+    result = await db.execute(stmt)
+    users = result.all()
+
+    next_cursor = None
+    if len(users) == limit:
+        last = users[-1]
+        next_cursor = ":".join(str(getattr(last, column.key)) for column in sort_key)
+
+    return {
+        "items": [
+            {
+                "id": u.id,
+                "nickname": u.nickname,
+                "email": u.email,
+                "role": u.role.value if hasattr(u.role, "value") else u.role,
+                "tasks_count": u.tasks_count,
+                "completed_count": u.completed_tasks_count,
+                "pending_count": u.tasks_count - u.completed_tasks_count
+            }
+            for u in users
+        ],
+        "next_cursor": next_cursor
+    }
+
+
+def job_response(job: Job) -> dict:
+    return {**job.to_dict(), "progress_url": f"/api/v3/admin/jobs/{job.id}"}
+
+
+# Пересчет счетчиков задач, если они разошлись с таблицей tasks (выполняется воркером заданий)
+@router.post("/users/recount", status_code=status.HTTP_202_ACCEPTED)
+async def recount_user_task_counters(
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    job = await enqueue_job(db, "reconcile_counters", created_by=admin.id)
+    return job_response(job)
+
+
+# Удаление пользователя: сразу помечается удаленным, задачи удаляются заданием пачками
+@router.delete("/users/{user_id}", status_code=status.HTTP_202_ACCEPTED)
+async def delete_user(
+    user_id: int,
     db: AsyncSession = Depends(get_async_session),
     admin: User = Depends(get_current_admin)
 ):
-    stmt = (
-        select(
-            User.id,
-            User.nickname,
-            User.email,
-            User.role,
-            func.count(Task.id).label("tasks_count")
+    if user_id == admin.id:
+        raise HTTPException(status_code=400, detail="Нельзя удалить самого себя")
+
+    result = await db.execute(
+        select(User.id, User.deleted_at).where(User.id == user_id)
+    )
+    user = result.one_or_none()
+    if user is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    # Повторный вызов для уже помеченного пользователя продолжает удаление
+    if user.deleted_at is None:
+        await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(deleted_at=datetime.now(timezone.utc))
         )
-        .outerjoin(Task, Task.user_id == User.id)
-        .group_by(User.id)
+        await db.commit()
+
+    job = await enqueue_job(db, "purge_user", {"user_id": user_id}, created_by=admin.id)
+
+    return {
+        "message": "Пользователь помечен на удаление",
+        "id": user_id,
+        "job_id": job.id,
+        "progress_url": f"/api/v3/admin/users/{user_id}/deletion"
+    }
+
+
+@router.get("/users/{user_id}/deletion")
+async def get_user_deletion_progress(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    result = await db.execute(
+        select(Job)
+        .where(Job.kind == "purge_user", Job.params["user_id"].as_integer() == user_id)
+        .order_by(Job.id.desc())
+        .limit(1)
     )
+    job = result.scalar_one_or_none()
+    if job is not None:
+        return {"id": user_id, "job_id": job.id, "status": job.status, **job.progress, "error": job.error}
+
+    result = await db.execute(
+        select(User.deleted_at, User.tasks_count).where(User.id == user_id)
+    )
+    user = result.one_or_none()
+    if user is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if user.deleted_at is None:
+        raise HTTPException(status_code=404, detail="Пользователь не помечен на удаление")
+
+    return {"id": user_id, "status": "pending", "remaining_tasks": user.tasks_count}
+
+
+# Тяжелые операции админки выполняются воркерами заданий, а не в запросе
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    job_data: JobCreate,
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    if job_data.kind not in ADMIN_JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"Неизвестное задание, доступны: {', '.join(ADMIN_JOB_KINDS)}")
+    job = await enqueue_job(db, job_data.kind, job_data.params, created_by=admin.id)
+    return job_response(job)
+
+
+@router.get("/jobs")
+async def get_jobs(
+    kind: Optional[str] = None,
+    job_status: Optional[str] = Query(None, alias="status", pattern="^(queued|running|completed|failed|cancelled)$"),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    stmt = select(Job).order_by(Job.id.desc()).limit(limit)
+    if kind is not None:
+        stmt = stmt.where(Job.kind == kind)
+    if job_status is not None:
+        stmt = stmt.where(Job.status == job_status)
+    result = await db.execute(stmt)
+    return {"items": [job.to_dict() for job in result.scalars().all()]}
 
+
+@router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    job = await db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.to_dict()
+
+
+@router.post("/jobs/{job_id}/cancel", status_code=status.HTTP_202_ACCEPTED)
+async def cancel_job_endpoint(
+    job_id: int,
+    db: AsyncSession = Depends(get_async_session),
+    admin: User = Depends(get_current_admin)
+):
+    job = await cancel_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.to_dict()
+
+
+@router.get("/scheduler")
+async def get_scheduler_runs(
+    request: Request,
+    job_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_read_session),
+    admin: User = Depends(get_read_admin)
+):
+    # Следующие запуски по данным APScheduler этого процесса
+    scheduler = getattr(request.app.state, "scheduler", None)
+    jobs = []
+    if scheduler is not None:
+        for job in scheduler.get_jobs():
+            jobs.append({
+                "id": job.id,
+                "name": job.name,
+                "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None
+            })
+
+    # Последние запуски из истории (всех воркеров)
+    stmt = select(SchedulerRun).order_by(SchedulerRun.started_at.desc()).limit(limit)
+    if job_id is not None:
+        stmt = stmt.where(SchedulerRun.job_id == job_id)
     result = await db.execute(stmt)
-    users = result.all()
+    runs = result.scalars().all()
+
+    return {
+        "jobs": jobs,
+        "runs": [run.to_dict() for run in runs]
+    }
+
+
+@router.get("/analytics")
+async def get_tasks_analytics(
+    sort: str = Query("overdue", pattern=f"^({'|'.join(USER_SORT_KEYS)})$", description=", ".join(USER_SORT_KEYS)),
+    limit: int = Query(20, ge=1, le=500),
+    admin: User = Depends(get_current_admin)
+):
+    # Агрегаты по всем задачам считаются по снимку в памяти, а не по таблицам
+    state = await get_snapshot()
+    result = state["result"]
+
+    return {
+        "snapshot": snapshot_info(state),
+        **result["aggregates"],
+        "users": top_users(result["users"], sort, limit)
+    }
+
+
+@router.get("/load")
+async def get_load(
+    admin: User = Depends(get_current_admin)
+):
+    # Счетчики защиты от перегрузки и группового коммита этого процесса
+    return {**get_load_stats(), "group_commit": get_group_commit_stats()}
+
+
+@router.get("/slow-queries")
+async def get_slow_query_log(
+    fingerprint: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    admin: User = Depends(get_current_admin)
+):
+    # Медленные запросы этого процесса: последние записи и сводка по одинаковым запросам
+    return {
+        "summary": summarize_slow_queries(),
+        "entries": get_slow_queries(limit, fingerprint)
+    }
+
 
-    return [
-        {
-            "id": u.id,
-            "nickname": u.nickname,
-            "email": u.email,
-            "role": u.role.value if hasattr(u.role, "value") else u.role,
-            "tasks_count": u.tasks_count
-        }
-        for u in users
-    ]
+@router.get("/reminders")
+async def get_reminders_state(
+    db: AsyncSession = Depends(get_read_session),
+    admin: User = Depends(get_read_admin)
+):
+    # Напоминания по статусам и счетчики диспетчера этого процесса
+    result = await db.execute(
+        select(Reminder.status, func.count()).group_by(Reminder.status)
+    )
+    next_due = (await db.execute(
+        select(func.min(Reminder.remind_at)).where(Reminder.status == REMINDER_PENDING)
+    )).scalar_one_or_none()
+    return {
+        "statuses": {reminder_status: count for reminder_status, count in result},
+        "next_due_at": next_due.isoformat() if next_due else None,
+        "dispatcher": dict(dispatcher_stats)
+    }
+
+
+@router.get("/traces")
+async def get_trace_list(
+    name: Optional[str] = None,
+    min_duration_ms: float = Query(0.0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    admin: User = Depends(get_current_admin)
+):
+    # Последние трассы этого процесса (без спанов - только время по фазам)
+    return {
+        "enabled": TRACING_ENABLED,
+        "sample_rate": TRACE_SAMPLE_RATE,
+        "trust_remote_sampled": TRACE_TRUST_REMOTE_SAMPLED,
+        "traces": get_traces(limit, min_duration_ms, name)
+    }
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace_detail(
+    trace_id: str,
+    admin: User = Depends(get_current_admin)
+):
+    trace = get_trace(trace_id.lower())
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Трасса не найдена (возможно, уже вытеснена из буфера)")
+    return trace
@@ -1,3 +1,4 @@
+import secrets
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -5,9 +6,12 @@ from sqlalchemy import select
 from database import get_async_session
 from models import User, UserRole
 from models.utils import ChangePasswordRequest
-from schemas_auth import UserCreate, UserResponse, Token
-from auth_utils import verify_password, get_password_hash, create_access_token
+from schemas_auth import UserCreate, UserResponse, Token, WebhookUpdate, WebhookResponse
+from auth_utils import verify_password_async, get_password_hash_async, create_access_token
 from dependencies import get_current_user
+from rate_limit import limit_login, limit_register, password_hash_slot, record_failed_login
+from reminders import cancel_user_reminders, resolve_webhook_url, WebhookAddressError
+from jobs import enqueue_job
 
 router = APIRouter(
     prefix="/auth",
@@ -15,8 +19,10 @@ router = APIRouter(
 )
 
 
+# Лимиты проверяются до запросов к БД и расчета bcrypt
 @router.post("/register", response_model=UserResponse,
-             status_code=status.HTTP_201_CREATED)
+             status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(limit_register), Depends(password_hash_slot)])
 async def register(
         user_data: UserCreate,
         db: AsyncSession = Depends(get_async_session)
@@ -45,7 +51,7 @@ async def register(
     new_user = User(
         nickname=user_data.nickname,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await get_password_hash_async(user_data.password),
         role=UserRole.USER
     )
 
@@ -56,7 +62,8 @@ async def register(
     return new_user
 
 
-@router.post("/login", response_model=Token)
+@router.post("/login", response_model=Token,
+             dependencies=[Depends(limit_login), Depends(password_hash_slot)])
 async def login(
         form_data: OAuth2PasswordRequestForm = Depends(),
         db: AsyncSession = Depends(get_async_session)
@@ -68,7 +75,9 @@ async def login(
     user = result.scalar_one_or_none()
 
     # Проверяем пользователя и пароль
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or user.deleted_at is not None \
+            or not await verify_password_async(form_data.password, user.hashed_password):
+        await record_failed_login(form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный email или пароль",
@@ -89,22 +98,70 @@ async def get_me(
 ):
     return current_user
 
-@router.patch("/change-password")
+@router.patch("/change-password", dependencies=[Depends(password_hash_slot)])
 async def change_password(
         data: ChangePasswordRequest,
         current_user: User = Depends(get_current_user),
         db: AsyncSession = Depends(get_async_session)
 ):
     # Проверка старого пароля
-    if not verify_password(data.old_password, current_user.hashed_password):
+    if not await verify_password_async(data.old_password, current_user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Старый пароль указан неверно"
         )
 
     # Обновление пароля
-    current_user.hashed_password = get_password_hash(data.new_password)
+    current_user.hashed_password = await get_password_hash_async(data.new_password)
     db.add(current_user)
     await db.commit()
 
-    return {"message": "Пароль успешно обновлён"}
\ No newline at end of file
+    return {"message": "Пароль успешно обновлён"}
+
+# Настроить вебхук напоминаний: выдается новый ключ подписи, напоминания по всем будущим дедлайнам
+# создает фоновое задание schedule_user_reminders (у пользователя может быть много задач)
+@router.put("/me/webhook", response_model=WebhookResponse)
+async def set_webhook(
+        data: WebhookUpdate,
+        current_user: User = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_session)
+):
+    # Только https и публичные адреса; при доставке адрес проверяется еще раз
+    try:
+        await resolve_webhook_url(str(data.url))
+    except WebhookAddressError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    current_user.webhook_url = str(data.url)
+    current_user.webhook_secret = secrets.token_hex(32)
+    db.add(current_user)
+    job = await enqueue_job(db, "schedule_user_reminders", {"user_id": current_user.id}, created_by=current_user.id)
+    await db.commit()
+
+    return WebhookResponse(
+        url=current_user.webhook_url,
+        secret=current_user.webhook_secret,
+        job_id=job.id
+    )
+
+
+@router.get("/me/webhook", response_model=WebhookResponse)
+async def get_webhook(
+        current_user: User = Depends(get_current_user)
+):
+    return WebhookResponse(url=current_user.webhook_url)
+
+
+# Отключить вебхук: неотправленные напоминания удаляются
+@router.delete("/me/webhook", response_model=WebhookResponse)
+async def delete_webhook(
+        current_user: User = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_session)
+):
+    current_user.webhook_url = None
+    current_user.webhook_secret = None
+    db.add(current_user)
+    await cancel_user_reminders(db, current_user.id)
+    await db.commit()
+
+    return WebhookResponse()
@@ -1,13 +1,16 @@
-from datetime import datetime, timezone, date
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy import select, func, case
+from datetime import datetime, timezone, date, timedelta
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from sqlalchemy import select, func, case, and_
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_async_session
-from models.task import Task
+from models.task import Task, TaskArchive
 from models import User
 from schemas import TimingStatsResponse, TaskResponse
-from utils import prepare_task_to_response
-from dependencies import get_current_user
+from utils import prepare_tasks_to_response
+from dependencies import get_read_session, get_read_user
+from rollups import completion_stats_from_rollup, completion_stats_exact
+from analytics import get_snapshot
+from tags import tag_counts
 
 
 router = APIRouter(
@@ -17,32 +20,35 @@ router = APIRouter(
 
 @router.get("/", response_model=dict)
 async def get_tasks_stats(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> dict:
-    # Все задачи с учетом роли пользователя
+    # Администратор получает статистику по всем задачам из снимка аналитики
     if current_user.role.value == "admin":
-        result = await db.execute(select(Task))
-    else:
-        result = await db.execute(select(Task).where(Task.user_id == current_user.id))
+        aggregates = (await get_snapshot())["result"]["aggregates"]
+        return {
+            "total_tasks": aggregates["total_tasks"],
+            "by_quadrant": aggregates["by_quadrant"],
+            "by_status": aggregates["by_status"]
+        }
 
-    tasks = result.scalars().all()
+    by_quadrant = {"Q1": 0, "Q2": 0, "Q3": 0, "Q4": 0}
+    by_status = {"completed": 0, "pending": 0}
 
-    total_tasks = len(tasks)
+    # Подсчет в БД по задачам пользователя в основной таблице и архиве
+    for model in (Task, TaskArchive):
+        stmt = (
+            select(model.quadrant, model.completed, func.count())
+            .where(model.user_id == current_user.id)
+            .group_by(model.quadrant, model.completed)
+        )
 
-    # Подсчет по квадрантам
-    by_quadrant = {"Q1": 0, "Q2": 0, "Q3": 0, "Q4": 0}
-    for task in tasks:
-        if task.quadrant in by_quadrant:
-            by_quadrant[task.quadrant] += 1
+        for quadrant, completed, count in (await db.execute(stmt)).all():
+            if quadrant in by_quadrant:
+                by_quadrant[quadrant] += count
+            by_status["completed" if completed else "pending"] += count
 
-    # Подсчет по статусу
-    by_status = {"completed": 0, "pending": 0}
-    for task in tasks:
-        if task.completed:
-            by_status["completed"] += 1
-        else:
-            by_status["pending"] += 1
+    total_tasks = by_status["completed"] + by_status["pending"]
 
     return {
         "total_tasks": total_tasks,
@@ -54,8 +60,8 @@ async def get_tasks_stats(
 
 @router.get("/deadlines", response_model=list)
 async def get_deadline_stats(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ):
     # Все задачи с установленным сроком и не выполненные
     if current_user.role.value == "admin":
@@ -92,37 +98,40 @@ async def get_deadline_stats(
 
 @router.get("/timing", response_model=TimingStatsResponse)
 async def get_timing_stats(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> TimingStatsResponse:
-    now_utc = datetime.now(timezone.utc)
-
-    # Все задачи с учетом роли пользователя
     if current_user.role.value == "admin":
-        result = await db.execute(select(Task))
-    else:
-        result = await db.execute(select(Task).where(Task.user_id == current_user.id))
+        aggregates = (await get_snapshot())["result"]["aggregates"]
+        return TimingStatsResponse(**aggregates["timing"])
 
-    tasks = result.scalars().all()
+    now_utc = datetime.now(timezone.utc)
 
     completed_on_time = 0
     completed_late = 0
     on_plan_pending = 0
     overtime_pending = 0
 
-    for task in tasks:
-        if task.completed:
-            if task.completed_at and task.deadline_at:
-                if task.completed_at <= task.deadline_at:
-                    completed_on_time += 1
-                else:
-                    completed_late += 1
-        else:
-            if task.deadline_at:
-                if task.deadline_at > now_utc:
-                    on_plan_pending += 1
-                else:
-                    overtime_pending += 1
+    # Подсчет в БД по задачам пользователя в основной таблице и архиве
+    for model in (Task, TaskArchive):
+        with_dates = and_(
+            model.completed == True,
+            model.completed_at.isnot(None),
+            model.deadline_at.isnot(None)
+        )
+        pending = and_(model.completed == False, model.deadline_at.isnot(None))
+        stmt = select(
+            func.sum(case((and_(with_dates, model.completed_at <= model.deadline_at), 1), else_=0)),
+            func.sum(case((and_(with_dates, model.completed_at > model.deadline_at), 1), else_=0)),
+            func.sum(case((and_(pending, model.deadline_at > now_utc), 1), else_=0)),
+            func.sum(case((and_(pending, model.deadline_at <= now_utc), 1), else_=0)),
+        ).where(model.user_id == current_user.id)
+
+        row = (await db.execute(stmt)).one()
+        completed_on_time += row[0] or 0
+        completed_late += row[1] or 0
+        on_plan_pending += row[2] or 0
+        overtime_pending += row[3] or 0
 
     return TimingStatsResponse(
         completed_on_time=completed_on_time,
@@ -131,10 +140,43 @@ async def get_timing_stats(
         overtime_pending=overtime_pending,
     )
 
+@router.get("/completion", response_model=dict)
+async def get_completion_stats(
+    date_from: Optional[date] = Query(None, description="Начало периода (по умолчанию 30 дней назад)"),
+    date_to: Optional[date] = Query(None, description="Конец периода включительно (по умолчанию сегодня)"),
+    exact: bool = Query(False, description="Точный расчет по задачам (только PostgreSQL)"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
+) -> dict:
+    if date_to is None:
+        date_to = datetime.now(timezone.utc).date()
+    if date_from is None:
+        date_from = date_to - timedelta(days=29)
+    if date_from > date_to:
+        raise HTTPException(
+            status_code=400,
+            detail="Начало периода не может быть позже конца"
+        )
+
+    # Администратор видит статистику по всем пользователям
+    user_id = None if current_user.role.value == "admin" else current_user.id
+
+    if exact:
+        if db.get_bind().dialect.name != "postgresql":
+            raise HTTPException(
+                status_code=400,
+                detail="Точный расчет доступен только для PostgreSQL"
+            )
+        stats = await completion_stats_exact(db, user_id, date_from, date_to)
+    else:
+        stats = await completion_stats_from_rollup(db, user_id, date_from, date_to)
+
+    return {"date_from": date_from, "date_to": date_to, **stats}
+
 @router.get("/today", response_model=list[TaskResponse])
 async def get_tasks_for_today(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ):
     today = date.today()
 
@@ -154,4 +196,15 @@ async def get_tasks_for_today(
     result = await db.execute(stmt)
     tasks = result.scalars().all()
 
-    return [prepare_task_to_response(task) for task in tasks]
\ No newline at end of file
+    return await prepare_tasks_to_response(db, tasks)
+
+
+@router.get("/tags", response_model=list)
+async def get_tag_stats(
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
+) -> list:
+    # Число задач по тегам (основная таблица и архив); администратор - по всем пользователям
+    user_id = None if current_user.role.value == "admin" else current_user.id
+    return await tag_counts(db, user_id, limit)
\ No newline at end of file
@@ -1,42 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, tuple_, union_all
 from database import get_async_session
 from typing import List, Optional
 from datetime import datetime, timezone
-from dependencies import get_current_user
+from dependencies import get_current_user, get_read_session, get_read_user
 from models import User
-from models.task import Task
-from schemas import TaskResponse, TaskUpdate, TaskCreate
-from utils import prepare_task_to_response, calculate_urgency, define_quadrant
+from models.task import Task, TaskArchive
+from schemas import TaskResponse, TaskUpdate, TaskCreate, TaskQueryResponse
+from utils import prepare_task_to_response, prepare_tasks_to_response, calculate_urgency, define_quadrant, adjust_task_counters
+from archive import fetch_tasks, get_archived_task, TASK_COLUMNS
+from task_formats import render_tasks
+from query_planner import describe_plans, encode_cursor, decode_cursor, estimate_count
+from recurrence import normalize_rule, materialize_occurrences, reschedule_series
+from tags import normalize_tags, set_task_tags, delete_task_tags, tag_filter
+from reminders import schedule_reminders
+from rollups import invalidate_completion_day
+from group_commit import run_in_transaction
 
 router = APIRouter(
     prefix="/tasks",
     tags=["tasks"]
 )
 
+# Сколько раз перечитать задачу, если клиент не прислал версию и задачу изменили между чтением и записью
+TASK_UPDATE_ATTEMPTS = 3
+
+
+def parse_tags(tags: Optional[List[str]]) -> Optional[List[str]]:
+    if tags is None:
+        return None
+    try:
+        return normalize_tags(tags)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Некорректные теги: {error}"
+        )
+
+
+# Задачи пользователя (администратор видит все) с фильтром по тегам
+def scope_filters(model, current_user: User, tags: Optional[List[str]], tag_mode: str) -> list:
+    is_admin = current_user.role.value == "admin"
+    filters = [] if is_admin else [model.user_id == current_user.id]
+    if tags:
+        filters.append(tag_filter(model, tags, tag_mode, None if is_admin else current_user.id))
+    return filters
+
+
 # Получить все задачи
 @router.get("", response_model=List[TaskResponse])
 async def get_all_tasks(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    layout: Optional[str] = Query(None, pattern="^(rows|columnar)$", description="columnar - массив на каждое поле"),
+    tags: Optional[List[str]] = Query(None, description="Теги задачи"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="any - хотя бы один из тегов, all - все теги"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> List[TaskResponse]:
-    if current_user.role.value == "admin":
-        result = await db.execute(select(Task))
-    else:
-        result = await db.execute(
-            select(Task).where(Task.user_id == current_user.id)
-        )
-    tasks = result.scalars().all()
-    return [prepare_task_to_response(task) for task in tasks]
+    tag_list = parse_tags(tags)
+    # Выполненные задачи могут находиться в архиве
+    tasks = await fetch_tasks(
+        db, lambda model: scope_filters(model, current_user, tag_list, tag_mode)
+    )
+    return render_tasks(request, await prepare_tasks_to_response(db, tasks), layout)
 
 # Получить задачи по квадранту
 @router.get("/quadrant/{quadrant}",
             response_model=List[TaskResponse])
 async def get_tasks_by_quadrant(
     quadrant: str,
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    layout: Optional[str] = Query(None, pattern="^(rows|columnar)$", description="columnar - массив на каждое поле"),
+    tags: Optional[List[str]] = Query(None, description="Теги задачи"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="any - хотя бы один из тегов, all - все теги"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> List[TaskResponse]:
     # Получить задачи пользователя по квадранту
     if quadrant not in ["Q1", "Q2", "Q3", "Q4"]:
@@ -45,89 +84,218 @@ async def get_tasks_by_quadrant(
             detail="Неверный квадрант. Используйте: Q1, Q2, Q3, Q4"
         )
 
-    if current_user.role.value == "admin":
-        result = await db.execute(
-            select(Task).where(Task.quadrant == quadrant)
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.quadrant == quadrant,
-                Task.user_id == current_user.id
-            )
-        )
+    tag_list = parse_tags(tags)
+    tasks = await fetch_tasks(
+        db, lambda model: [
+            model.quadrant == quadrant,
+            *scope_filters(model, current_user, tag_list, tag_mode)
+        ]
+    )
 
-    tasks = result.scalars().all()
-    return [prepare_task_to_response(task) for task in tasks]
+    return render_tasks(request, await prepare_tasks_to_response(db, tasks), layout)
 
 
 # Поиск задач
 @router.get("/search", response_model=List[TaskResponse])
 async def search_tasks(
+    request: Request,
     q: str = Query(..., min_length=2),
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    layout: Optional[str] = Query(None, pattern="^(rows|columnar)$", description="columnar - массив на каждое поле"),
+    tags: Optional[List[str]] = Query(None, description="Теги задачи"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="any - хотя бы один из тегов, all - все теги"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> List[TaskResponse]:
     keyword = f"%{q.lower()}%"
-    if current_user.role.value == "admin":
-        result = await db.execute(
-            select(Task).where(
-                (Task.title.ilike(keyword)) |
-                (Task.description.ilike(keyword))
-            )
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.user_id == current_user.id,
-                (Task.title.ilike(keyword)) |
-                (Task.description.ilike(keyword))
-            )
-        )
+    tag_list = parse_tags(tags)
+    tasks = await fetch_tasks(
+        db, lambda model: [
+            *scope_filters(model, current_user, tag_list, tag_mode),
+            (model.title.ilike(keyword)) |
+            (model.description.ilike(keyword))
+        ]
+    )
 
-    tasks = result.scalars().all()
     if not tasks:
         raise HTTPException(status_code=404, detail="По данному запросу ничего не найдено")
-    return [prepare_task_to_response(task) for task in tasks]
+    return render_tasks(request, await prepare_tasks_to_response(db, tasks), layout)
 
 
 # Получить задачи по статусу
 @router.get("/status/{status}", response_model=List[TaskResponse])
 async def get_tasks_by_status(
     status: str,
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    layout: Optional[str] = Query(None, pattern="^(rows|columnar)$", description="columnar - массив на каждое поле"),
+    tags: Optional[List[str]] = Query(None, description="Теги задачи"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="any - хотя бы один из тегов, all - все теги"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> List[TaskResponse]:
     if status not in ["completed", "pending"]:
         raise HTTPException(status_code=404, detail="Недопустимый статус. Используйте: completed или pending")
     is_completed = (status == "completed")
-    if current_user.role.value == "admin":
-        result = await db.execute(
-            select(Task).where(Task.completed == is_completed)
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.completed == is_completed,
-                Task.user_id == current_user.id
-            )
+    tag_list = parse_tags(tags)
+    # В архиве только выполненные задачи
+    tasks = await fetch_tasks(
+        db, lambda model: [
+            model.completed == is_completed,
+            *scope_filters(model, current_user, tag_list, tag_mode)
+        ],
+        include_archive=is_completed
+    )
+
+    return render_tasks(request, await prepare_tasks_to_response(db, tasks), layout)
+
+
+# Комбинированный запрос: фильтры, сортировка и пагинация одним SQL-запросом
+@router.get("/query", response_model=TaskQueryResponse)
+async def query_tasks(
+    request: Request,
+    response: Response,
+    layout: Optional[str] = Query(None, pattern="^(rows|columnar)$", description="columnar - массив на каждое поле"),
+    quadrants: Optional[List[str]] = Query(None, description="Квадранты Q1-Q4"),
+    status: Optional[str] = Query(None, pattern="^(completed|pending)$"),
+    is_important: Optional[bool] = None,
+    deadline_from: Optional[datetime] = None,
+    deadline_to: Optional[datetime] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    q: Optional[str] = Query(None, min_length=2),
+    tags: Optional[List[str]] = Query(None, description="Теги задачи"),
+    tag_mode: str = Query("any", pattern="^(any|all)$", description="any - хотя бы один из тегов, all - все теги"),
+    sort: str = Query(
+        "-created_at",
+        pattern="^-?(created_at|deadline_at|id)$",
+        description="Ключ сортировки, '-' - по убыванию. При сортировке по deadline_at "
+                    "возвращаются только задачи с дедлайном"
+    ),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    include_total: bool = Query(False, description="Оценить общее число задач по EXPLAIN"),
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
+) -> TaskQueryResponse:
+    if quadrants and not set(quadrants) <= {"Q1", "Q2", "Q3", "Q4"}:
+        raise HTTPException(
+            status_code=400,
+            detail="Неверный квадрант. Используйте: Q1, Q2, Q3, Q4"
         )
 
-    tasks = result.scalars().all()
-    return [prepare_task_to_response(task) for task in tasks]
+    tag_list = parse_tags(tags)
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    cursor_value = None
+    if cursor:
+        try:
+            cursor_value = decode_cursor(cursor, sort_key)
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+    # Колонки, на которые наложено условие равенства - по ним определяется ожидаемый индекс
+    equality_columns = set()
+    if current_user.role.value != "admin":
+        equality_columns.add("user_id")
+    if quadrants and len(set(quadrants)) == 1:
+        equality_columns.add("quadrant")
+    if status is not None:
+        equality_columns.add("completed")
+
+    def build_filters(model) -> list:
+        filters = scope_filters(model, current_user, tag_list, tag_mode)
+        if quadrants:
+            filters.append(model.quadrant.in_(set(quadrants)))
+        if status is not None:
+            filters.append(model.completed == (status == "completed"))
+        if is_important is not None:
+            filters.append(model.is_important == is_important)
+        if deadline_from is not None:
+            filters.append(model.deadline_at >= deadline_from)
+        if deadline_to is not None:
+            filters.append(model.deadline_at < deadline_to)
+        if created_from is not None:
+            filters.append(model.created_at >= created_from)
+        if created_to is not None:
+            filters.append(model.created_at < created_to)
+        if q:
+            keyword = f"%{q.lower()}%"
+            filters.append(model.title.ilike(keyword) | model.description.ilike(keyword))
+        if sort_key == "deadline_at":
+            filters.append(model.deadline_at.isnot(None))
+        return filters
+
+    def sort_columns(columns) -> list:
+        return [columns[sort_key], columns["id"]] if sort_key != "id" else [columns["id"]]
+
+    def build_page(model):
+        columns = model.__table__.c
+        stmt = select(*[columns[name] for name in TASK_COLUMNS]).where(*build_filters(model))
+        keys = sort_columns(columns)
+        if cursor_value is not None:
+            values = cursor_value if sort_key != "id" else cursor_value[1:]
+            if descending:
+                stmt = stmt.where(tuple_(*keys) < tuple_(*values))
+            else:
+                stmt = stmt.where(tuple_(*keys) > tuple_(*values))
+        order = [key.desc() if descending else key.asc() for key in keys]
+        return select(stmt.order_by(*order).limit(limit + 1).subquery())
+
+    # Выполненные задачи могут лежать в архиве
+    if status == "pending":
+        tables = (Task,)
+        page = build_page(Task).subquery()
+    else:
+        tables = (Task, TaskArchive)
+        page = union_all(build_page(Task), build_page(TaskArchive)).subquery()
+    keys = sort_columns(page.c)
+    order = [key.desc() if descending else key.asc() for key in keys]
+    rows = (await db.execute(select(page).order_by(*order).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_key), last.id)
+
+    estimated_total = None
+    if include_total:
+        count_stmt = select(Task.id).where(*build_filters(Task))
+        if status != "pending":
+            count_stmt = union_all(count_stmt, select(TaskArchive.id).where(*build_filters(TaskArchive)))
+        estimated_total = await estimate_count(db, count_stmt)
+
+    plan_name = describe_plans(
+        equality_columns, sort_key, [model.__tablename__ for model in tables], db.get_bind().dialect.name
+    )
+    result = render_tasks(
+        request,
+        await prepare_tasks_to_response(db, rows),
+        layout,
+        extra={
+            "next_cursor": next_cursor,
+            "plan": plan_name,
+            "estimated_total": estimated_total
+        }
+    )
+    # Для msgpack и columnar render_tasks возвращает собственный Response - заголовок ставится на него
+    (result if isinstance(result, Response) else response).headers["X-Query-Plan"] = plan_name
+    return result
 
 
 # Получить задачу по ID
 @router.get("/{task_id}", response_model=TaskResponse)
 async def get_task_by_id(
     task_id: int,
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    db: AsyncSession = Depends(get_read_session),
+    current_user: User = Depends(get_read_user)
 ) -> TaskResponse:
     result = await db.execute(
         select(Task).where(Task.id == task_id)
     )
     task = result.scalar_one_or_none()
+    if not task:
+        task = await get_archived_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     if current_user.role.value != "admin" and task.user_id != current_user.id:
@@ -136,7 +304,20 @@ async def get_task_by_id(
             detail="Нет доступа к этой задаче"
         )
 
-    return prepare_task_to_response(task)
+    response.headers["ETag"] = task_etag(task)
+    return (await prepare_tasks_to_response(db, [task]))[0]
+
+def parse_recurrence_rule(rule: Optional[str]) -> Optional[str]:
+    if rule is None:
+        return None
+    try:
+        return normalize_rule(rule)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Некорректное правило повторения: {error}"
+        )
+
 
 # Создать задачу
 @router.post("/", response_model=TaskResponse, status_code=status.HTTP_201_CREATED)
@@ -148,57 +329,191 @@ async def create_task(
 
     is_urgent = calculate_urgency(task.deadline_at)
     quadrant = define_quadrant(task.is_important, is_urgent)
+    recurrence_rule = parse_recurrence_rule(task.recurrence_rule)
+    tags = parse_tags(task.tags)
+
+    async def create(db: AsyncSession) -> TaskResponse:
+        new_task = Task(
+            title=task.title,
+            description=task.description,
+            is_important=task.is_important,
+            deadline_at=task.deadline_at,
+            quadrant=quadrant,
+            completed=False,
+            user_id=current_user.id,
+            recurrence_rule=recurrence_rule
+        )
 
-    new_task = Task(
-        title=task.title,
-        description=task.description,
-        is_important=task.is_important,
-        deadline_at=task.deadline_at,
-        quadrant=quadrant,
-        completed=False,
-        user_id=current_user.id
-    )
+        db.add(new_task)
+        await adjust_task_counters(db, current_user.id, total=1)
+        # id и created_at заполняет БД - ответ собирается до коммита, в той же транзакции
+        await db.flush()
+        await db.refresh(new_task)
+        if tags:
+            await set_task_tags(db, new_task.id, current_user.id, tags)
+        if recurrence_rule is not None:
+            # Повторения на окно вперед создаются сразу, дальнейшие - планировщиком
+            await materialize_occurrences(db, [new_task])
+        if new_task.deadline_at is not None and current_user.webhook_url:
+            await schedule_reminders(db, [new_task], created=True)
+        return prepare_task_to_response(new_task, tags)
+
+    return await run_in_transaction(db, create)
+
+
+def task_etag(task) -> str:
+    return f'"{task.version}"'
+
+
+# Версия из If-Match ("3" или W/"3"); "*" - любая существующая задача
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    if if_match is None or if_match.strip() == "*":
+        return None
+    value = if_match.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Некорректный заголовок If-Match"
+        )
 
-    db.add(new_task)
-    await db.commit()
-    await db.refresh(new_task)
 
-    return prepare_task_to_response(new_task)
+def version_conflict(task, from_header: bool) -> HTTPException:
+    # If-Match - условие HTTP (412), версия в теле - конфликт данных (409)
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED if from_header else status.HTTP_409_CONFLICT,
+        detail=f"Задача была изменена другим запросом, текущая версия {task.version}",
+        headers={"ETag": task_etag(task)}
+    )
 
 
-# Обновить задачу
-@router.put("/{task_id}", response_model=TaskResponse)
-async def update_task(
-    task_id: int,
-    task_update: TaskUpdate,
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
-) -> TaskResponse:
-
+async def get_task_for_update(db: AsyncSession, task_id: int, current_user: User) -> Task:
+    # populate_existing: при повторной попытке нужны свежие значения, а не объект из identity map
     result = await db.execute(
-        select(Task).where(Task.id == task_id)
+        select(Task).where(Task.id == task_id).execution_options(populate_existing=True)
     )
-
     task = result.scalar_one_or_none()
     if not task:
+        if await get_archived_task(db, task_id):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Задача перенесена в архив и не может быть изменена"
+            )
         raise HTTPException(status_code=404, detail="Задача не найдена")
     if current_user.role.value != "admin" and task.user_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Нет доступа к этой задаче"
         )
-    update_data = task_update.model_dump(exclude_unset=True)
-
-    for field, value in update_data.items():
-        setattr(task, field, value)
+    return task
+
+
+# Изменение задачи без блокировок: один UPDATE ... WHERE version = прочитанная версия.
+# Если строку успели изменить, UPDATE не найдет ее: с версией от клиента это конфликт,
+# без нее задача перечитывается и изменение применяется к свежим данным.
+async def update_task_versioned(
+        db: AsyncSession,
+        task_id: int,
+        current_user: User,
+        make_values,
+        expected_version: Optional[int],
+        from_header: bool,
+        on_updated=None,
+        commit: bool = True
+) -> Task:
+    for _ in range(TASK_UPDATE_ATTEMPTS):
+        task = await get_task_for_update(db, task_id, current_user)
+        if expected_version is not None and task.version != expected_version:
+            raise version_conflict(task, from_header)
+
+        values = make_values(task)
+        was_completed = task.completed
+        # Поля, от которых зависит свод выполнения (строку перезапишет populate_existing)
+        rollup_fields = (task.completed, task.completed_at, task.quadrant, task.deadline_at)
+        result = await db.execute(
+            update(Task)
+            .where(Task.id == task.id, Task.version == task.version)
+            .values(**values, version=Task.version + 1)
+            .returning(Task)
+            .execution_options(synchronize_session=False, populate_existing=True)
+        )
+        updated = result.scalar_one_or_none()
+        if updated is None:
+            if expected_version is not None:
+                raise version_conflict(await get_task_for_update(db, task_id, current_user), from_header)
+            continue
+
+        await adjust_task_counters(
+            db, updated.user_id, completed=int(updated.completed) - int(was_completed)
+        )
+        if was_completed and rollup_fields != (updated.completed, updated.completed_at, updated.quadrant, updated.deadline_at):
+            # День выполнения уже мог попасть в свод - его нужно пересчитать
+            await invalidate_completion_day(db, updated.user_id, rollup_fields[1])
+        # Связанные изменения (теги, повторения серии) - в той же транзакции
+        if on_updated is not None:
+            await on_updated(updated)
+        if commit:
+            await db.commit()
+        return updated
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Задача одновременно изменяется другими запросами, повторите позже"
+    )
 
-    is_urgent = calculate_urgency(task.deadline_at)
-    task.quadrant = define_quadrant(task.is_important, is_urgent)
 
-    await db.commit()
-    await db.refresh(task)
-
-    return prepare_task_to_response(task)
+# Обновить задачу
+@router.put("/{task_id}", response_model=TaskResponse)
+async def update_task(
+    task_id: int,
+    task_update: TaskUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user)
+) -> TaskResponse:
+    update_data = task_update.model_dump(exclude_unset=True)
+    body_version = update_data.pop("version", None)
+    header_version = parse_if_match(if_match)
+    if "recurrence_rule" in update_data:
+        update_data["recurrence_rule"] = parse_recurrence_rule(update_data["recurrence_rule"])
+    tags = update_data.pop("tags", None)
+    if tags is not None:
+        tags = parse_tags(tags)
+    previous_rule = {}
+
+    def make_values(task: Task) -> dict:
+        if update_data.get("recurrence_rule") and task.recurrence_parent_id is not None:
+            raise HTTPException(
+                status_code=400,
+                detail="Правило повторения задается у исходной задачи серии"
+            )
+        previous_rule["value"] = task.recurrence_rule
+        values = dict(update_data)
+        is_important = values.get("is_important", task.is_important)
+        deadline_at = values.get("deadline_at", task.deadline_at)
+        values["quadrant"] = define_quadrant(is_important, calculate_urgency(deadline_at))
+        return values
+
+    async def on_updated(task: Task):
+        if tags is not None:
+            await set_task_tags(db, task.id, task.user_id, tags)
+        if "recurrence_rule" in update_data and update_data["recurrence_rule"] != previous_rule["value"]:
+            await reschedule_series(db, task)
+        if "deadline_at" in update_data or "completed" in update_data:
+            await schedule_reminders(db, [task])
+
+    task = await update_task_versioned(
+        db, task_id, current_user, make_values,
+        expected_version=header_version if header_version is not None else body_version,
+        from_header=header_version is not None,
+        on_updated=on_updated
+    )
+    response.headers["ETag"] = task_etag(task)
+    return (await prepare_tasks_to_response(db, [task]))[0]
 
 # Удалить задачу
 @router.delete("/{task_id}", status_code=status.HTTP_200_OK)
@@ -211,6 +526,9 @@ async def delete_task(
         select(Task).where(Task.id == task_id)
     )
     task = result.scalar_one_or_none()
+    if not task:
+        # Выполненную задачу можно удалить и из архива
+        task = await get_archived_task(db, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
@@ -226,6 +544,10 @@ async def delete_task(
     }
 
     await db.delete(task)
+    await delete_task_tags(db, [task.id])
+    if task.completed:
+        await invalidate_completion_day(db, task.user_id, task.completed_at)
+    await adjust_task_counters(db, task.user_id, total=-1, completed=-int(task.completed))
     await db.commit()
 
     return {
@@ -238,25 +560,25 @@ async def delete_task(
 @router.patch("/{task_id}/complete", response_model=TaskResponse)
 async def complete_task(
     task_id: int,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_async_session),
     current_user: User = Depends(get_current_user)
 ) -> TaskResponse:
-    result = await db.execute(
-        select(Task).where(Task.id == task_id)
-    )
-    task = result.scalar_one_or_none()
-    if not task:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-
-    if current_user.role.value != "admin" and task.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Нет доступа к этой задаче"
+    header_version = parse_if_match(if_match)
+
+    async def complete(db: AsyncSession) -> tuple:
+        task = await update_task_versioned(
+            db, task_id, current_user,
+            lambda task: {"completed": True, "completed_at": datetime.now(timezone.utc)},
+            expected_version=header_version,
+            from_header=True,
+            # Напоминание о выполненной задаче больше не нужно
+            on_updated=lambda task: schedule_reminders(db, [task]),
+            commit=False
         )
-    task.completed = True
-    task.completed_at = datetime.now(timezone.utc)
-
-    await db.commit()
-    await db.refresh(task)
+        return task_etag(task), (await prepare_tasks_to_response(db, [task]))[0]
 
-    return prepare_task_to_response(task)
+    etag, task_response = await run_in_transaction(db, complete)
+    response.headers["ETag"] = etag
+    return task_response
@@ -1,58 +1,367 @@
-from datetime import datetime
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from sqlalchemy import select
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+from sqlalchemy import select, update, or_
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
 from database import AsyncSessionLocal
 from models.task import Task
+from models.scheduler_lease import SchedulerLease
+from models.scheduler_run import SchedulerRun
 from utils import define_quadrant, calculate_urgency
+from archive import archive_completed_tasks
+from rollups import rollup_completions
+from analytics import refresh_snapshot, ANALYTICS_MAX_STALENESS_SECONDS
+from recurrence import generate_occurrences
+from slow_queries import current_source as current_query_source
 
+load_dotenv()
+# single - каждую задачу выполняет один воркер целиком,
+# partitioned - пересчет делится на диапазоны user_id между воркерами
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "single")
+SCHEDULER_PARTITIONS = int(os.getenv("SCHEDULER_PARTITIONS", "8"))
+# Через сколько секунд аренда считается брошенной (воркер упал)
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "600"))
+# Размер пачки задач, которую планировщик обрабатывает за одну транзакцию
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "1000"))
 
-async def update_task_urgency():
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Запуск обновления квадрантов...")
+# Уникальный идентификатор процесса (uvicorn --workers N запускает N процессов)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def update_task_urgency(
+        partition: Optional[int] = None,
+        partitions: int = 1,
+        stats: Optional[dict] = None
+) -> dict:
+    # stats заполняется по ходу работы, чтобы при ошибке сохранился частичный прогресс
+    if stats is None:
+        stats = {}
+    stats.update(rows_scanned=0, rows_updated=0, batches=0)
 
     async with AsyncSessionLocal() as db:
-        try:
-            # Получение активных задач
-            result = await db.execute(
-                select(Task).where(Task.completed == False)
+        last_id = 0
+        while True:
+            # Получение активных задач пачками по id (keyset-пагинация)
+            stmt = (
+                select(Task.id, Task.is_important, Task.deadline_at, Task.quadrant)
+                .where(Task.completed == False, Task.id > last_id)
+                .order_by(Task.id)
+                .limit(SCHEDULER_BATCH_SIZE)
             )
-            tasks = result.scalars().all()
+            if partition is not None:
+                # Только пользователи своей партиции
+                stmt = stmt.where(Task.user_id % partitions == partition)
+            rows = (await db.execute(stmt)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
 
-            updated_count = 0
+            # Новый квадрант -> id задач, которые в него переходят
+            changes = {}
+            for row in rows:
+                is_urgent = calculate_urgency(row.deadline_at)
+                new_quadrant = define_quadrant(row.is_important, is_urgent)
+                if row.quadrant != new_quadrant:
+                    changes.setdefault(new_quadrant, []).append(row.id)
 
-            for task in tasks:
-                # Вычисление срочности
-                is_urgent = calculate_urgency(task.deadline_at)
+            for quadrant, ids in changes.items():
+                await db.execute(
+                    update(Task)
+                    .where(Task.id.in_(ids))
+                    .values(quadrant=quadrant)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
 
-                # Вычисление нового квадранта
-                new_quadrant = define_quadrant(task.is_important, is_urgent)
+            stats["rows_scanned"] += len(rows)
+            stats["rows_updated"] += sum(len(ids) for ids in changes.values())
+            stats["batches"] += 1
 
-                # Обновление в бд квадранта
-                if task.quadrant != new_quadrant:
-                    task.quadrant = new_quadrant
-                    updated_count += 1
+    return stats
 
-            if updated_count > 0:
-                await db.commit()
-                print(f"Обновлено квадрантов: {updated_count}")
-            else:
-                print("Нет изменений.")
 
-        except Exception as e:
-            print(f"Ошибка при обновлении: {e}")
+# Задачи, которые выполняются под арендой
+JOBS = {
+    "update_urgency": update_task_urgency,
+    "archive_completed": archive_completed_tasks,
+    "rollup_completions": rollup_completions,
+    "generate_occurrences": generate_occurrences,
+}
+
+
+def lease_name(job_id: str, partition: Optional[int]) -> str:
+    if partition is None:
+        return job_id
+    return f"{job_id}:{partition}"
+
+
+# Плановое время запуска: последнее срабатывание cron не позже текущего момента.
+# Воркер, который сработал с опозданием (перегруженный цикл событий, переход через минуту),
+# получает тот же ключ, что и остальные, и не выполняет задачу повторно.
+def _scheduled_run_time(trigger, now: datetime) -> datetime:
+    fire_time = trigger.get_next_fire_time(None, now - timedelta(days=1))
+    scheduled = None
+    while fire_time is not None and fire_time <= now:
+        scheduled = fire_time
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+    return scheduled or now
+
+
+def _current_run_key(trigger=None) -> str:
+    now = datetime.now(timezone.utc)
+    if trigger is not None:
+        now = _scheduled_run_time(trigger, now)
+    return now.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M")
+
+
+async def acquire_lease(name: str, run_key: str) -> bool:
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)
+
+    async with AsyncSessionLocal() as db:
+        # Забираем аренду, если она свободна (завершена или просрочена)
+        # и этот запуск еще не был выполнен
+        result = await db.execute(
+            update(SchedulerLease)
+            .where(
+                SchedulerLease.name == name,
+                or_(SchedulerLease.expires_at < now, SchedulerLease.completed == True),
+                or_(SchedulerLease.run_key != run_key, SchedulerLease.completed == False),
+            )
+            .values(owner=WORKER_ID, run_key=run_key, expires_at=expires_at, completed=False)
+        )
+        if result.rowcount == 1:
+            await db.commit()
+            return True
+
+        existing = await db.execute(
+            select(SchedulerLease.name).where(SchedulerLease.name == name)
+        )
+        if existing.first() is not None:
             await db.rollback()
+            return False
+
+        # Записи еще нет: из нескольких одновременных INSERT пройдет только один
+        db.add(SchedulerLease(
+            name=name,
+            owner=WORKER_ID,
+            run_key=run_key,
+            expires_at=expires_at,
+            completed=False
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            return False
+        return True
+
+
+# Запуск run_key под арендой name уже выполнен до конца
+async def is_lease_completed(name: str, run_key: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        lease = (await db.execute(
+            select(SchedulerLease.run_key, SchedulerLease.completed).where(SchedulerLease.name == name)
+        )).one_or_none()
+        return lease is not None and lease.run_key == run_key and lease.completed
+
+
+# Продлевает аренду; False - аренду уже забрал другой воркер
+async def renew_lease(name: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.owner == WORKER_ID, SchedulerLease.completed == False)
+            .values(expires_at=datetime.now(timezone.utc) + timedelta(seconds=SCHEDULER_LEASE_SECONDS))
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+
+async def _keep_lease(name: str, job: asyncio.Task):
+    while True:
+        await asyncio.sleep(SCHEDULER_LEASE_SECONDS / 3)
+        try:
+            renewed = await renew_lease(name)
+        except Exception as e:
+            # Временная ошибка БД: попробуем еще раз до истечения аренды
+            print(f"Не удалось продлить аренду {name}: {type(e).__name__}: {e}")
+            continue
+        if not renewed:
+            job.cancel()
+            return
+
+
+async def release_lease(name: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.owner == WORKER_ID)
+            .values(completed=True, expires_at=datetime.now(timezone.utc))
+        )
+        await db.commit()
+
+
+# Выполняет задачу и сохраняет запись о запуске в scheduler_runs
+async def run_and_record(job_id: str, partition: Optional[int] = None) -> SchedulerRun:
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    print(f"[{started_at.strftime('%Y-%m-%d %H:%M:%S')}] Запуск {lease_name(job_id, partition)}...")
+
+    stats = {}
+    error = None
+    # Запросы задачи в журнале медленных запросов подписываются ее именем
+    current_query_source.set(f"job:{lease_name(job_id, partition)}")
+    try:
+        if partition is None:
+            await JOBS[job_id](stats=stats)
+        else:
+            await JOBS[job_id](partition=partition, partitions=SCHEDULER_PARTITIONS, stats=stats)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"Ошибка в задаче {job_id}: {error}")
+
+    run = SchedulerRun(
+        job_id=job_id,
+        partition=partition,
+        worker=WORKER_ID,
+        started_at=started_at,
+        finished_at=datetime.now(timezone.utc),
+        duration_ms=(time.perf_counter() - started) * 1000,
+        rows_scanned=stats.get("rows_scanned", 0),
+        rows_updated=stats.get("rows_updated", 0),
+        batches=stats.get("batches", 0),
+        error=error
+    )
+    async with AsyncSessionLocal() as db:
+        db.add(run)
+        await db.commit()
+
+    print(
+        f"Задача {job_id} завершена за {run.duration_ms:.0f} мс: "
+        f"просмотрено {run.rows_scanned}, обновлено {run.rows_updated}"
+    )
+    return run
+
+
+# Выполняет run() под арендой name, продлевая ее, пока работа идет.
+# False - аренду держит другой воркер или этот запуск уже выполнен.
+async def run_with_lease(name: str, run_key: str, run: Callable[[], Awaitable]) -> bool:
+    if not await acquire_lease(name, run_key):
+        return False
+
+    job = asyncio.create_task(run())
+    keeper = asyncio.create_task(_keep_lease(name, job))
+    try:
+        await asyncio.wait({job})
+    finally:
+        keeper.cancel()
+        if not job.done():
+            # Остановка приложения: аренда не освобождается, и после ее истечения
+            # незавершенную работу подхватит reclaim_expired_leases
+            job.cancel()
+
+    if job.cancelled():
+        # Аренда истекла (например, долгая пауза процесса) и перешла другому воркеру
+        raise RuntimeError(f"Аренда {name} перешла другому воркеру, выполнение прервано")
+    await release_lease(name)
+    job.result()
+    return True
+
+
+async def _run_with_lease(job_id: str, run_key: str, partition: Optional[int]):
+    name = lease_name(job_id, partition)
+    try:
+        await run_with_lease(name, run_key, lambda: run_and_record(job_id, partition))
+    except RuntimeError as e:
+        print(e)
+
+
+async def run_job(job_id: str, trigger=None):
+    run_key = _current_run_key(trigger)
+
+    if SCHEDULER_MODE == "partitioned":
+        partitions = list(range(SCHEDULER_PARTITIONS))
+        # Воркеры начинают с разных партиций и не ждут друг друга
+        random.shuffle(partitions)
+        for partition in partitions:
+            await _run_with_lease(job_id, run_key, partition)
+    else:
+        await _run_with_lease(job_id, run_key, None)
+
+
+# Подбирает работу воркеров, которые упали, не завершив свою аренду
+async def reclaim_expired_leases():
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(SchedulerLease).where(
+                SchedulerLease.completed == False,
+                SchedulerLease.expires_at < datetime.now(timezone.utc)
+            )
+        )
+        leases = result.scalars().all()
+
+    for lease in leases:
+        job_id, _, partition = lease.name.partition(":")
+        if job_id not in JOBS or lease.run_key.startswith("job:"):
+            # Ручной запуск (задание из jobs) после падения воркера перезапускает очередь заданий
+            continue
+        print(f"Повторный запуск брошенной задачи {lease.name} ({lease.run_key})")
+        await _run_with_lease(job_id, lease.run_key, int(partition) if partition else None)
 
 
 def start_scheduler():
+    # APScheduler импортируется только при запуске планировщика
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.cron import CronTrigger
     scheduler = AsyncIOScheduler()
 
+    # Триггер передается в задачу, чтобы ключ запуска считался от планового времени
+    def add_cron_job(job_id: str, name: str, **cron):
+        trigger = CronTrigger(**cron)
+        scheduler.add_job(
+            run_job,
+            trigger=trigger,
+            args=[job_id, trigger],
+            id=job_id,
+            name=name,
+            replace_existing=True
+        )
+
     # Основная задача: запускаем каждый день в 09:00
+    add_cron_job("update_urgency", 'Обновление срочности задач', hour=9, minute=0)
+
+    # Перенос давно выполненных задач в архив: каждый день в 03:00
+    add_cron_job("archive_completed", 'Архивация выполненных задач', hour=3, minute=0)
+
+    # Дневной свод для аналитики выполнения: каждый час в :15
+    add_cron_job("rollup_completions", 'Свод по выполненным задачам', minute=15)
+
+    # Повторения регулярных задач на окно вперед: каждый час в :45
+    add_cron_job("generate_occurrences", 'Создание повторений регулярных задач', minute=45)
+
+    # Снимок аналитики хранится в памяти процесса, поэтому собирается каждым воркером без аренды
+    scheduler.add_job(
+        refresh_snapshot,
+        trigger='interval',
+        seconds=max(ANALYTICS_MAX_STALENESS_SECONDS // 2, 30),
+        id='refresh_analytics',
+        name='Пересборка снимка аналитики',
+        replace_existing=True
+    )
+
     scheduler.add_job(
-        update_task_urgency,
-        trigger='cron',
-        hour=9,
-        minute=0,
-        id='update_urgency',
-        name='Обновление срочности задач',
+        reclaim_expired_leases,
+        trigger='interval',
+        seconds=max(SCHEDULER_LEASE_SECONDS // 2, 30),
+        id='reclaim_leases',
+        name='Перезапуск брошенных задач',
         replace_existing=True
     )
 
@@ -67,6 +376,6 @@ def start_scheduler():
     #  )
 
     scheduler.start()
-    print("Планировщик задач запущен")
+    print(f"Планировщик задач запущен (режим: {SCHEDULER_MODE}, воркер: {WORKER_ID})")
 
     return scheduler
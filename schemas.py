@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 # --- Pydantic Модели ---
@@ -26,6 +26,17 @@ class TaskBase(BaseModel):
         None,
         description="Плановый дедлайн"
     )
+    recurrence_rule: Optional[str] = Field(
+        None,
+        max_length=255,
+        description="Повторение: daily, weekly, monthly или RRULE (FREQ, INTERVAL, BYDAY, COUNT, UNTIL)",
+        examples=["FREQ=WEEKLY;BYDAY=MO,WE"]
+    )
+    tags: List[str] = Field(
+        default_factory=list,
+        description="Теги задачи (до 20, хранятся в нижнем регистре)",
+        examples=[["работа", "отчет"]]
+    )
 
 ## Схема для создания новой задачи
 ## Наследует все поля от TaskBase
@@ -58,6 +69,19 @@ class TaskUpdate(BaseModel):
         None,
         description="Статус выполнения"
     )
+    recurrence_rule: Optional[str] = Field(
+        None,
+        max_length=255,
+        description="Новое правило повторения (null - прекратить повторения)"
+    )
+    tags: Optional[List[str]] = Field(
+        None,
+        description="Новый набор тегов (заменяет текущий)"
+    )
+    version: Optional[int] = Field(
+        None,
+        description="Версия задачи, которую видел клиент (вместо заголовка If-Match)"
+    )
 
 ## Модель для ответа (TaskResponse)
 ## Включает сгенерированные поля (id, created_at, quadrant) и наследует TaskBase.
@@ -91,6 +115,18 @@ class TaskResponse(TaskBase):
     days_until_deadline: Optional[int] = Field(
         None,
         description="Дней до дедлайна")
+    version: int = Field(
+        1,
+        description="Версия задачи (совпадает с ETag)"
+    )
+    recurrence_parent_id: Optional[int] = Field(
+        None,
+        description="Исходная задача серии, если это повторение"
+    )
+    occurrence_at: Optional[datetime] = Field(
+        None,
+        description="Плановое время повторения"
+    )
 
     class Config:
         # Config класс для работы с ORM (понадобится после подключения СУБД)
@@ -112,4 +148,35 @@ class TimingStatsResponse(BaseModel):
     overtime_pending: int = Field(
         ...,
         description="Количество просроченных незавершенных задач"
-    )
\ No newline at end of file
+    )
+
+## Ответ GET /tasks/query: страница задач и курсор следующей страницы
+class TaskQueryResponse(BaseModel):
+    items: List[TaskResponse] = Field(
+        ...,
+        description="Задачи текущей страницы"
+    )
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Курсор следующей страницы (None - страниц больше нет)"
+    )
+    plan: str = Field(
+        ...,
+        description="Ожидаемый индекс каждой ветки запроса: tasks=...; tasks_archive=... (подсказка, SQL не меняется)"
+    )
+    estimated_total: Optional[int] = Field(
+        None,
+        description="Оценка общего числа задач по EXPLAIN (только PostgreSQL)"
+    )
+
+
+## Постановка фонового задания администратором
+class JobCreate(BaseModel):
+    kind: str = Field(
+        ...,
+        description="Задание: update_urgency, archive_completed, rollup_completions, generate_occurrences, reconcile_counters"
+    )
+    params: dict = Field(
+        default_factory=dict,
+        description="Параметры задания (rollup_completions: {\"full\": true})"
+    )
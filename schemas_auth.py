@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, HttpUrl
 from typing import Optional
 from models.user import UserRole
 
@@ -34,6 +34,7 @@ class UserResponse(BaseModel):
     nickname: str
     email: str
     role: UserRole
+    webhook_url: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -50,4 +51,19 @@ class Token(BaseModel):
 # Данные, извлекаемые из токена
 class TokenData(BaseModel):
     user_id: Optional[int] = None
-    role: Optional[str] = None
\ No newline at end of file
+    role: Optional[str] = None
+
+# Вебхук для напоминаний о дедлайнах
+class WebhookUpdate(BaseModel):
+    url: HttpUrl = Field(
+        ...,
+        description="Адрес https, на который отправляются POST-запросы с напоминаниями"
+    )
+
+
+class WebhookResponse(BaseModel):
+    url: Optional[str] = None
+    # Ключ подписи X-Webhook-Signature, показывается только при настройке вебхука
+    secret: Optional[str] = None
+    # Фоновое задание, создающее напоминания по будущим дедлайнам
+    job_id: Optional[int] = None
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+# Запросы дольше порога (мс) попадают в журнал, 0 - журнал выключен
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Сколько последних медленных запросов хранится в памяти процесса
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# Доля медленных запросов, для которых снимается план (EXPLAIN ANALYZE выполняет запрос повторно)
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+# Не чаще одного плана на один и тот же запрос за это время
+SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS = float(os.getenv("SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS", "300"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+
+# Источник запросов: маршрут API или задача планировщика
+current_source: ContextVar[Optional[str]] = ContextVar("slow_query_source", default=None)
+# Область ASGI текущего запроса: шаблон маршрута появляется в ней после роутинга
+current_scope: ContextVar[Optional[dict]] = ContextVar("slow_query_scope", default=None)
+
+_entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_last_explained = {}
+_explain_running = False
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+# Списки параметров (IN (...), VALUES пачкой) разной длины - один и тот же запрос
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|\$\d+|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|\$\d+|%\(\w+\)s|:\w+))+\s*\)")
+
+
+def normalize_sql(statement: str) -> str:
+    sql = _WHITESPACE.sub(" ", statement).strip()
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _PARAMETER_LIST.sub("(...)", sql)
+
+
+def fingerprint(normalized_sql: str) -> str:
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:16]
+
+
+# Строки (email, тексты задач, хеши паролей) не сохраняются - только тип и длина
+def _redact_value(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(item) for item in value[:20]]
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters, executemany: bool):
+    if executemany:
+        rows = list(parameters or [])
+        return {"rows": len(rows), "first": redact_parameters(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: _redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_redact_value(value) for value in parameters]
+    return _redact_value(parameters)
+
+
+def _source() -> Optional[str]:
+    source = current_source.get()
+    if source is not None:
+        return source
+    scope = current_scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path")
+    return f"{scope.get('method')} {path}"
+
+
+# Блокирующее чтение или изменение данных где-то в запросе (в том числе в CTE)
+_LOCKING_OR_WRITING = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE)\b|\bFOR\s+KEY\s+SHARE\b|\b(?:INSERT|UPDATE|DELETE|MERGE)\b",
+    re.IGNORECASE
+)
+
+
+def _statement_kind(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+
+
+def _explain_sql(dialect_name: str, statement: str) -> Optional[str]:
+    kind = _statement_kind(statement)
+    # BEGIN, DDL, PRAGMA и т.п. не объясняются, но в журнал попадают
+    if kind not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+        return None
+    if dialect_name == "postgresql":
+        # ANALYZE выполняет запрос - только для чтения; изменения данных без ANALYZE.
+        # Откат транзакции отменит изменения, но не блокировки строк, которые повторное выполнение
+        # возьмет у живых воркеров: SELECT ... FOR UPDATE (захват заданий, напоминаний)
+        # и WITH с INSERT/UPDATE/DELETE внутри тоже объясняются без ANALYZE.
+        if kind in ("SELECT", "WITH") and not _LOCKING_OR_WRITING.search(statement):
+            return "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement
+        return "EXPLAIN (FORMAT JSON) " + statement
+    if dialect_name == "sqlite":
+        return "EXPLAIN QUERY PLAN " + statement
+    return None
+
+
+# План снимается на отдельном соединении в фоне, запрос пользователя его не ждет
+async def _capture_explain(async_engine, entry: dict, statement: str, parameters):
+    global _explain_running
+    try:
+        explain = _explain_sql(async_engine.dialect.name, statement)
+        async with async_engine.connect() as conn:
+            conn = await conn.execution_options(slow_query_log=False)
+            async with conn.begin() as transaction:
+                if async_engine.dialect.name == "postgresql":
+                    await conn.exec_driver_sql(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                result = await conn.exec_driver_sql(explain, parameters)
+                rows = result.all()
+                # Изменения от EXPLAIN ANALYZE не нужны, даже если это был SELECT с побочным эффектом
+                await transaction.rollback()
+
+        if async_engine.dialect.name == "postgresql":
+            plan = rows[0][0]
+            entry["explain"] = json.loads(plan) if isinstance(plan, str) else plan
+        else:
+            entry["explain"] = [" ".join(str(value) for value in row) for row in rows]
+    except Exception as error:
+        entry["explain_error"] = f"{type(error).__name__}: {error}"
+    finally:
+        _explain_running = False
+
+
+def _should_explain(key: str, executemany: bool) -> bool:
+    if executemany or _explain_running or SLOW_QUERY_EXPLAIN_SAMPLE_RATE <= 0:
+        return False
+    if random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE_RATE:
+        return False
+    last = _last_explained.get(key)
+    return last is None or time.monotonic() - last >= SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS
+
+
+def _record(async_engine, conn, statement, parameters, executemany, duration_ms, rowcount):
+    global _explain_running
+    normalized = normalize_sql(statement)
+    key = fingerprint(normalized)
+    entry = {
+        "at": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round(duration_ms, 2),
+        "fingerprint": key,
+        "sql": normalized,
+        "parameters": redact_parameters(parameters, executemany),
+        "source": _source(),
+        "database": conn.engine.url.render_as_string(hide_password=True).split("@")[-1],
+        "rows": rowcount,
+        "explain": None,
+    }
+    _entries.append(entry)
+
+    if _explain_sql(conn.dialect.name, statement) is None or not _should_explain(key, executemany):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _explain_running = True
+    if len(_last_explained) > 10000:
+        _last_explained.clear()
+    _last_explained[key] = time.monotonic()
+    entry["explain"] = "pending"
+    loop.create_task(_capture_explain(async_engine, entry, statement, parameters))
+
+
+# Подключает журнал к движку (AsyncEngine). explain_engine - откуда снимать планы,
+# если у движка нет свободных соединений (у писателя SQLite оно одно)
+def install(async_engine, explain_engine=None):
+    if SLOW_QUERY_MS <= 0:
+        return
+    sync_engine = async_engine.sync_engine
+    explain_engine = explain_engine or async_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["slow_query_started"].pop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < SLOW_QUERY_MS or not conn.get_execution_options().get("slow_query_log", True):
+            return
+        _record(explain_engine, conn, statement, parameters, executemany, duration_ms, cursor.rowcount)
+
+    # Запрос завершился ошибкой - after_cursor_execute не будет, метку времени нужно снять
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(context):
+        connection = context.connection
+        if connection is not None and connection.info.get("slow_query_started"):
+            connection.info["slow_query_started"].pop()
+
+
+def get_entries(limit: int = 50, fingerprint_filter: Optional[str] = None) -> list:
+    entries = [entry for entry in reversed(_entries) if fingerprint_filter in (None, entry["fingerprint"])]
+    return entries[:limit]
+
+
+# Сводка по одинаковым запросам: сколько раз попали в журнал, среднее и максимальное время
+def summarize_entries() -> list:
+    groups = {}
+    for entry in _entries:
+        group = groups.setdefault(entry["fingerprint"], {
+            "fingerprint": entry["fingerprint"],
+            "sql": entry["sql"],
+            "count": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "sources": set(),
+        })
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+        if entry["source"]:
+            group["sources"].add(entry["source"])
+
+    summary = []
+    for group in groups.values():
+        summary.append({
+            "fingerprint": group["fingerprint"],
+            "sql": group["sql"],
+            "count": group["count"],
+            "mean_ms": round(group["total_ms"] / group["count"], 2),
+            "max_ms": group["max_ms"],
+            "sources": sorted(group["sources"]),
+        })
+    return sorted(summary, key=lambda item: item["count"] * item["mean_ms"], reverse=True)
+
+
+# ASGI-обертка: запоминает область запроса, чтобы журнал знал маршрут
+class SlowQuerySourceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
@@ -0,0 +1,82 @@
+from typing import Iterable, List, Optional
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.task_tag import TaskTag
+
+MAX_TAGS_PER_TASK = 20
+MAX_TAG_LENGTH = 50
+# Сколько id задач передается в один запрос IN при загрузке тегов
+TAGS_LOAD_CHUNK_SIZE = 5000
+
+TAG_MODE_ANY = "any"
+TAG_MODE_ALL = "all"
+
+
+# Теги хранятся в нижнем регистре без повторов; ValueError, если тег пустой или слишком длинный
+def normalize_tags(tags: Iterable[str]) -> List[str]:
+    normalized = []
+    for tag in tags:
+        tag = tag.strip().lower()
+        if not tag:
+            raise ValueError("Пустой тег")
+        if len(tag) > MAX_TAG_LENGTH:
+            raise ValueError(f"Тег длиннее {MAX_TAG_LENGTH} символов: {tag}")
+        if tag not in normalized:
+            normalized.append(tag)
+    if len(normalized) > MAX_TAGS_PER_TASK:
+        raise ValueError(f"У задачи может быть не больше {MAX_TAGS_PER_TASK} тегов")
+    return normalized
+
+
+# id задача -> отсортированные теги
+async def load_tags(db: AsyncSession, task_ids: List[int]) -> dict:
+    tags = {}
+    for i in range(0, len(task_ids), TAGS_LOAD_CHUNK_SIZE):
+        result = await db.execute(
+            select(TaskTag.task_id, TaskTag.tag)
+            .where(TaskTag.task_id.in_(task_ids[i:i + TAGS_LOAD_CHUNK_SIZE]))
+            .order_by(TaskTag.task_id, TaskTag.tag)
+        )
+        for task_id, tag in result:
+            tags.setdefault(task_id, []).append(tag)
+    return tags
+
+
+# Заменяет теги задачи в текущей транзакции
+async def set_task_tags(db: AsyncSession, task_id: int, user_id: int, tags: List[str]):
+    await db.execute(delete(TaskTag).where(TaskTag.task_id == task_id))
+    if tags:
+        await db.execute(
+            insert(TaskTag),
+            [{"task_id": task_id, "user_id": user_id, "tag": tag} for tag in tags]
+        )
+
+
+async def delete_task_tags(db: AsyncSession, task_ids):
+    await db.execute(
+        delete(TaskTag)
+        .where(TaskTag.task_id.in_(task_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Условие на задачи с тегами: any - хотя бы один из тегов, all - все теги.
+# Подзапрос идет по индексу task_tags, а не по тексту задач.
+def tag_filter(model, tags: List[str], mode: str = TAG_MODE_ANY, user_id: Optional[int] = None):
+    subquery = select(TaskTag.task_id).where(TaskTag.tag.in_(tags))
+    if user_id is not None:
+        subquery = subquery.where(TaskTag.user_id == user_id)
+    if mode == TAG_MODE_ALL and len(tags) > 1:
+        # (task_id, tag) - первичный ключ, поэтому count(*) = число разных тегов задачи
+        subquery = subquery.group_by(TaskTag.task_id).having(func.count() == len(tags))
+    return model.id.in_(subquery)
+
+
+# Число задач по каждому тегу одним запросом с группировкой
+async def tag_counts(db: AsyncSession, user_id: Optional[int] = None, limit: int = 100) -> list:
+    count = func.count().label("count")
+    stmt = select(TaskTag.tag, count).group_by(TaskTag.tag).order_by(count.desc(), TaskTag.tag).limit(limit)
+    if user_id is not None:
+        stmt = stmt.where(TaskTag.user_id == user_id)
+    result = await db.execute(stmt)
+    return [{"tag": tag, "count": tag_count} for tag, tag_count in result]
@@ -0,0 +1,72 @@
+import json
+from typing import List, Optional
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from schemas import TaskResponse
+from tracing import span
+
+# msgpack - необязательная зависимость: без нее ответы отдаются в JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# Поля задачи в порядке колонок для columnar-формата
+TASK_FIELDS = list(TaskResponse.model_fields)
+
+_task_list_adapter = TypeAdapter(List[TaskResponse])
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def tasks_to_rows(tasks: List[TaskResponse]) -> list:
+    # Одна сериализация всего списка вместо model_dump для каждой задачи
+    return _task_list_adapter.dump_python(tasks, mode="json")
+
+
+# Один массив на поле: имена полей не повторяются для каждой задачи
+def tasks_to_columns(tasks: List[TaskResponse]) -> dict:
+    rows = tasks_to_rows(tasks)
+    return {
+        "count": len(rows),
+        "columns": {field: [row[field] for row in rows] for field in TASK_FIELDS}
+    }
+
+
+def encode_json(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def encode_msgpack(payload) -> bytes:
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+# Ответ со списком задач в формате, который запросил клиент.
+# extra - дополнительные поля ответа (курсор и т.п.), задачи тогда кладутся в "items".
+def render_tasks(
+        request: Request,
+        tasks: List[TaskResponse],
+        layout: Optional[str] = None,
+        extra: Optional[dict] = None
+):
+    use_msgpack = wants_msgpack(request)
+
+    # Формат по умолчанию - обычный JSON через response_model FastAPI
+    if not use_msgpack and layout != "columnar":
+        if extra is None:
+            return tasks
+        return {"items": tasks, **extra}
+
+    with span("serialize.encode", format="msgpack" if use_msgpack else "json", layout=layout or "rows"):
+        data = tasks_to_columns(tasks) if layout == "columnar" else tasks_to_rows(tasks)
+        payload = data if extra is None else {"items": data, **extra}
+        if use_msgpack:
+            content, media_type = encode_msgpack(payload), "application/msgpack"
+        else:
+            content, media_type = encode_json(payload), "application/json"
+    return Response(content=content, media_type=media_type)
@@ -0,0 +1,39 @@
+# Тесты идут на SQLite во временном файле: настройки задаются до импорта модулей приложения
+import os
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix="todo-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["DB_INIT_MODE"] = "create_all"
+os.environ["TRACING_ENABLED"] = "false"
+os.environ["REMINDER_DISPATCHER"] = "0"
+os.environ["JOB_WORKERS"] = "0"
+
+import pytest  # noqa: E402
+from sqlalchemy import delete  # noqa: E402
+import models  # noqa: E402,F401
+from database import Base, engine, sqlite_reader_engine, init_db  # noqa: E402
+
+
+# Все тесты и фикстуры выполняются в одном цикле событий: пул соединений движка привязан к нему
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def schema(anyio_backend):
+    await init_db()
+    yield
+    await engine.dispose()
+    if sqlite_reader_engine is not None and sqlite_reader_engine is not engine:
+        await sqlite_reader_engine.dispose()
+
+
+# Каждый тест начинает с пустых таблиц
+@pytest.fixture(autouse=True)
+async def clean_tables(schema):
+    async with engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            await conn.execute(delete(table))
+    yield
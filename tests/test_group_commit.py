@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+import group_commit
+from database import AsyncSessionLocal
+from models import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def grouped(monkeypatch):
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT_ENABLED", True)
+    # Окно с запасом, чтобы все изменения теста попали в одну группу
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT_WINDOW_MS", 200)
+    yield
+    await group_commit.stop_group_commit()
+
+
+def _add_user(nickname: str, fail: bool = False):
+    async def operation(db):
+        user = User(nickname=nickname, email=f"{nickname}@example.com", hashed_password="-")
+        db.add(user)
+        await db.flush()
+        if fail:
+            raise ValueError(nickname)
+        return user.id
+    return operation
+
+
+async def _run(operation):
+    async with AsyncSessionLocal() as db:
+        return await group_commit.run_in_transaction(db, operation)
+
+
+async def _nicknames() -> list:
+    async with AsyncSessionLocal() as db:
+        return sorted((await db.execute(select(User.nickname))).scalars())
+
+
+async def test_failed_operation_rolls_back_only_its_savepoint(grouped):
+    before = group_commit.get_stats()
+    results = await asyncio.gather(
+        _run(_add_user("alice")),
+        _run(_add_user("broken", fail=True)),
+        _run(_add_user("bob")),
+        # Нарушение уникальности - ошибка базы внутри точки сохранения
+        _run(_add_user("alice")),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], int) and isinstance(results[2], int)
+    assert isinstance(results[1], ValueError)
+    assert isinstance(results[3], IntegrityError)
+    assert await _nicknames() == ["alice", "bob"]
+
+    after = group_commit.get_stats()
+    assert after["batches"] - before["batches"] == 1
+    assert after["operation_errors"] - before["operation_errors"] == 2
+    assert after["fallbacks"] == before["fallbacks"]
+
+
+async def test_failed_group_commit_falls_back_to_separate_transactions(grouped, monkeypatch):
+    sessions = []
+
+    # Коммит транзакции группы (первой сессии) не проходит, отдельные транзакции - проходят
+    def session_factory():
+        session = AsyncSessionLocal()
+        sessions.append(session)
+        if len(sessions) == 1:
+            async def failing_commit():
+                raise OperationalError("COMMIT", {}, Exception("connection lost"))
+            session.commit = failing_commit
+        return session
+
+    monkeypatch.setattr(group_commit, "AsyncSessionLocal", session_factory)
+    before = group_commit.get_stats()
+    results = await asyncio.gather(
+        _run(_add_user("alice")),
+        _run(_add_user("broken", fail=True)),
+        _run(_add_user("bob")),
+        return_exceptions=True,
+    )
+
+    assert isinstance(results[0], int) and isinstance(results[2], int)
+    assert isinstance(results[1], ValueError)
+    # Каждое изменение применено ровно один раз
+    assert await _nicknames() == ["alice", "bob"]
+    assert len(sessions) == 1 + 3
+
+    after = group_commit.get_stats()
+    assert after["fallbacks"] - before["fallbacks"] == 1
+    assert after["batches"] == before["batches"]
+
+
+async def test_disabled_group_commit_uses_request_session():
+    assert not group_commit.GROUP_COMMIT_ENABLED
+    async with AsyncSessionLocal() as db:
+        user_id = await group_commit.run_in_transaction(db, _add_user("alice"))
+        assert (await db.get(User, user_id)).nickname == "alice"
+    assert group_commit.get_stats()["queued"] == 0
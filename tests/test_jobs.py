@@ -0,0 +1,157 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import select, update
+import jobs
+from database import AsyncSessionLocal
+from models.job import Job, JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    registry = dict(jobs.JOB_HANDLERS)
+    monkeypatch.setattr(jobs, "JOB_HANDLERS", registry)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_SECONDS", 0.05)
+    return registry
+
+
+async def _enqueue(kind: str, params: dict = None) -> Job:
+    async with AsyncSessionLocal() as db:
+        return await jobs.enqueue_job(db, kind, params)
+
+
+async def _job(job_id: int) -> Job:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(Job).where(Job.id == job_id))).scalar_one()
+
+
+async def _set_job(job_id: int, **values):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Job).where(Job.id == job_id).values(**values))
+        await db.commit()
+
+
+async def test_enqueue_dedupes_active_jobs(handlers):
+    handlers["noop"] = handlers["reconcile_counters"]
+    jobs_ = await asyncio.gather(*(_enqueue("noop", {"a": 1, "b": 2}) for _ in range(5)))
+    assert len({job.id for job in jobs_}) == 1
+    # Порядок ключей не важен, другие параметры - другое задание
+    assert (await _enqueue("noop", {"b": 2, "a": 1})).id == jobs_[0].id
+    assert (await _enqueue("noop", {"a": 2})).id != jobs_[0].id
+
+    # Завершенное задание не мешает поставить такое же снова
+    await _set_job(jobs_[0].id, status=JOB_COMPLETED)
+    assert (await _enqueue("noop", {"a": 1, "b": 2})).id != jobs_[0].id
+
+
+async def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        await _enqueue("no_such_job")
+
+
+async def test_claim_and_run_to_completion(handlers):
+    async def work(params, progress):
+        progress["done"] = params["n"]
+
+    handlers["work"] = work
+    job = await _enqueue("work", {"n": 3})
+    claimed = await jobs.claim_job()
+    assert claimed.id == job.id and claimed.status == JOB_RUNNING and claimed.attempts == 1
+    # Выполняющееся задание второй раз не забирается
+    assert await jobs.claim_job() is None
+
+    await jobs.run_claimed_job(claimed)
+    finished = await _job(job.id)
+    assert finished.status == JOB_COMPLETED
+    assert finished.progress["done"] == 3 and finished.finished_at is not None
+
+
+async def test_failed_handler_marks_job_failed(handlers):
+    async def broken(params, progress):
+        raise ValueError("boom")
+
+    handlers["broken"] = broken
+    await _enqueue("broken")
+    job = await jobs.claim_job()
+    await jobs.run_claimed_job(job)
+    failed = await _job(job.id)
+    assert failed.status == JOB_FAILED and "boom" in failed.error
+
+
+async def test_cancel_queued_and_running_jobs(handlers):
+    started = asyncio.Event()
+
+    async def slow(params, progress):
+        started.set()
+        await asyncio.sleep(10)
+
+    handlers["slow"] = slow
+    queued = await _enqueue("slow", {"n": 1})
+    async with AsyncSessionLocal() as db:
+        assert (await jobs.cancel_job(db, queued.id)).status == JOB_CANCELLED
+    assert await jobs.claim_job() is None
+
+    running = await _enqueue("slow", {"n": 2})
+    job = await jobs.claim_job()
+    task = asyncio.create_task(jobs.run_claimed_job(job))
+    await started.wait()
+    async with AsyncSessionLocal() as db:
+        assert (await jobs.cancel_job(db, running.id)).cancel_requested
+    # Воркер замечает отмену при следующей отметке
+    await asyncio.wait_for(task, timeout=2)
+    assert (await _job(running.id)).status == JOB_CANCELLED
+
+
+async def test_stale_jobs_are_requeued_then_failed(handlers, monkeypatch):
+    handlers["noop"] = handlers["reconcile_counters"]
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    stale = datetime.now(timezone.utc) - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)
+
+    job = await _enqueue("noop")
+    await jobs.claim_job()
+    await _set_job(job.id, heartbeat_at=stale)
+    assert await jobs.requeue_stale_jobs() == 1
+    requeued = await _job(job.id)
+    assert requeued.status == JOB_QUEUED and requeued.worker is None
+
+    await jobs.claim_job()
+    await _set_job(job.id, heartbeat_at=stale)
+    await jobs.requeue_stale_jobs()
+    assert (await _job(job.id)).status == JOB_FAILED
+
+
+async def test_cancelled_job_is_not_rerun_after_worker_loss(handlers):
+    handlers["noop"] = handlers["reconcile_counters"]
+    stale = datetime.now(timezone.utc) - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)
+    job = await _enqueue("noop")
+    await jobs.claim_job()
+    await _set_job(job.id, cancel_requested=True, heartbeat_at=stale)
+
+    assert await jobs.requeue_stale_jobs() == 0
+    assert (await _job(job.id)).status == JOB_CANCELLED
+    assert await jobs.claim_job() is None
+
+
+async def test_shutdown_requeues_job_unless_cancel_requested(handlers):
+    started = asyncio.Event()
+
+    async def slow(params, progress):
+        started.set()
+        await asyncio.sleep(10)
+
+    handlers["slow"] = slow
+    for cancel_requested, expected in ((False, JOB_QUEUED), (True, JOB_CANCELLED)):
+        started.clear()
+        await _enqueue("slow", {"cancel": cancel_requested})
+        job = await jobs.claim_job()
+        task = asyncio.create_task(jobs.run_claimed_job(job))
+        await started.wait()
+        if cancel_requested:
+            await _set_job(job.id, cancel_requested=True)
+        # Остановка приложения отменяет воркер раньше, чем он заметит флаг
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert (await _job(job.id)).status == expected
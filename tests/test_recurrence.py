@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import pytest
+from recurrence import parse_rule, normalize_rule, _iter_schedule, iter_occurrences
+
+
+def _at(year, month, day, hour=9):
+    return datetime(year, month, day, hour, tzinfo=timezone.utc)
+
+
+def _schedule(rule: str, anchor: datetime, after: datetime, limit: int):
+    return list(islice(_iter_schedule(parse_rule(rule), anchor, after), limit))
+
+
+def _occurrences(rule: str, anchor: datetime, after: datetime = None, limit: int = 50):
+    return list(islice(iter_occurrences(parse_rule(rule), anchor, after or anchor), limit))
+
+
+def test_monthly_on_31st_clamps_to_month_end():
+    anchor = _at(2026, 1, 31)
+    assert _occurrences("FREQ=MONTHLY", anchor, limit=4) == [
+        _at(2026, 2, 28), _at(2026, 3, 31), _at(2026, 4, 30), _at(2026, 5, 31),
+    ]
+    # Високосный год и переход через декабрь
+    assert _occurrences("FREQ=MONTHLY;INTERVAL=13", _at(2027, 1, 31), limit=1) == [_at(2028, 2, 29)]
+
+
+def test_monthly_resumes_with_same_numbers_after_short_month():
+    anchor = _at(2026, 1, 31)
+    full = _schedule("FREQ=MONTHLY", anchor, anchor, 6)
+    # Продолжение с 28 февраля не теряет и не сдвигает 31 марта
+    resumed = [item for item in _schedule("FREQ=MONTHLY", anchor, _at(2026, 2, 28), 6) if item[1] > _at(2026, 2, 28)]
+    assert resumed[:4] == full[1:5]
+    assert resumed[0] == (2, _at(2026, 3, 31))
+
+
+def test_weekly_byday_first_week_only_after_anchor():
+    # Среда; в первой неделе - только пятница, понедельник уже прошел
+    anchor = _at(2026, 1, 7)
+    assert _schedule("FREQ=WEEKLY;BYDAY=MO,WE,FR", anchor, anchor, 4) == [
+        (1, _at(2026, 1, 9)), (2, _at(2026, 1, 12)), (3, _at(2026, 1, 14)), (4, _at(2026, 1, 16)),
+    ]
+    # Ни одного дня после исходной задачи в первой неделе
+    assert _schedule("FREQ=WEEKLY;BYDAY=MO", anchor, anchor, 2) == [(1, _at(2026, 1, 12)), (2, _at(2026, 1, 19))]
+
+
+def test_weekly_byday_numbers_are_stable_for_any_after():
+    anchor = _at(2026, 1, 7)
+    rule = "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,FR"
+    full = dict(_schedule(rule, anchor, anchor, 20))
+    for after in (_at(2026, 1, 20), _at(2026, 2, 3, 12), _at(2026, 3, 1)):
+        for index, occurrence_at in _schedule(rule, anchor, after, 4):
+            assert full[index] == occurrence_at
+
+
+def test_count_includes_the_original_task():
+    anchor = _at(2026, 1, 7)
+    assert _occurrences("FREQ=DAILY;COUNT=3", anchor) == [_at(2026, 1, 8), _at(2026, 1, 9)]
+    assert _occurrences("FREQ=WEEKLY;BYDAY=MO,FR;COUNT=4", anchor) == [_at(2026, 1, 9), _at(2026, 1, 12), _at(2026, 1, 16)]
+    # Счет ведется от исходной задачи, а не от after
+    assert _occurrences("FREQ=DAILY;COUNT=3", anchor, after=_at(2026, 1, 8)) == [_at(2026, 1, 9)]
+    assert _occurrences("FREQ=DAILY;COUNT=1", anchor) == []
+
+
+def test_until_is_inclusive():
+    anchor = _at(2026, 1, 7)
+    assert _occurrences("FREQ=DAILY;UNTIL=20260109T090000Z", anchor) == [_at(2026, 1, 8), _at(2026, 1, 9)]
+    # Дата без времени включает весь день
+    assert _occurrences("FREQ=DAILY;UNTIL=20260109", anchor)[-1] == _at(2026, 1, 9)
+    assert _occurrences("FREQ=MONTHLY;UNTIL=20260430", _at(2026, 1, 31)) == [_at(2026, 2, 28), _at(2026, 3, 31), _at(2026, 4, 30)]
+
+
+def test_count_and_until_stop_at_whichever_is_first():
+    anchor = _at(2026, 1, 7)
+    assert len(_occurrences("FREQ=DAILY;COUNT=10;UNTIL=20260110", anchor)) == 3
+    assert len(_occurrences("FREQ=DAILY;COUNT=3;UNTIL=20260131", anchor)) == 2
+
+
+def test_normalize_rule():
+    assert normalize_rule("weekly") == "FREQ=WEEKLY"
+    assert normalize_rule("RRULE:freq=weekly;byday=fr,mo;interval=1") == "FREQ=WEEKLY;BYDAY=MO,FR"
+    assert parse_rule("FREQ=DAILY;UNTIL=20260109").until == _at(2026, 1, 10, 0) - timedelta(microseconds=1)
+    for rule in ("FREQ=YEARLY", "FREQ=MONTHLY;BYDAY=MO", "FREQ=DAILY;COUNT=0", "FREQ=WEEKLY;BYDAY=XX"):
+        with pytest.raises(ValueError):
+            parse_rule(rule)
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import select, update
+import scheduler
+from database import AsyncSessionLocal
+from models import SchedulerLease
+
+pytestmark = pytest.mark.anyio
+
+
+async def _lease(name: str) -> SchedulerLease:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(SchedulerLease).where(SchedulerLease.name == name))).scalar_one()
+
+
+async def _set_lease(name: str, **values):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(SchedulerLease).where(SchedulerLease.name == name).values(**values))
+        await db.commit()
+
+
+async def test_active_lease_is_exclusive_and_run_key_runs_once():
+    assert await scheduler.acquire_lease("job", "2026-01-01T03:00")
+    # Аренду держит этот воркер - второй запуск того же ключа ее не получает
+    assert not await scheduler.acquire_lease("job", "2026-01-01T03:00")
+
+    await scheduler.release_lease("job")
+    # Завершенный запуск не повторяется, следующий - выполняется
+    assert not await scheduler.acquire_lease("job", "2026-01-01T03:00")
+    assert await scheduler.acquire_lease("job", "2026-01-01T04:00")
+
+
+async def test_expired_lease_is_taken_over(monkeypatch):
+    monkeypatch.setattr(scheduler, "WORKER_ID", "worker-a")
+    assert await scheduler.acquire_lease("job", "key")
+    await _set_lease("job", expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+    monkeypatch.setattr(scheduler, "WORKER_ID", "worker-b")
+    assert await scheduler.acquire_lease("job", "key")
+    assert (await _lease("job")).owner == "worker-b"
+
+    # Прежний владелец больше не может ее продлить
+    monkeypatch.setattr(scheduler, "WORKER_ID", "worker-a")
+    assert not await scheduler.renew_lease("job")
+
+
+async def test_renewal_keeps_long_job_alive(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_LEASE_SECONDS", 0.3)
+    ran = []
+
+    async def run():
+        await asyncio.sleep(0.8)
+        ran.append(True)
+
+    assert await scheduler.run_with_lease("job", "key", run)
+    assert ran == [True]
+    lease = await _lease("job")
+    assert lease.completed and lease.run_key == "key"
+
+
+async def test_job_is_cancelled_when_lease_is_stolen(monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_LEASE_SECONDS", 0.3)
+    finished = []
+
+    async def run():
+        await asyncio.sleep(0.05)
+        await _set_lease("job", owner="other-worker")
+        await asyncio.sleep(1)
+        finished.append(True)
+
+    with pytest.raises(RuntimeError):
+        await scheduler.run_with_lease("job", "key", run)
+    assert finished == []
+    # Чужая аренда не освобождается
+    lease = await _lease("job")
+    assert lease.owner == "other-worker" and not lease.completed
+
+
+async def test_run_key_is_the_scheduled_fire_time():
+    from apscheduler.triggers.cron import CronTrigger
+
+    trigger = CronTrigger(hour=3, minute=0, timezone=timezone.utc)
+    late = datetime(2026, 1, 1, 3, 0, 59, tzinfo=timezone.utc)
+    assert scheduler._scheduled_run_time(trigger, late) == datetime(2026, 1, 1, 3, 0, tzinfo=timezone.utc)
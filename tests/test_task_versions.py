@@ -0,0 +1,130 @@
+import httpx
+import pytest
+from sqlalchemy import select, update
+import main
+from auth_utils import create_access_token
+from database import AsyncSessionLocal
+from models import Task, User, UserRole
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def headers():
+    async with AsyncSessionLocal() as db:
+        user = User(nickname="alice", email="alice@example.com", hashed_password="-", role=UserRole.USER)
+        db.add(user)
+        await db.commit()
+        token = create_access_token(data={"sub": str(user.id), "role": user.role.value})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+async def task_id(client, headers):
+    response = await client.post("/api/v3/tasks/", json={"title": "write tests", "is_important": True}, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+async def _version(task_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(Task.version).where(Task.id == task_id))).scalar_one()
+
+
+async def test_etag_follows_version(client, headers, task_id):
+    response = await client.get(f"/api/v3/tasks/{task_id}", headers=headers)
+    etag = response.headers["ETag"]
+    assert etag == f'"{await _version(task_id)}"'
+
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "renamed"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+    assert response.headers["ETag"] == f'"{await _version(task_id)}"'
+
+
+async def test_stale_if_match_is_412(client, headers, task_id):
+    etag = (await client.get(f"/api/v3/tasks/{task_id}", headers=headers)).headers["ETag"]
+    await client.put(f"/api/v3/tasks/{task_id}", json={"title": "first"}, headers={**headers, "If-Match": etag})
+
+    # Второй клиент прочитал задачу до первого изменения
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "second"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    assert response.headers["ETag"] == f'"{await _version(task_id)}"'
+    response = await client.patch(f"/api/v3/tasks/{task_id}/complete", headers={**headers, "If-Match": f"W/{etag}"})
+    assert response.status_code == 412
+
+    task = (await client.get(f"/api/v3/tasks/{task_id}", headers=headers)).json()
+    assert task["title"] == "first" and not task["completed"]
+
+
+async def test_stale_body_version_is_409(client, headers, task_id):
+    version = await _version(task_id)
+    await client.put(f"/api/v3/tasks/{task_id}", json={"title": "first"}, headers=headers)
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "second", "version": version}, headers=headers)
+    assert response.status_code == 409
+    assert response.headers["ETag"] == f'"{version + 1}"'
+
+
+async def test_if_match_wildcard_and_malformed(client, headers, task_id):
+    response = await client.patch(f"/api/v3/tasks/{task_id}/complete", headers={**headers, "If-Match": "*"})
+    assert response.status_code == 200 and response.json()["completed"]
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "renamed"}, headers={**headers, "If-Match": '"abc"'})
+    assert response.status_code == 412
+
+
+async def test_updates_without_version_are_not_lost(client, headers, task_id):
+    version = await _version(task_id)
+    await client.put(f"/api/v3/tasks/{task_id}", json={"title": "renamed"}, headers=headers)
+    await client.patch(f"/api/v3/tasks/{task_id}/complete", headers=headers)
+
+    task = (await client.get(f"/api/v3/tasks/{task_id}", headers=headers)).json()
+    assert task["title"] == "renamed" and task["completed"]
+    assert await _version(task_id) == version + 2
+
+
+
+@pytest.fixture
+def concurrent_write(monkeypatch, task_id):
+    import routers.tasks
+
+    read = routers.tasks.get_task_for_update
+    reads = []
+
+    # Другой запрос меняет задачу между чтением и UPDATE ... WHERE version
+    async def read_then_race(db, task_id, current_user):
+        task = await read(db, task_id, current_user)
+        reads.append(task.version)
+        if len(reads) == 1:
+            async with AsyncSessionLocal() as other:
+                await other.execute(update(Task).where(Task.id == task_id).values(description="other", version=Task.version + 1))
+                await other.commit()
+        return task
+
+    monkeypatch.setattr(routers.tasks, "get_task_for_update", read_then_race)
+    return reads
+
+
+async def test_concurrent_write_with_if_match_is_412(client, headers, task_id, concurrent_write):
+    version = await _version(task_id)
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "mine"}, headers={**headers, "If-Match": f'"{version}"'})
+    assert response.status_code == 412
+    assert response.headers["ETag"] == f'"{version + 1}"'
+    task = (await client.get(f"/api/v3/tasks/{task_id}", headers=headers)).json()
+    assert task["title"] == "write tests" and task["description"] == "other"
+
+
+async def test_concurrent_write_without_version_is_retried(client, headers, task_id, concurrent_write):
+    version = await _version(task_id)
+    response = await client.put(f"/api/v3/tasks/{task_id}", json={"title": "mine"}, headers=headers)
+    assert response.status_code == 200, response.text
+    # Изменение применено к перечитанной задаче, чужое изменение сохранилось
+    assert concurrent_write == [version, version + 1]
+    task = response.json()
+    assert task["title"] == "mine" and task["description"] == "other"
+    assert response.headers["ETag"] == f'"{version + 2}"'
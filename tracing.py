@@ -0,0 +1,385 @@
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import event
+from slow_queries import normalize_sql
+
+load_dotenv()
+# Трассировка запросов API; выключенная не добавляет обработчиков и почти ничего не стоит
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# Доля запросов, которые трассируются
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# true - запрос с traceparent и флагом sampled трассируется всегда. Только если API доступен лишь
+# доверенным сервисам: иначе любой клиент включает трассировку каждого своего запроса.
+TRACE_TRUST_REMOTE_SAMPLED = os.getenv("TRACE_TRUST_REMOTE_SAMPLED", "false").lower() == "true"
+# Сколько последних трасс хранится в памяти процесса (GET /admin/traces)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+# Файл JSON Lines, куда дописываются трассы ("" - не писать)
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+# Как часто фоновый поток сбрасывает файл трасс на диск
+TRACE_FILE_FLUSH_SECONDS = float(os.getenv("TRACE_FILE_FLUSH_SECONDS", "1"))
+# Сколько трасс ждет записи в файл; при переполнении (диск не успевает) новые трассы в файл не попадают
+TRACE_FILE_QUEUE_SIZE = int(os.getenv("TRACE_FILE_QUEUE_SIZE", "10000"))
+# Больше спанов в одной трассе не сохраняется (запрос с тысячами SQL-запросов)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "1000"))
+
+# W3C Trace Context: версия-trace_id-parent_id-флаги
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Trace:
+    __slots__ = ("trace_id", "remote_parent_id", "spans", "dropped_spans", "finished")
+
+    def __init__(self, trace_id: str, remote_parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.remote_parent_id = remote_parent_id
+        self.spans = []
+        self.dropped_spans = 0
+        self.finished = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "started", "duration_ms", "error", "token")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        trace = self.trace
+        if trace.finished:
+            # Фоновая задача, запущенная запросом, закончилась позже него
+            return
+        if len(trace.spans) >= TRACE_MAX_SPANS:
+            trace.dropped_spans += 1
+            return
+        trace.spans.append(self)
+
+    def __enter__(self):
+        self.token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.finish()
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start, timezone.utc).isoformat(),
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+# Заглушка, когда запрос не трассируется: with span(...) ничего не делает
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+# Спан фазы обработки запроса: with span("auth.decode_token"): ...
+def span(name: str, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    parent = _current_span.get()
+    return Span(trace, name, parent.span_id if parent is not None else trace.remote_parent_id, attributes)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    # (trace_id, parent_id, sampled) или None, если заголовок некорректен
+    if not value:
+        return None
+    match = _TRACEPARENT.match(value.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+
+# Экспорт: in-memory кольцевой буфер и файл JSON Lines; свой экспортер подключается через add_exporter
+class RingBufferExporter:
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self.traces = deque(maxlen=size)
+
+    def export(self, trace: dict):
+        self.traces.append(trace)
+
+    def close(self):
+        pass
+
+
+# Запись в файл - в фоновом потоке: export() вызывается в цикле событий и только кладет трассу в очередь
+class JsonLinesExporter:
+    def __init__(self, path: str, flush_seconds: float = TRACE_FILE_FLUSH_SECONDS,
+                 queue_size: int = TRACE_FILE_QUEUE_SIZE):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: dict):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        # Буферизованная запись: на диск попадают блоки, а не каждая трасса, но не реже flush_seconds
+        with open(self.path, "a", encoding="utf-8") as file:
+            next_flush = time.monotonic() + self.flush_seconds
+            while True:
+                try:
+                    trace = self._queue.get(timeout=max(next_flush - time.monotonic(), 0.0))
+                except queue.Empty:
+                    pass
+                else:
+                    if trace is None:
+                        return
+                    try:
+                        file.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+                    except Exception as e:
+                        print(f"Ошибка записи трассы в {self.path}: {type(e).__name__}: {e}")
+                if time.monotonic() >= next_flush:
+                    file.flush()
+                    next_flush = time.monotonic() + self.flush_seconds
+
+    # Остановка: трассы, уже стоящие в очереди, дописываются в файл
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+ring_buffer = RingBufferExporter()
+_exporters: list = [ring_buffer]
+if TRACE_FILE:
+    _exporters.append(JsonLinesExporter(TRACE_FILE))
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+
+
+def set_exporters(exporters: list):
+    global _exporters
+    _exporters = list(exporters)
+
+
+def close_exporters():
+    for exporter in _exporters:
+        exporter.close()
+
+
+# Время по фазам: спаны одного вида суммируются (db.query x 12 -> одна строка)
+def _phases(spans: List[Span], root: Span) -> dict:
+    phases = {}
+    children_ms = 0.0
+    for item in spans:
+        if item is root:
+            continue
+        phase = phases.setdefault(item.name, {"count": 0, "total_ms": 0.0})
+        phase["count"] += 1
+        phase["total_ms"] += item.duration_ms
+        if item.parent_id == root.span_id:
+            children_ms += item.duration_ms
+    for phase in phases.values():
+        phase["total_ms"] = round(phase["total_ms"], 3)
+    # Время самого запроса вне фаз: роутинг, валидация, JSON-ответ FastAPI, сжатие
+    phases["self"] = {"count": 1, "total_ms": round(max(root.duration_ms - children_ms, 0.0), 3)}
+    return phases
+
+
+def _export(trace: Trace, root: Span):
+    trace.finished = True
+    data = {
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "start": datetime.fromtimestamp(root.start, timezone.utc).isoformat(),
+        "duration_ms": round(root.duration_ms, 3),
+        "attributes": root.attributes,
+        "error": root.error,
+        "phases": _phases(trace.spans, root),
+        "dropped_spans": trace.dropped_spans,
+        "spans": [item.to_dict() for item in trace.spans],
+    }
+    for exporter in _exporters:
+        try:
+            exporter.export(data)
+        except Exception as e:
+            print(f"Ошибка экспорта трассы {trace.trace_id}: {type(e).__name__}: {e}")
+
+
+# Спан на каждый SQL-запрос трассируемого запроса; у нетрассируемых - одна проверка contextvar
+def install(async_engine):
+    if not TRACING_ENABLED:
+        return
+    sync_engine = async_engine.sync_engine
+    database = async_engine.url.get_backend_name()
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            context._trace_span = span(
+                "db.query",
+                database=database,
+                statement=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "",
+                executemany=executemany,
+            )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        db_span = getattr(context, "_trace_span", None)
+        if db_span is not None:
+            db_span.set(sql=normalize_sql(statement)[:500], rows=cursor.rowcount)
+            db_span.finish()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _on_error(context):
+        db_span = getattr(context.execution_context, "_trace_span", None)
+        if db_span is not None:
+            db_span.error = f"{type(context.original_exception).__name__}: {context.original_exception}"
+            db_span.finish()
+
+
+# ASGI-обертка: корневой спан запроса, traceparent во входящем и исходящем заголовках
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                parent = parse_traceparent(value.decode("latin-1"))
+                break
+        if parent is not None:
+            trace_id, remote_parent_id, sampled = parent
+        else:
+            trace_id, remote_parent_id, sampled = os.urandom(16).hex(), None, False
+        # Флаг sampled вызывающего учитывается только по TRACE_TRUST_REMOTE_SAMPLED, иначе решает TRACE_SAMPLE_RATE
+        sampled = (sampled and TRACE_TRUST_REMOTE_SAMPLED) or random.random() < TRACE_SAMPLE_RATE
+
+        if not sampled:
+            # Идентификатор трассы все равно отдается клиенту - для сопоставления с его логами
+            traceparent = format_traceparent(trace_id, os.urandom(8).hex(), False).encode()
+            await self.app(scope, receive, _with_header(send, traceparent))
+            return
+
+        trace = Trace(trace_id, remote_parent_id)
+        root = Span(trace, f"{scope['method']} {scope['path']}", remote_parent_id, {"http.path": scope["path"]})
+        traceparent = format_traceparent(trace_id, root.span_id, True).encode()
+        status = {}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, _with_header(send_with_status, traceparent))
+        except Exception as exc:
+            root.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            # Шаблон маршрута (/tasks/{task_id}) появляется в scope после роутинга
+            route = getattr(scope.get("route"), "path", None)
+            if route is not None:
+                root.name = f"{scope['method']} {route}"
+            root.set(**{"http.status_code": status.get("code")})
+            root.finish()
+            _export(trace, root)
+
+
+def _with_header(send, traceparent: bytes):
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            message["headers"] = list(message.get("headers", [])) + [(b"traceparent", traceparent)]
+        await send(message)
+    return wrapped
+
+
+def get_traces(limit: int = 50, min_duration_ms: float = 0.0, name: Optional[str] = None) -> list:
+    traces = []
+    for trace in reversed(ring_buffer.traces):
+        if trace["duration_ms"] < min_duration_ms or (name and name not in trace["name"]):
+            continue
+        summary = {key: value for key, value in trace.items() if key != "spans"}
+        summary["spans"] = len(trace["spans"])
+        traces.append(summary)
+        if len(traces) >= limit:
+            break
+    return traces
+
+
+def get_trace(trace_id: str) -> Optional[dict]:
+    for trace in reversed(ring_buffer.traces):
+        if trace["trace_id"] == trace_id:
+            return trace
+    return None
@@ -0,0 +1,76 @@
+import os
+from typing import Optional
+from sqlalchemy import select, delete, update, tuple_
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models.task import Task, TaskArchive
+from models.user import User
+from models.task_tag import TaskTag
+
+load_dotenv()
+# Сколько задач удаляется за одну транзакцию
+USER_PURGE_CHUNK_SIZE = int(os.getenv("USER_PURGE_CHUNK_SIZE", "1000"))
+
+
+# Задачи удаляются пачками, прогресс пишется в stats (задание jobs.purge_user).
+# Повторный запуск продолжает с того места, где удаление остановилось.
+async def purge_user(user_id: int, chunk_size: int = USER_PURGE_CHUNK_SIZE, stats: Optional[dict] = None) -> dict:
+    if stats is None:
+        stats = {}
+    stats.update(deleted_tasks=0)
+
+    async with AsyncSessionLocal() as db:
+        stats["total_tasks"] = (await db.execute(
+            select(User.tasks_count).where(User.id == user_id)
+        )).scalar_one_or_none() or 0
+
+        # Сначала основная таблица, затем архив выполненных задач
+        for model in (Task, TaskArchive):
+            while True:
+                # Удаление пачки по id, строки задач в Python не загружаются
+                chunk = (
+                    select(model.id)
+                    .where(model.user_id == user_id)
+                    .limit(chunk_size)
+                    .scalar_subquery()
+                )
+                result = await db.execute(
+                    delete(model)
+                    .where(model.id.in_(chunk))
+                    .execution_options(synchronize_session=False)
+                )
+                deleted = result.rowcount or 0
+                if deleted:
+                    await db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(tasks_count=User.tasks_count - deleted)
+                    )
+                await db.commit()
+
+                stats["deleted_tasks"] += deleted
+                if deleted < chunk_size:
+                    break
+
+        # Теги тоже пачками, чтобы не удалять их одной большой транзакцией каскадом
+        while True:
+            chunk = (
+                select(TaskTag.task_id, TaskTag.tag)
+                .where(TaskTag.user_id == user_id)
+                .limit(chunk_size)
+            )
+            result = await db.execute(
+                delete(TaskTag)
+                .where(tuple_(TaskTag.task_id, TaskTag.tag).in_(chunk))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            if (result.rowcount or 0) < chunk_size:
+                break
+
+        # Оставшееся (если есть) удалит ON DELETE CASCADE
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+
+    print(f"Пользователь {user_id} удален, задач удалено: {stats['deleted_tasks']}")
+    return stats
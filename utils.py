@@ -1,7 +1,12 @@
 from datetime import datetime, timezone
 from typing import Optional
-from models.task import Task
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.task import Task, TaskArchive
+from models.user import User
 from schemas import TaskResponse
+from tags import load_tags
+from tracing import span
 
 
 def calculate_urgency(deadline: Optional[datetime]) -> bool:
@@ -23,7 +28,7 @@ def define_quadrant(is_important: bool, is_urgent: bool) -> str:
         return "Q4"
 
 
-def prepare_task_to_response(task: Task) -> TaskResponse:
+def prepare_task_to_response(task: Task, tags: Optional[list] = None) -> TaskResponse:
     is_urgent = calculate_urgency(task.deadline_at)
     # количество дней до дедлайна
     days_until = None
@@ -42,5 +47,79 @@ def prepare_task_to_response(task: Task) -> TaskResponse:
         created_at=task.created_at,
         completed_at=task.completed_at,
         is_urgent=is_urgent,
-        days_until_deadline=days_until
+        days_until_deadline=days_until,
+        version=task.version,
+        recurrence_rule=task.recurrence_rule,
+        recurrence_parent_id=task.recurrence_parent_id,
+        occurrence_at=task.occurrence_at,
+        tags=tags or []
     )
+
+
+# Ответ для списка задач: теги всех задач загружаются одним запросом
+async def prepare_tasks_to_response(db: AsyncSession, tasks) -> list:
+    tags = await load_tags(db, [task.id for task in tasks])
+    with span("serialize.prepare_tasks", tasks=len(tasks)):
+        return [prepare_task_to_response(task, tags.get(task.id)) for task in tasks]
+
+
+# Изменяет счетчики задач пользователя в текущей транзакции
+async def adjust_task_counters(
+        db: AsyncSession,
+        user_id: int,
+        total: int = 0,
+        completed: int = 0
+):
+    if not total and not completed:
+        return
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(
+            tasks_count=User.tasks_count + total,
+            completed_tasks_count=User.completed_tasks_count + completed
+        )
+    )
+
+
+# Пересчитывает счетчики задач по tasks и tasks_archive, пачками пользователей
+async def reconcile_task_counters(db: AsyncSession, batch_size: int = 1000, stats: Optional[dict] = None) -> int:
+    # В архиве лежат только выполненные задачи
+    archived_subquery = (
+        select(func.count(TaskArchive.id))
+        .where(TaskArchive.user_id == User.id)
+        .scalar_subquery()
+    )
+    total_subquery = (
+        select(func.count(Task.id))
+        .where(Task.user_id == User.id)
+        .scalar_subquery()
+    ) + archived_subquery
+    completed_subquery = (
+        select(func.count(Task.id))
+        .where(Task.user_id == User.id, Task.completed == True)
+        .scalar_subquery()
+    ) + archived_subquery
+
+    processed = 0
+    last_id = 0
+    while True:
+        ids = (await db.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+        )).scalars().all()
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        await db.execute(
+            update(User)
+            .where(User.id.in_(ids))
+            .values(tasks_count=total_subquery, completed_tasks_count=completed_subquery)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        processed += len(ids)
+        if stats is not None:
+            stats["users"] = processed
+
+    return processed